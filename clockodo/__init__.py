@@ -16,12 +16,15 @@
 # damage or existence of a defect, except proven that it results out
 # of said person's immediate fault when using the work as intended.
 
+from clockodo import trace
 from clockodo.api import ClockodoApi
 from clockodo.clock import ClockApi
 from clockodo.service import ServiceApi
 from clockodo.project import ProjectApi
 from clockodo.customer import CustomerApi
+from clockodo.user import UserApi
 from clockodo.entry import EntryApi
+from clockodo.watch import WatchApi
 
-class Clockodo(ClockApi, EntryApi, CustomerApi, ProjectApi, ServiceApi, ClockodoApi):
+class Clockodo(ClockApi, EntryApi, CustomerApi, ProjectApi, ServiceApi, UserApi, WatchApi, ClockodoApi):
     pass
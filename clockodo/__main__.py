@@ -18,12 +18,20 @@
 
 import os
 import sys
+import time
+import subprocess
+import concurrent.futures
 import datetime
-import itertools
 import functools
 import click
-import inquirer
 import clockodo
+# Only what the decorators below need, everything else is imported by
+# the commands using it, to keep TAB presses fast
+import clockodo.completion
+import clockodo.export
+import clockodo.resilience
+import clockodo.trace
+from clockodo.api import ClockodoError
 from clockodo.interactivity import our_tz
 
 Iso8601 = click.DateTime([clockodo.entry.ISO8601_TIME_FORMAT])
@@ -61,6 +69,7 @@ class DefaultCommandGroup(click.Group):
                 DefaultCommandGroup, self).resolve_command(ctx, args)
 
 
+@clockodo.trace.traced("render", "cli")
 def clock_entry_cb(clock):
     customer = str(clock.customer)
     project = ""
@@ -89,6 +98,7 @@ Description: {clock.text}
 ---"""
 
 
+@clockodo.trace.traced("render", "cli")
 def lump_sum_cb(entry):
     project = ""
     if entry.project is not None:
@@ -97,11 +107,14 @@ def lump_sum_cb(entry):
         entry.time_since.astimezone(our_tz()),
         clockodo.entry.ISO8601_TIME_FORMAT
     )
+    # Entries with a lump sum service have no service
+    service = ""
+    if isinstance(entry, clockodo.entry.LumpSumValue):
+        service = f"\nService: {entry.service}"
     return f"""---
 {entry}
 Datetime: {time_since}
-Customer: {entry.customer}{project}
-Service: {entry.service}
+Customer: {entry.customer}{project}{service}
 Description: {entry.text}
 ---"""
 
@@ -109,9 +122,60 @@ Description: {entry.text}
 @click.group()
 @click.option('--user', envvar='CLOCKODO_API_USER', show_envvar=True)
 @click.option('--token', envvar='CLOCKODO_API_TOKEN', show_envvar=True)
+@click.option('--timeout', default=10.0, show_default=True,
+              help="Give up on an API call after this many seconds")
+@click.option('--hedge/--no-hedge', envvar='CLOCKODO_HEDGE', show_envvar=True, default=False,
+              help="Send slow GET requests a second time, for long-running commands")
+@click.option('--queue/--no-queue', envvar='CLOCKODO_QUEUE', show_envvar=True, default=False,
+              help="Record clock start/stop/edit locally and send them in the background")
+@click.option('--trace', type=click.Path(dir_okay=False, writable=True), default=None,
+              help="Write a timeline of the run to this file, for chrome://tracing or ui.perfetto.dev")
+@click.option('--cache', envvar='CLOCKODO_CACHE', show_envvar=True, default=None,
+              help="Share cached customers, projects, services and the clock, e.g. redis://host:6379/0")
+@click.option('--cache-namespace', envvar='CLOCKODO_CACHE_NAMESPACE', show_envvar=True, default=None,
+              help="Name of the clocko:do account, to share --cache with its other users")
 @click.pass_context
-def cli(ctx, user, token):
-    ctx.obj = clockodo.Clockodo(user, token)
+def cli(ctx, user, token, timeout, hedge, queue, trace, cache, cache_namespace):
+    if trace is not None:
+        tracer = ctx.with_resource(clockodo.trace.tracing(trace))
+        tracer.add("import", "startup", clockodo.trace.IMPORTED_AT, time.perf_counter())
+        # Not the whole command line, it may contain the token
+        ctx.with_resource(clockodo.trace.span(f"clockodo {ctx.invoked_subcommand}", "cli"))
+    shared = None
+    if cache is not None and user is not None:
+        from clockodo.cache import SharedCache, backend_from_url, user_hash
+        # Without the account's name only this user's processes share
+        if cache_namespace is None:
+            cache_namespace = "user-" + user_hash(user)
+        shared = SharedCache(backend_from_url(cache), namespace=cache_namespace)
+    ctx.obj = ctx.with_resource(clockodo.Clockodo(
+        user, token, timeout=timeout, hedge=hedge, breaker=clockodo.resilience.CircuitBreaker(),
+        cache=shared
+    ))
+    if queue:
+        from clockodo.wal import WriteAheadLog
+        ctx.meta["clockodo.wal"] = WriteAheadLog()
+
+
+def get_queue():
+    """The write-ahead log if `--queue` was given, otherwise None."""
+    return click.get_current_context().meta.get("clockodo.wal")
+
+
+def flush_in_background(api):
+    """Send queued clock operations from a detached process, so the
+    command can return right away."""
+    env = dict(os.environ)
+    if api.user is not None:
+        env["CLOCKODO_API_USER"] = api.user
+    if api.token is not None:
+        env["CLOCKODO_API_TOKEN"] = api.token
+    subprocess.Popen(
+        [sys.executable, "-m", "clockodo", "wal", "flush", "--quiet"],
+        env=env,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
 
 
 @cli.group(cls=DefaultCommandGroup, invoke_without_command=True)
@@ -134,12 +198,23 @@ def current_clock(api):
 @clock.command(name="stop")
 @click.pass_obj
 def stop_clock(api):
+    queue = get_queue()
+    if queue is not None:
+        try:
+            op = queue.stop(api=api)
+        except ClockodoError as e:
+            click.echo(f"Can't queue stopping the clock: {e.msg}", err=True)
+            sys.exit(1)
+        flush_in_background(api)
+        click.echo(f"Stopped at {op['at']} (queued)")
+        return
     clock = api.current_clock().stop()
     click.echo("Finished: {}".format(str(clock)))
 
 
 @clock.command(name="continue")
-@click.option("--clock-id", type=int, required=False)
+@click.option("--clock-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("entry"))
 @click.pass_obj
 def continue_last_clock(api, clock_id):
     current_clock = api.current_clock()
@@ -160,10 +235,10 @@ def continue_last_clock(api, clock_id):
         )
 
         # Get the last clock entry for this period
-        *_, last = filter(
+        last = next(filter(
             lambda i: isinstance(i, clockodo.entry.ClockEntry),
-            api.iter_entries(time_since, time_until)
-        )
+            api.iter_entries_reverse(time_since, time_until)
+        ), None)
 
         if last is None:
             click.echo("No entries clocked today. Use `clockodo clock create` to clock in interactively.", err=True)
@@ -183,14 +258,17 @@ def continue_last_clock(api, clock_id):
 @clock.command(name="create")
 @click.pass_obj
 def create_clock_interactive(api):
-    from clockodo.interactivity import inject_api, memoize_once, project_entries, customer_entries, service_entries, validate_timestamp, get_last_clock_out_time
+    # Only needed here, and slow to import on every TAB press
+    import inquirer
+    from clockodo.interactivity import Prefetcher, validate_timestamp
+    prefetch = Prefetcher(api, last_clock_out=False)
 
     questions = [
         inquirer.List("customer", message="Customer",
-                      choices=inject_api(customer_entries, api)),
-        inquirer.List("project", message="Project", choices=inject_api(project_entries, api)),
+                      choices=prefetch.customer_entries),
+        inquirer.List("project", message="Project", choices=prefetch.project_entries),
         inquirer.List("service", message="Service",
-                      choices=inject_api(service_entries, api)),
+                      choices=prefetch.service_entries),
         inquirer.Confirm("set_time_since", message="Set start time for clock manually?"),
         inquirer.Text("time_since", message="Started at [HH:MM:SS]",
                       default=datetime.datetime.now(tz=our_tz()).strftime("%H:%M:%S"),
@@ -204,6 +282,7 @@ def create_clock_interactive(api):
     ]
 
     answers = inquirer.prompt(questions)
+    prefetch.close()
     if answers is None:
         exit(1)
     if answers["set_time_since"]:
@@ -217,26 +296,57 @@ def create_clock_interactive(api):
     entry = clockodo.entry.ClockEntry(api, **answers)
     print(clock_entry_cb(entry))
     if inquirer.confirm("Start clock?", default=True):
-        current = api.current_clock()
-        if current is not None:
-            current.stop()
-        entry = entry.start()
+        stopped, entry = api.switch_clock(entry, time=entry.time_since)
+        if stopped is not None:
+            print("Finished:", stopped)
         print("Clock started, ID:", entry.id)
 
 
-@clock.command(name="new")
-@click.option("--customer", type=str, required=False)
-@click.option("--customer-id", type=int, required=False)
-@click.option("--project", type=str, required=False)
-@click.option("--project-id", type=int, required=False)
-@click.option("--service", type=str, required=False)
-@click.option("--service-id", type=int, required=False)
-@click.option("--billable", type=bool, required=False, default=None)
-@click.argument("text", type=str)
-@click.pass_obj
-def new_clock(api, customer, customer_id, project, project_id, service, service_id, text, billable):
+def queue_start(api, queue, *args, **kwargs):
+    try:
+        op = queue.start(*args, **kwargs)
+    except ClockodoError as e:
+        click.echo(f"Can't queue starting a clock: {e.msg}", err=True)
+        sys.exit(1)
+    flush_in_background(api)
+    click.echo(f"Started at {op['at']} (queued)")
+
+
+def new_clock_options(f):
+    """Options describing the task of a new clock."""
+    for option in reversed([
+        click.option("--customer", type=str, required=False,
+                     shell_complete=clockodo.completion.complete_names("customer")),
+        click.option("--customer-id", type=int, required=False,
+                     shell_complete=clockodo.completion.complete_ids("customer")),
+        click.option("--project", type=str, required=False,
+                     shell_complete=clockodo.completion.complete_names("project")),
+        click.option("--project-id", type=int, required=False,
+                     shell_complete=clockodo.completion.complete_ids("project")),
+        click.option("--service", type=str, required=False,
+                     shell_complete=clockodo.completion.complete_names("service")),
+        click.option("--service-id", type=int, required=False,
+                     shell_complete=clockodo.completion.complete_ids("service")),
+        click.option("--billable", type=bool, required=False, default=None),
+        click.argument("text", type=str),
+    ]):
+        f = option(f)
+    return f
+
+
+def resolve_entities(api, customer, customer_id, project, project_id, service, service_id):
+    """Look up the customer, project and service given by name or ID."""
+    # Lookups by ID don't depend on each other, so send them together
+    with concurrent.futures.ThreadPoolExecutor(3) as pool:
+        if customer_id is not None:
+            customer_id = pool.submit(api.get_customer, customer_id)
+        if project_id is not None:
+            project_id = pool.submit(api.get_project, project_id)
+        if service_id is not None:
+            service_id = pool.submit(api.get_service, service_id)
+
     if customer_id is not None:
-        customer = api.get_customer(customer_id)
+        customer = customer_id.result()
     elif customer is not None:
         with click.progressbar(api.iter_customers(), label="Determining customer") as bar:
             for c in bar:
@@ -251,7 +361,7 @@ def new_clock(api, customer, customer_id, project, project_id, service, service_
         exit(1)
 
     if project_id is not None:
-        project = api.get_project(project)
+        project = project_id.result()
     elif project is not None:
         with click.progressbar(api.iter_projects(), label="Determining project") as bar:
             for p in bar:
@@ -259,13 +369,13 @@ def new_clock(api, customer, customer_id, project, project_id, service, service_
                     project = p
                     break
             else:
-                click.echo("Can't find a project named", project, err=True)
+                click.echo(f"Can't find a project named {project}", err=True)
                 exit(1)
     else:
         project = None
 
     if service_id is not None:
-        service = api.get_service(service_id)
+        service = service_id.result()
     elif service is not None:
         with click.progressbar(api.iter_services(), label="Determining service") as bar:
             for s in bar:
@@ -283,6 +393,28 @@ def new_clock(api, customer, customer_id, project, project_id, service, service_
     assert isinstance(service, clockodo.service.Service)
     assert project is None or isinstance(project, clockodo.project.Project)
 
+    return customer, project, service
+
+
+@clock.command(name="new")
+@new_clock_options
+@click.pass_obj
+def new_clock(api, customer, customer_id, project, project_id, service, service_id, text, billable):
+    queue = get_queue()
+    if queue is not None and customer_id is not None and service_id is not None and project is None:
+        # Nothing to look up, so the network isn't needed at all
+        queue_start(api, queue, customer_id, service_id, text, projects_id=project_id, billable=billable)
+        return
+
+    customer, project, service = resolve_entities(
+        api, customer, customer_id, project, project_id, service, service_id
+    )
+
+    if queue is not None:
+        queue_start(api, queue, customer.id, service.id, text,
+                    projects_id=project.id if project is not None else None, billable=billable)
+        return
+
     clock = clockodo.clock.ClockEntry(
         api=api,
         customer=customer,
@@ -294,60 +426,191 @@ def new_clock(api, customer, customer_id, project, project_id, service, service_
     click.echo(clock_entry_cb(clock))
 
 
+@clock.command(name="switch")
+@new_clock_options
+@click.option("--at", type=Iso8601, required=False,
+              help="When the switch happened, instead of now")
+@click.pass_obj
+def switch_clock(api, customer, customer_id, project, project_id, service, service_id, text, billable, at):
+    """Stop the running clock and start a new one at the same time."""
+    customer, project, service = resolve_entities(
+        api, customer, customer_id, project, project_id, service, service_id
+    )
+    clock = clockodo.clock.ClockEntry(
+        api=api,
+        customer=customer,
+        project=project,
+        service=service,
+        text=text,
+        billable=billable
+    )
+    stopped, running = api.switch_clock(clock, time=at)
+    if stopped is not None:
+        click.echo("Finished: {}".format(str(stopped)))
+    click.echo(clock_entry_cb(running))
+
+
+def resolve_edit_options(api, options):
+    """Turn `--customer`/`--customer-id` style options into an edit dict
+    with `customers_id` and friends, leaving out options that weren't
+    given."""
+    edit = {}
+    for k, v in options.items():
+        if v is None:
+            continue
+        if k in ["customer", "project", "service"]:
+            if options.get(k + "_id") is not None:
+                continue
+            with click.progressbar(getattr(api, f"iter_{k}s")(), label=f"Determining {k}") as bar:
+                for c in bar:
+                    if c.name == v:
+                        edit[k + "s_id"] = c.id
+                        break
+                else:
+                    click.echo(f"Can't find a {k} named {v}", err=True)
+                    exit(1)
+        elif k in ["customer_id", "project_id", "service_id"]:
+            edit[k.removesuffix("_id") + "s_id"] = v
+        else:
+            edit[k] = v
+
+    return edit
+
+
 @clock.command(name="edit")
-@click.option("--customer", type=int, required=False)
-@click.option("--customer-id", type=int, required=False)
-@click.option("--project", type=int, required=False)
-@click.option("--service", type=int, required=False)
+@click.option("--clock-id", type=int, required=False,
+              help="ID of the running clock, saves looking it up",
+              shell_complete=clockodo.completion.complete_ids("entry"))
+@click.option("--customer", type=str, required=False,
+              shell_complete=clockodo.completion.complete_names("customer"))
+@click.option("--customer-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("customer"))
+@click.option("--project", type=str, required=False,
+              shell_complete=clockodo.completion.complete_names("project"))
+@click.option("--project-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("project"))
+@click.option("--service", type=str, required=False,
+              shell_complete=clockodo.completion.complete_names("service"))
+@click.option("--service-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("service"))
 @click.option("--text", type=str, required=False)
 @click.option("--time-since", type=Iso8601, required=False)
 @click.option("--billable", type=bool, required=False)
 @click.pass_obj
-def edit_clock(api, **kwargs):
-    clock = api.current_clock()
-    if kwargs.get("customer_id") is not None:
-        kwargs["customers_id"] = kwargs["customer_id"]
-        del kwargs["customer_id"]
-    elif kwargs.get("customer") is not None:
-        with click.progressbar(api.iter_customers(), label="Determining customer") as bar:
-            for c in bar:
-                if c.name == kwargs["customer"]:
-                    kwargs["customers_id"] = c.id
-                    del kwargs["customer"]
-                    break
-            else:
-                click.echo(f"Can't find a customer named {customer}", err=True)
-                exit(1)
+def edit_clock(api, clock_id, **kwargs):
+    queue = get_queue()
+    if queue is not None:
+        try:
+            queue.edit(clock_id, resolve_edit_options(api, kwargs), api=api)
+        except ClockodoError as e:
+            click.echo(f"Can't queue the edit: {e.msg}", err=True)
+            sys.exit(1)
+        flush_in_background(api)
+        click.echo("Edit queued")
+        return
+    if clock_id is None:
+        clock = api.current_clock()
+        if clock is None:
+            click.echo("No running clock", err=True)
+            exit(1)
+        clock_id = clock.id
 
-    if kwargs.get("project_id") is not None:
-        kwargs["projects_id"] = kwargs["project_id"]
-        del kwargs["project_id"]
-    elif kwargs.get("project") is not None:
-        with click.progressbar(api.iter_projects(), label="Determining project") as bar:
-            for c in bar:
-                if c.name == kwargs["project"]:
-                    kwargs["projects_id"] = c.id
-                    del kwargs["project"]
-                    break
-            else:
-                click.echo(f"Can't find a project named {project}", err=True)
-                exit(1)
+    click.echo(clock_entry_cb(api.edit_entry(clock_id, resolve_edit_options(api, kwargs))))
 
-    if kwargs.get("service_id") is not None:
-        kwargs["services_id"] = kwargs["service_id"]
-        del kwargs["service_id"]
-    elif kwargs.get("service") is not None:
-        with click.progressbar(api.iter_services(), label="Determining service") as bar:
-            for c in bar:
-                if c.name == kwargs["service"]:
-                    kwargs["services_id"] = c.id
-                    del kwargs["service"]
-                    break
-            else:
-                click.echo(f"Can't find a service named {service}", err=True)
-                exit(1)
 
-    click.echo(clock_entry_cb(clock.edit(kwargs)))
+@cli.group()
+@click.option("--max-concurrency", default=16, show_default=True,
+              help="Requests to run at once for per-person queries")
+@click.pass_context
+def team(ctx, max_concurrency):
+    """Overviews over everyone in the account."""
+    import clockodo.team
+    ctx.obj = ctx.with_resource(clockodo.team.Team(ctx.obj, max_concurrency=max_concurrency))
+
+
+@team.command(name="presence")
+@click.pass_obj
+def team_presence(team):
+    """Who is clocked in on what right now."""
+    for presence in team.presence():
+        clock = presence.clock
+        if clock is None:
+            status = "-"
+        else:
+            since = clock.time_since.astimezone(our_tz()).strftime("%H:%M")
+            status = f"since {since}: {clock.customer.name} / {clock.service.name}: {clock.text}"
+        click.echo(f"{presence.user.name:30} {status}")
+
+
+@team.command(name="summary")
+@click.argument("week_start", type=click.DateTime(formats=["%Y-%m-%d"]), required=False)
+@click.pass_obj
+def team_summary(team, week_start):
+    """Worked time per person in a week (by default this one)."""
+    summary = team.weekly_summary(week_start.date() if week_start is not None else None)
+    for user, totals in sorted(summary.items(), key=lambda i: i[0].name.casefold()):
+        click.echo(
+            f"{user.name:30} {clockodo.entry.format_timedelta(totals.work):>12} worked, "
+            f"{totals.entries} entries, {totals.break_count} breaks, {totals.overlap_count} overlaps"
+        )
+
+
+@cli.group()
+def completion():
+    """Shell completion, see the README for setting it up."""
+
+
+@completion.command(name="refresh")
+@click.pass_obj
+def refresh_completion(api):
+    """Rebuild the index that completion answers from."""
+    marker = clockodo.completion.marker_path(api.user)
+    try:
+        clockodo.completion.save_index(clockodo.completion.build_index(api), user=api.user)
+    except Exception:
+        # Keep the marker, freshly dated, so that completion doesn't
+        # start another refresh on every TAB press
+        with open(marker, "w"):
+            pass
+        raise
+    try:
+        os.remove(marker)
+    except FileNotFoundError:
+        pass
+
+
+@cli.group()
+def wal():
+    """Clock operations recorded with `--queue`."""
+
+
+@wal.command(name="flush")
+@click.option("--quiet", is_flag=True)
+@click.pass_obj
+def flush_wal(api, quiet):
+    """Send queued clock operations now."""
+    import clockodo.wal
+    queue = clockodo.wal.WriteAheadLog()
+    sent, conflicts = queue.flush(api)
+    left = len(queue.pending())
+    if not quiet:
+        click.echo(f"Sent {sent}, {conflicts} conflicting, {left} still queued")
+    if conflicts or left:
+        exit(1)
+
+
+@wal.command(name="status")
+def wal_status():
+    """Show queued and conflicting clock operations."""
+    import clockodo.wal
+    queue = clockodo.wal.WriteAheadLog()
+    for op in queue.pending():
+        target = ""
+        if op["op"] != "start":
+            target = f" {op['target']}" if op["target"] is not None else " running clock"
+        click.echo(f"#{op['seq']} {op['op']}{target} at {op['at']} {op['params'] or ''}")
+    for op in queue.conflicts():
+        click.echo(f"#{op['seq']} {op['op']} at {op['at']} failed: {op['error']}", err=True)
 
 
 @cli.command()
@@ -395,66 +658,30 @@ def entries(ctx):
 
 @entries.command(name="edit")
 @click.pass_obj
-@click.option("--entry-id", type=int, required=True)
-@click.option("--customer", type=int, required=False)
-@click.option("--customer-id", type=int, required=False)
-@click.option("--project", type=int, required=False)
-@click.option("--service", type=int, required=False)
+@click.option("--entry-id", type=int, required=True,
+              shell_complete=clockodo.completion.complete_ids("entry"))
+@click.option("--customer", type=str, required=False,
+              shell_complete=clockodo.completion.complete_names("customer"))
+@click.option("--customer-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("customer"))
+@click.option("--project", type=str, required=False,
+              shell_complete=clockodo.completion.complete_names("project"))
+@click.option("--project-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("project"))
+@click.option("--service", type=str, required=False,
+              shell_complete=clockodo.completion.complete_names("service"))
+@click.option("--service-id", type=int, required=False,
+              shell_complete=clockodo.completion.complete_ids("service"))
 @click.option("--text", type=str, required=False)
 @click.option("--time-since", type=Iso8601, required=False)
 @click.option("--time-until", type=Iso8601, required=False)
 @click.option("--billable", type=bool, required=False)
 def edit_entry(api, entry_id, **kwargs):
-    if kwargs.get("customer_id") is not None:
-        kwargs["customers_id"] = kwargs["customer_id"]
-        del kwargs["customer_id"]
-    elif kwargs.get("customer") is not None:
-        with click.progressbar(api.iter_customers(), label="Determining customer") as bar:
-            for c in bar:
-                if c.name == kwargs["customer"]:
-                    kwargs["customers_id"] = c.id
-                    del kwargs["customer"]
-                    break
-            else:
-                click.echo(f"Can't find a customer named {customer}", err=True)
-                exit(1)
-
-    if kwargs.get("project_id") is not None:
-        kwargs["projects_id"] = kwargs["project_id"]
-        del kwargs["project_id"]
-    elif kwargs.get("project") is not None:
-        with click.progressbar(api.iter_projects(), label="Determining project") as bar:
-            for c in bar:
-                if c.name == kwargs["project"]:
-                    kwargs["projects_id"] = c.id
-                    del kwargs["project"]
-                    break
-            else:
-                click.echo(f"Can't find a project named {project}", err=True)
-                exit(1)
-
-    if kwargs.get("service_id") is not None:
-        kwargs["services_id"] = kwargs["service_id"]
-        del kwargs["service_id"]
-    elif kwargs.get("service") is not None:
-        with click.progressbar(api.iter_services(), label="Determining service") as bar:
-            for c in bar:
-                if c.name == kwargs["service"]:
-                    kwargs["services_id"] = c.id
-                    del kwargs["service"]
-                    break
-            else:
-                click.echo(f"Can't find a service named {service}", err=True)
-                exit(1)
-
-    new_entry = api.edit_entry(
-        api.get_entry(entry_id),
-        kwargs
-    )
+    new_entry = api.edit_entry(entry_id, resolve_edit_options(api, kwargs))
 
     if isinstance(new_entry, clockodo.entry.ClockEntry):
         click.echo(clock_entry_cb(new_entry))
-    elif isinstance(new_entry, clockodo.entry.LumpSumValue):
+    elif isinstance(new_entry, (clockodo.entry.LumpSumValue, clockodo.entry.EntryWithLumpSumService)):
         click.echo(lump_sum_cb(new_entry))
     else:
         raise NotImplementedError
@@ -463,18 +690,22 @@ def edit_entry(api, entry_id, **kwargs):
 @entries.command(name="create")
 @click.pass_obj
 def create_entry_interactive(api):
-    from clockodo.interactivity import inject_api, memoize_once, project_entries, customer_entries, service_entries, validate_timestamp, get_last_clock_out_time
+    # Only needed here, and slow to import on every TAB press
+    import inspect
+    import inquirer
+    from clockodo.interactivity import Prefetcher, validate_timestamp
+    from clockodo.search import SearchIndex
+    prefetch = Prefetcher(api)
 
     questions = [
         inquirer.List("entry_type", message="Entry type", choices=[("Clock", 1), ("Lump sum", 2)]),
         inquirer.List("customer", message="Customer",
-                      choices=inject_api(customer_entries, api)),
-        inquirer.List("project", message="Project", choices=inject_api(project_entries, api)),
+                      choices=prefetch.customer_entries),
+        inquirer.List("project", message="Project", choices=prefetch.project_entries),
         inquirer.List("service", message="Service",
-                      choices=inject_api(service_entries, api)),
-        # XXX why are these two questions so slow? Something is up with them, I wonder what exactly
+                      choices=prefetch.service_entries),
         inquirer.Text("time_since", message="Started at [HH:MM:SS]",
-                      default=get_last_clock_out_time(api), validate=validate_timestamp,
+                      default=prefetch.last_clock_out_time, validate=validate_timestamp,
                       ignore=lambda ans: ans["entry_type"] != 1),
         inquirer.Text("time_until", message="Ended at   [HH:MM:SS]",
                       default=datetime.datetime.now(tz=our_tz()).strftime("%H:%M:%S"),
@@ -491,9 +722,24 @@ def create_entry_interactive(api):
             ("billable", 1),
             ("already billed", 2)
         ]),
-        inquirer.Text("text", message="Description"),
     ]
     answers = inquirer.prompt(questions)
+    prefetch.close()
+    if answers is None:
+        exit(1)
+
+    # Asked separately so suggestions can prefer descriptions used
+    # with the same customer, project and service. inquirer before 3.x
+    # doesn't take `autocomplete`, then there are no suggestions.
+    text = {"message": "Description"}
+    index = SearchIndex.load(user=api.user)
+    if index.docs and "autocomplete" in inspect.signature(inquirer.Text.__init__).parameters:
+        text["message"] += " (TAB: earlier ones)"
+        text["autocomplete"] = index.autocomplete(**{
+            f"{kind}s_id": answers[kind].id
+            for kind in ("customer", "project", "service") if answers[kind] is not None
+        })
+    answers = inquirer.prompt([inquirer.Text("text", **text)], answers=answers)
 
     if answers is None:
         exit(1)
@@ -525,11 +771,110 @@ def create_entry_interactive(api):
         api.add_entry(entry)
 
 
+@entries.command(name="export")
+@click.argument('time_since', type=Iso8601, required=False)
+@click.argument('time_until', type=Iso8601, required=False)
+@click.option("--format", "format", type=click.Choice(clockodo.export.EXPORT_FORMATS), default="jsonl")
+@click.option("--output", "-o", type=click.Path(dir_okay=False, allow_dash=True), default="-")
+@click.option("--resolve-names/--no-resolve-names", default=True)
+@click.option("--resume", type=str, required=False,
+              help="Continue an interrupted export, appending to --output")
+@click.pass_obj
+def export_entries(api, time_since, time_until, format, output, resolve_names, resume):
+    if time_since is None:
+        time_since = datetime.datetime.combine(
+            datetime.date.today(),
+            datetime.time(0, tzinfo=our_tz())
+        )
+    if time_until is None:
+        time_until = datetime.datetime.combine(
+            datetime.date.today() + datetime.timedelta(days=1),
+            datetime.time(0, tzinfo=our_tz())
+        )
+
+    binary = format == "parquet"
+    mode = ("a" if resume is not None else "w") + ("b" if binary else "")
+    if output == "-":
+        fp = sys.stdout.buffer if binary else sys.stdout
+        close = False
+    else:
+        fp = open(output, mode) if binary else open(output, mode, newline="")
+        close = True
+    entries = api.iter_entries(time_since, time_until, checkpoint=resume)
+    try:
+        clockodo.export.export_entries(
+            api, entries, fp,
+            format=format, resolve_names=resolve_names,
+            append=resume is not None
+        )
+    except (Exception, KeyboardInterrupt):
+        if not binary:
+            fp.flush()
+            click.echo(f"Export interrupted, continue it with --resume {entries.checkpoint()}", err=True)
+        raise
+    finally:
+        if close:
+            fp.close()
+
+
+@entries.command(name="archive")
+@click.argument('time_since', type=Iso8601)
+@click.argument('time_until', type=Iso8601)
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.pass_obj
+def archive_entries(api, time_since, time_until, output):
+    """Freeze all entries in a closed time range into OUTPUT.
+
+    Read it back with `clockodo.archive.Archive`."""
+    import clockodo.archive
+    count = clockodo.archive.freeze(api, output, time_since, time_until)
+    click.echo(f"Archived {count} entries to {output}")
+
+
+@entries.command(name="search")
+@click.argument('query', nargs=-1, required=True)
+@click.option("--since", type=Iso8601, required=False)
+@click.option("--until", type=Iso8601, required=False)
+@click.option("--limit", default=20, show_default=True)
+@click.option("--facets", is_flag=True, help="Also count hits per customer, project and service")
+@click.option("--sync/--no-sync", default=None,
+              help="Fetch changed entries first [default: if the index is older than 10 minutes]")
+@click.option("--rebuild", is_flag=True, help="Index all of history again")
+@click.pass_obj
+def search_entries(api, query, since, until, limit, facets, sync, rebuild):
+    """Search the descriptions of your entries.
+
+    Every word has to appear, the last one may be cut short.
+    `customer:NAME`, `project:NAME` and `service:NAME` narrow the
+    search down to names containing NAME."""
+    import clockodo.search
+    index = clockodo.search.SearchIndex.load(user=api.user)
+    if rebuild:
+        index = clockodo.search.SearchIndex(user=api.user)
+    if sync is None:
+        sync = index.synced is None or time.time() - index.synced > clockodo.search.MAX_AGE
+    if sync:
+        if index.synced is None:
+            click.echo("Indexing all entries, this only happens once...", err=True)
+        index.sync(api)
+        index.save()
+
+    hits = index.search(" ".join(query), since=since, until=until, limit=limit)
+    for hit in hits:
+        click.echo(str(hit))
+    if facets:
+        click.echo(f"{hits.total} matching entries")
+        for facet, counts in hits.facets.items():
+            if counts:
+                click.echo(f"{facet.capitalize()}: " + ", ".join(f"{name} ({n})" for name, n in counts.most_common()))
+
+
 @entries.command(default_command=True, name="list")
 @click.argument('time_since', type=Iso8601, required=False)
 @click.argument('time_until', type=Iso8601, required=False)
 @click.pass_obj
 def list_entries(api, time_since, time_until):
+    import clockodo.timeline
     if time_since is None:
         time_since = datetime.datetime.combine(
             datetime.date.today(),
@@ -541,38 +886,36 @@ def list_entries(api, time_since, time_until):
             datetime.time(0, tzinfo=our_tz())
         )
 
-    def pairwise_with_last_none(iterable):
-        """Like itertools.pairwise(), but returns `(last, None)`
-        instead of `(last-1, last)` as the last entry."""
-        main, peek = itertools.tee(iterable)
-        # Advance the "peek" iterator by one entry
-        next(peek, None)
-        # Zip entries in pairs like this: ABCDEFG -> (AB, BC, CD, DE, EF, FG, G_)
-        yield from itertools.zip_longest(main, peek, fillvalue=None)
-
-    break_count = 0
-    total_break_duration = datetime.timedelta(0)
-    total_work_time = datetime.timedelta(0)
-    entries = pairwise_with_last_none(api.iter_entries(time_since, time_until))
-    for entry, next_entry in entries:
-        click.echo(clock_entry_cb(entry))
-        if entry.duration is not None:
-            total_work_time += datetime.timedelta(seconds=entry.duration)
-        else:
-            total_work_time += datetime.datetime.now(tz=datetime.timezone.utc) - entry.time_since
-
-        if entry.time_until is not None and next_entry is not None:
-            next_since = next_entry.time_since
-            break_duration = next_since - entry.time_until
-            total_break_duration += break_duration
-            if break_duration > datetime.timedelta(0):
-                click.echo("Break: {}".format(clockodo.entry.format_timedelta(break_duration)))
-                break_count += 1
-
-    click.echo("Total work time: {}".format(clockodo.entry.format_timedelta(total_work_time)))
-    click.echo("Breaks: {}, total duration: {}".format(
-        break_count,
-        clockodo.entry.format_timedelta(total_break_duration)
-    ))
+    timeline = clockodo.timeline.Timeline()
+    for item in timeline.sweep(api.iter_entries(time_since, time_until)):
+        if isinstance(item, clockodo.timeline.Gap):
+            click.echo("Break: {}".format(clockodo.entry.format_timedelta(item.duration)))
+        elif isinstance(item, clockodo.timeline.Overlap):
+            click.echo("Overlap with entry {}: {}".format(
+                item.first.id,
+                clockodo.entry.format_timedelta(item.duration)
+            ))
+        elif isinstance(item, clockodo.entry.ClockEntry):
+            click.echo(clock_entry_cb(item))
+        elif isinstance(item, (clockodo.entry.LumpSumValue, clockodo.entry.EntryWithLumpSumService)):
+            click.echo(lump_sum_cb(item))
+
+    # Print zero totals for a range without entries, like before
+    all_totals = timeline.totals or {None: clockodo.timeline.UserTotals()}
+    for users_id, totals in all_totals.items():
+        if len(all_totals) > 1:
+            click.echo(f"User {users_id}:")
+        click.echo("Total work time: {}".format(clockodo.entry.format_timedelta(totals.work)))
+        click.echo("Breaks: {}, total duration: {}".format(
+            totals.break_count,
+            clockodo.entry.format_timedelta(totals.breaks)
+        ))
+        if totals.overlap_count > 0:
+            click.echo("Overlaps: {}, total duration: {}".format(
+                totals.overlap_count,
+                clockodo.entry.format_timedelta(totals.overlaps)
+            ))
+
+
 if __name__ == "__main__":
     cli()
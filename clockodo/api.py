@@ -1,4 +1,13 @@
-import requests
+import copy
+import json
+import time
+import datetime
+import functools
+import contextlib
+import threading
+import collections
+import concurrent.futures
+from clockodo import resilience, trace
 
 CLOCKODO_BASE_URL = "https://my.clockodo.com/api/"
 
@@ -15,7 +24,7 @@ class ClockodoApiError(ClockodoError, Exception):
         self.status = response.status_code
         try:
             self.data = response.json()
-        except requests.exceptions.JSONDecodeError:
+        except ValueError:
             self.data = None
         response.close()
 
@@ -23,47 +32,436 @@ class ClockodoApiError(ClockodoError, Exception):
         return f"ClockodoApiError({self.status}, {self.data})"
 
 
+class ClockodoTimeout(ClockodoError):
+    def __str__(self):
+        return f"ClockodoTimeout({self.msg})"
+
+
+class ClockodoUnavailable(ClockodoError):
+    def __str__(self):
+        return f"ClockodoUnavailable({self.msg})"
+
+
+class RequestsTransport:
+    """Sends requests with `requests`, over HTTP/1.1.
+
+    Every thread gets its own session, since sessions aren't safe to
+    share between threads. They all use the same adapter, which is, so
+    the connection pool is still shared."""
+    def __init__(self, adapter=None):
+        # Imported here rather than at the top, it takes about as long
+        # as the rest of the CLI's startup
+        import requests
+        import requests.adapters
+        import urllib3.util.request
+        self._requests = requests
+        self._adapter = adapter if adapter is not None else requests.adapters.HTTPAdapter()
+        self._local = threading.local()
+        # Everything urllib3 can decode here, i.e. gzip and deflate, plus
+        # brotli and zstd if the respective packages are installed
+        self.accept_encoding = urllib3.util.request.ACCEPT_ENCODING
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        try:
+            return self.session.request(
+                method=method, url=url, params=params, data=data, headers=headers, timeout=timeout
+            )
+        except self._requests.exceptions.Timeout as e:
+            raise ClockodoTimeout(str(e))
+        except self._requests.exceptions.ConnectionError as e:
+            raise ClockodoUnavailable(str(e))
+
+    def close(self):
+        self._adapter.close()
+
+
+class HttpxTransport:
+    """Sends requests with `httpx`, which must be installed.
+
+    With `http2` (which needs the `h2` package), concurrent requests
+    from several threads are multiplexed over a single connection
+    instead of each taking a connection of their own."""
+    accept_encoding = None
+
+    def __init__(self, http2=True, **kwargs):
+        try:
+            import httpx
+        except ImportError:
+            raise ClockodoError("HttpxTransport requires httpx to be installed")
+        self._httpx = httpx
+        self._client = httpx.Client(http2=http2, **kwargs)
+        # httpx sets Accept-Encoding itself, depending on the decoders
+        # that are available
+
+    @staticmethod
+    def _drop_none(values):
+        # requests leaves out parameters that are None, httpx would send
+        # them as empty strings
+        if values is None:
+            return None
+        return {k: v for k, v in values.items() if v is not None}
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None):
+        params, data = self._drop_none(params), self._drop_none(data)
+        try:
+            return self._client.request(
+                method, url, params=params, data=data, headers=headers, timeout=timeout
+            )
+        except self._httpx.TimeoutException as e:
+            raise ClockodoTimeout(str(e))
+        except self._httpx.TransportError as e:
+            raise ClockodoUnavailable(str(e))
+
+    def close(self):
+        self._client.close()
+
+
+class EntityCache:
+    """A small, thread-safe LRU cache for customers, projects, services
+    and users.
+
+    Keys are `(kind, id)` tuples. One cache can be shared by several
+    clients that belong to the same clocko:do account. If several
+    threads ask for the same missing key at once, only one of them
+    fetches it and the others wait for the result."""
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get_or_fetch(self, key, fetch, api=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+            pending = self._pending.get(key)
+            fetching = pending is None
+            if fetching:
+                pending = self._pending[key] = concurrent.futures.Future()
+        if not fetching:
+            return pending.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            del self._pending[key]
+        pending.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """Store a value that was fetched some other way, e.g. in a list."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def cached_response(self, user, endpoint, fetch):
+        """Responses are only shared by `clockodo.cache.SharedCache`."""
+        return fetch()
+
+    def forget_responses(self, user):
+        pass
+
+
+def cached_entity(kind):
+    """Cache the result of a `get_<kind>(id)` method in the client's
+    entity cache."""
+    def decorator(fun):
+        @functools.wraps(fun)
+        def _inner(self, id):
+            def fetch():
+                with trace.span(f"get_{kind}", "entity", id=id):
+                    return fun(self, id)
+
+            value = self._cache.get_or_fetch((kind, id), fetch, api=self)
+            # The cache may be shared with other clients (of other API
+            # users), and the entity has to use the one asking for it
+            if getattr(value, "_api", self) is not self:
+                value = copy.copy(value)
+                value._api = self
+            return value
+
+        return _inner
+
+    return decorator
+
+
+def json_loader(backend="auto"):
+    """A function parsing JSON from bytes with the named library.
+
+    `"auto"` picks the fastest one installed: orjson, msgspec, or the
+    standard library's `json`."""
+    if backend in ("auto", "orjson"):
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            if backend == "orjson":
+                raise ClockodoError("the orjson backend requires the orjson package")
+    if backend in ("auto", "msgspec"):
+        try:
+            import msgspec.json
+            return msgspec.json.decode
+        except ImportError:
+            if backend == "msgspec":
+                raise ClockodoError("the msgspec backend requires the msgspec package")
+    if backend in ("auto", "json"):
+        return json.loads
+    raise ClockodoError(f"unknown JSON backend {backend}")
+
+
 class ClockodoApi:
     _ident = 'clockodo.py;oss@nyantec.com'
 
-    def __init__(self, api_user, api_token, language='en'):
+    def __init__(self, api_user, api_token, language='en', transport=None, cache=None,
+                 base_url=CLOCKODO_BASE_URL, timeout=30.0, hedge=False, breaker=None,
+                 json_backend="auto", limiter=None):
+        """Create a client.
+
+        Every request times out after `timeout` seconds, or earlier if
+        a `clockodo.resilience.deadline()` is active. With `hedge`, a
+        GET that takes longer than the 95th percentile of recent ones
+        is sent a second time, and whichever answer comes first is
+        used, once enough GETs were timed to know that percentile. A `clockodo.resilience.CircuitBreaker` makes calls fail
+        fast (or be answered from older responses) while the API is
+        down. Responses are parsed with `json_backend`, see
+        `json_loader()`. Every HTTP request is made while holding
+        `limiter`, e.g. a semaphore shared by several clients."""
         self.user = api_user
         self.token = api_token
         self.language = language
+        self.base_url = base_url
+        self.timeout = timeout
+        self.hedge = hedge
+        # Both of these may be shared with other clients, see `clockodo.pool`
+        self._owns_transport = transport is None
+        self._transport = transport if transport is not None else RequestsTransport()
+        self._cache = cache if cache is not None else EntityCache()
+        self._breaker = breaker
+        self._latency = resilience.LatencyTracker()
+        self._loads = json_loader(json_backend)
+        self._limiter = limiter if limiter is not None else contextlib.nullcontext()
+        self._hedge_pool = None
+        if hedge:
+            # Threads are only started once requests are hedged
+            self._hedge_pool = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="clockodo-hedge")
+
+    def close(self):
+        """Stop the hedging threads, and close the transport unless it
+        was passed in."""
+        if self._hedge_pool is not None:
+            # A hedged request that lost may still be running, don't wait
+            self._hedge_pool.shutdown(wait=False, cancel_futures=True)
+        if self._owns_transport:
+            self._transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, method, url, params, headers, timeout):
+        with self._limiter:
+            start = time.monotonic()
+            response = self._transport.request(
+                method,
+                url,
+                data=None if method == "GET" else params,
+                params=None if method != "GET" else params,
+                headers=headers,
+                timeout=timeout
+            )
+        if method == "GET":
+            self._latency.record(time.monotonic() - start)
+        return response
+
+    def _hedged_request(self, url, params, headers, timeout):
+        delay = self._latency.percentile(0.95)
+        if timeout is not None:
+            delay = min(delay, timeout)
+        first = self._hedge_pool.submit(self._request, "GET", url, params, headers, timeout)
+        try:
+            return first.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        second = self._hedge_pool.submit(self._request, "GET", url, params, headers, timeout)
+        pending = {first, second}
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            # Both may have finished by now, take one that succeeded
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            if not pending:
+                return done.pop().result()
 
     def _api_call(self, endpoint, method="GET", params=None):
-        response = requests.request(
-            method=method,
-            url=CLOCKODO_BASE_URL + endpoint,
-            data=None if method == "GET" else params,
-            params=None if method != "GET" else params,
-            headers={
-                'X-ClockodoApiUser': self.user,
-                'X-ClockodoApiKey': self.token,
-                'X-Clockodo-External-Application': self._ident,
-                'Accept-Language': self.language,
-                'Accept': 'application/json',
-            }
-        )
-
-        if response.ok:
-            return response.json()
+        if method == "GET" and not params:
+            return self._cache.cached_response(self.user, endpoint, lambda: self._send(endpoint))
+        response = self._send(endpoint, method, params)
+        if method != "GET":
+            self._cache.forget_responses(self.user)
+        return response
+
+    def _send(self, endpoint, method="GET", params=None):
+        headers = {
+            'X-ClockodoApiUser': self.user,
+            'X-ClockodoApiKey': self.token,
+            'X-Clockodo-External-Application': self._ident,
+            'Accept-Language': self.language,
+            'Accept': 'application/json',
+        }
+        if self._transport.accept_encoding is not None:
+            headers['Accept-Encoding'] = self._transport.accept_encoding
+
+        timeout = self.timeout
+        left = resilience.remaining()
+        if left is not None:
+            if left <= 0:
+                raise ClockodoTimeout(f"deadline exceeded before calling {endpoint}")
+            timeout = min(timeout, left) if timeout is not None else left
+
+        key = None
+        if method == "GET":
+            key = (endpoint, tuple(sorted((params or {}).items(), key=lambda i: i[0])))
+        if self._breaker is not None and not self._breaker.allow():
+            content = self._breaker.fallback(key) if key is not None else None
+            if content is None:
+                raise ClockodoUnavailable(f"clocko:do is failing, not calling {endpoint}")
+            return self._loads(content)
+
+        url = self.base_url + endpoint
+        try:
+            with trace.span(f"{method} {endpoint}", "api") as args:
+                try:
+                    if method == "GET" and self.hedge and self._latency.ready:
+                        response = self._hedged_request(url, params, headers, timeout)
+                    else:
+                        response = self._request(method, url, params, headers, timeout)
+                except (ClockodoTimeout, ClockodoUnavailable):
+                    if self._breaker is not None:
+                        self._breaker.failure()
+                    raise
+                if args is not None:
+                    args["status"] = response.status_code
+                    args["bytes"] = len(response.content)
+        except BaseException:
+            # Whatever else went wrong says nothing about clocko:do, but
+            # if this was the breaker's trial request it must end
+            if self._breaker is not None:
+                self._breaker.release()
+            raise
+
+        if 200 <= response.status_code < 300:
+            if self._breaker is not None:
+                self._breaker.success(key, response.content)
+            with trace.span("parse json", "decode"):
+                return self._loads(response.content)
         else:
+            if self._breaker is not None:
+                if response.status_code >= 500:
+                    self._breaker.failure()
+                else:
+                    self._breaker.success()
             raise ClockodoApiError(response)
 
 
+def parse_time(value: str) -> datetime.datetime:
+    """Parse a timestamp as clocko:do sends it, e.g. `2022-05-02T08:00:00Z`.
+
+    Several times faster than `strptime()`, which is kept as a fallback
+    for offsets `fromisoformat()` doesn't understand before Python 3.11."""
+    try:
+        if value.endswith("Z"):
+            return datetime.datetime.fromisoformat(value[:-1]).replace(tzinfo=datetime.timezone.utc)
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        # Same as `clockodo.entry.ISO8601_TIME_FORMAT`
+        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+
+
+_decoders = {}
+
+
 class FromJsonBlob:
+    """An object decoded from clocko:do's JSON.
+
+    Subclasses declare their fields in `_schema`, mapping JSON field
+    names to a function converting non-null values, or None to take
+    them as they are. Fields that aren't declared are still copied.
+    `_rename_fields` stores JSON fields under a different attribute
+    name, and `_optional_fields` are set to None when missing.
+
+    From that, a decoder with one straight line of code per converted
+    field is generated the first time a class is decoded."""
+    _schema = {}
     _optional_fields = []
     _rename_fields = {}
 
     @classmethod
-    def from_json_blob(cls, api, blob: dict):
-        entry = cls.__new__(cls)
-        for k, v in blob.items():
-            setattr(entry, cls._rename_fields.get(k, k), v)
-            entry._api = api
+    def _compile_decoder(cls):
+        lines = [
+            "def decode(api, blob):",
+            "    obj = new(cls)",
+            "    d = obj.__dict__",
+            "    d.update(blob)",
+        ]
+        namespace = {"new": object.__new__, "cls": cls}
+        for i, (field, convert) in enumerate(cls._schema.items()):
+            if convert is None:
+                continue
+            namespace[f"convert_{i}"] = convert
+            lines += [
+                f"    v = d.get({field!r})",
+                "    if v is not None:",
+                f"        d[{field!r}] = convert_{i}(v)",
+            ]
+        for field, name in cls._rename_fields.items():
+            lines += [
+                f"    if {field!r} in d:",
+                f"        d[{name!r}] = d.pop({field!r})",
+            ]
         for field in cls._optional_fields:
-            if field not in blob:
-                setattr(entry, field, None)
+            lines += [
+                f"    if {field!r} not in d:",
+                f"        d[{field!r}] = None",
+            ]
+        lines += [
+            "    d['_api'] = api",
+            "    return obj",
+        ]
+        exec("\n".join(lines), namespace)
+        _decoders[cls] = namespace["decode"]
+        return namespace["decode"]
 
-        return entry
+    @classmethod
+    def from_json_blob(cls, api, blob: dict):
+        decode = _decoders.get(cls)
+        if decode is None:
+            decode = cls._compile_decoder()
+        return decode(api, blob)
@@ -0,0 +1,254 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""A compact, memory-mapped file format for entries that won't change.
+
+Every numeric field is stored as a fixed-width column, `text` and all
+remaining fields go through a string table. `Archive` maps the file
+and reads columns in place, so opening even a large archive costs
+almost nothing, and entry objects are only built for the rows that are
+actually looked at."""
+
+import os
+import sys
+import mmap
+import json
+import array
+import bisect
+import struct
+import datetime
+from clockodo.api import ClockodoError
+from clockodo.entry import iso8601
+from clockodo.bulk import INT_COLUMNS, TIME_COLUMNS, FLOAT_COLUMNS, NONE, \
+    _TYPES, _pack_int, _pack_time, _pack_float, iter_raw_entry_pages
+
+MAGIC = b"CLKARCH\x01"
+_PREAMBLE = struct.Struct("<8sQ")
+# Timestamps that entries keep as strings, packed like `TIME_COLUMNS`
+# and turned back into strings when read
+STRING_TIME_COLUMNS = ["time_insert", "time_last_change", "time_clocked_since", "time_last_change_worktime"]
+# Fields with a column of their own, everything else ends up in `extra`
+_COLUMNS = set(INT_COLUMNS + TIME_COLUMNS + STRING_TIME_COLUMNS + FLOAT_COLUMNS + ["text"])
+
+
+def _padding(n):
+    return -n % 8
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def add(self, s):
+        if s is None:
+            return NONE
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+def write_archive(path, entries, time_since=None, time_until=None):
+    """Write raw entry JSON (as returned by clocko:do) to an archive.
+
+    Entries should be sorted by `time_since`, which is what
+    `Archive.between()` relies on. The file is written next to `path`
+    and renamed into place when complete."""
+    columns = {name: array.array("q") for name in INT_COLUMNS + TIME_COLUMNS + STRING_TIME_COLUMNS}
+    columns.update((name, array.array("d")) for name in FLOAT_COLUMNS)
+    columns["text"] = array.array("q")
+    columns["extra"] = array.array("q")
+    columns["keyset"] = array.array("q")
+    strings = _StringTable()
+    keysets = {}
+
+    for e in entries:
+        for name in INT_COLUMNS:
+            columns[name].append(_pack_int(e.get(name)))
+        for name in TIME_COLUMNS + STRING_TIME_COLUMNS:
+            columns[name].append(_pack_time(e.get(name)))
+        for name in FLOAT_COLUMNS:
+            columns[name].append(_pack_float(e.get(name)))
+        columns["text"].append(strings.add(e.get("text")))
+        extra = {k: v for k, v in e.items() if k not in _COLUMNS}
+        columns["extra"].append(strings.add(json.dumps(extra, separators=(",", ":"))))
+        columns["keyset"].append(keysets.setdefault(tuple(e.keys()), len(keysets)))
+
+    encoded = [s.encode() for s in strings.strings]
+    offsets = array.array("q", [0])
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    sections = list(columns.items()) + [("string_offsets", offsets), ("strings", b"".join(encoded))]
+
+    header = {
+        "count": len(columns["id"]),
+        "byteorder": sys.byteorder,
+        "time_since": time_since.timestamp() if time_since is not None else None,
+        "time_until": time_until.timestamp() if time_until is not None else None,
+        "keysets": list(keysets),
+        "sections": {},
+    }
+    # Offsets are relative to the first 8-byte boundary after the header
+    position = 0
+    for name, data in sections:
+        size = len(data) * (data.itemsize if isinstance(data, array.array) else 1)
+        header["sections"][name] = [position, size, getattr(data, "typecode", "B")]
+        position += size + _padding(size)
+    blob = json.dumps(header).encode()
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(_PREAMBLE.pack(MAGIC, len(blob)))
+        fp.write(blob)
+        fp.write(b"\0" * _padding(fp.tell()))
+        for name, data in sections:
+            fp.write(data if isinstance(data, bytes) else data.tobytes())
+            fp.write(b"\0" * _padding(fp.tell()))
+    os.replace(tmp, path)
+    return header["count"]
+
+
+def freeze(api, path, time_since: datetime.datetime, time_until: datetime.datetime, filters={}):
+    """Fetch all entries in a time range and write them to an archive."""
+    def entries():
+        for page in iter_raw_entry_pages(api, time_since, time_until, filters):
+            yield from page
+
+    return write_archive(path, entries(), time_since, time_until)
+
+
+class Archive:
+    """A read-only view of an archive file.
+
+    `column(name)` returns a new `memoryview` straight into the mapped
+    file on every call (timestamps are UNIX time, nulls are `NONE` or
+    NaN). Views have to be released before the archive is closed.
+
+    Indexing and iterating build entry objects row by row, with `api`
+    used to resolve customers, projects and services."""
+    def __init__(self, path, api=None):
+        self._api = api
+        self._fp = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fp.close()
+            raise ClockodoError(f"{path} is empty")
+        self._view = memoryview(self._mm)
+        magic, length = _PREAMBLE.unpack_from(self._mm)
+        if magic != MAGIC:
+            self.close()
+            raise ClockodoError(f"{path} is not a clockodo archive")
+        header = json.loads(self._mm[_PREAMBLE.size:_PREAMBLE.size + length])
+        if header["byteorder"] != sys.byteorder:
+            self.close()
+            raise ClockodoError(f"{path} was written on a machine with different byte order")
+        self._header = header
+        self._keysets = [set(k) for k in header["keysets"]]
+        start = _PREAMBLE.size + length + _padding(_PREAMBLE.size + length)
+        self._columns = {}
+        for name, (offset, size, typecode) in header["sections"].items():
+            offset += start
+            self._columns[name] = self._view[offset:offset + size].cast(typecode)
+
+    @property
+    def time_range(self):
+        """The `(time_since, time_until)` the archive was frozen for."""
+        return tuple(
+            datetime.datetime.fromtimestamp(self._header[k], tz=datetime.timezone.utc)
+            if self._header[k] is not None else None
+            for k in ["time_since", "time_until"]
+        )
+
+    def column(self, name) -> memoryview:
+        # A view of its own, releasing it leaves ours usable
+        return self._columns[name][:]
+
+    def string(self, i):
+        if i == NONE:
+            return None
+        offsets = self._columns["string_offsets"]
+        return bytes(self._columns["strings"][offsets[i]:offsets[i + 1]]).decode()
+
+    def __len__(self):
+        return self._header["count"]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        c = self._columns
+        cls = _TYPES.get(c["type"][i])
+        if cls is None:
+            raise ClockodoError("archive contains entry with unknown type " + str(c["type"][i]))
+        keys = self._keysets[c["keyset"][i]]
+        entry = cls.__new__(cls)
+        d = entry.__dict__
+        for name in INT_COLUMNS:
+            if name in keys:
+                value = c[name][i]
+                d[name] = value if value != NONE else None
+        for name in TIME_COLUMNS:
+            if name in keys:
+                value = c[name][i]
+                d[name] = datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc) \
+                    if value != NONE else None
+        for name in STRING_TIME_COLUMNS:
+            if name in keys:
+                value = c[name][i]
+                d[name] = iso8601(datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)) \
+                    if value != NONE else None
+        for name in FLOAT_COLUMNS:
+            if name in keys:
+                value = c[name][i]
+                d[name] = value if value == value else None
+        if "text" in keys:
+            d["text"] = self.string(c["text"][i])
+        d.update(json.loads(self.string(c["extra"][i])))
+        d["_api"] = self._api
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def between(self, time_since: datetime.datetime, time_until: datetime.datetime):
+        """Entries starting in `[time_since, time_until)`, found by
+        binary search on the `time_since` column."""
+        column = self._columns["time_since"]
+        lo = bisect.bisect_left(column, int(time_since.timestamp()))
+        hi = bisect.bisect_left(column, int(time_until.timestamp()), lo)
+        for i in range(lo, hi):
+            yield self[i]
+
+    def close(self):
+        for view in self._columns.values():
+            view.release()
+        self._columns = {}
+        self._view.release()
+        self._mm.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
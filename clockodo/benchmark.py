@@ -0,0 +1,178 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""Measures what response compression buys on a large `v2/entries` page.
+
+Runs against a local stub server that serves a synthetic page and
+counts the bytes it sends, optionally throttled to a given bandwidth:
+
+    $ python -m clockodo.benchmark --entries 1000 --requests 50 --bandwidth 1000000
+"""
+
+import gzip
+import json
+import time
+import datetime
+import threading
+import statistics
+import http.server
+import concurrent.futures
+import click
+import clockodo
+from clockodo.api import RequestsTransport, HttpxTransport, ClockodoError
+
+
+def synthetic_entries(n):
+    start = datetime.datetime(2022, 1, 3, 8, tzinfo=datetime.timezone.utc)
+    entries = []
+    for i in range(n):
+        since = start + datetime.timedelta(hours=i)
+        entries.append({
+            "id": i + 1, "type": 1, "users_id": 1000 + i % 20,
+            "customers_id": 100 + i % 7, "projects_id": 200 + i % 13, "services_id": 300 + i % 5,
+            "billable": i % 2, "texts_id": None, "text": f"Working on ticket #{i % 500}",
+            "time_since": since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "time_until": (since + datetime.timedelta(minutes=45)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "time_insert": since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "time_last_change": since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "duration": 2700, "clocked": False, "clocked_offline": False,
+            "time_clocked_since": None, "time_last_change_worktime": None, "hourly_rate": 95.0,
+        })
+    return entries
+
+
+class StubServer:
+    """A local HTTP server answering every GET with the same entries page."""
+    def __init__(self, entries=1000, latency=0.0, bandwidth=None):
+        self.body = json.dumps({
+            "entries": synthetic_entries(entries),
+            "paging": {"items_per_page": entries, "current_page": 1, "count_pages": 1, "count_items": entries},
+        }).encode()
+        self.gzip_body = gzip.compress(self.body)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Otherwise small (compressed) responses wait for delayed ACKs
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                body, encoding = stub.body, None
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body, encoding = stub.gzip_body, "gzip"
+                time.sleep(stub.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if encoding is not None:
+                    self.send_header("Content-Encoding", encoding)
+                self.end_headers()
+                stub._write(self.wfile, body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/api/"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _write(self, wfile, body):
+        with self._lock:
+            self.bytes_sent += len(body)
+        if self.bandwidth is None:
+            wfile.write(body)
+            return
+        chunk = max(1, self.bandwidth // 100)
+        for i in range(0, len(body), chunk):
+            wfile.write(body[i:i + chunk])
+            time.sleep(len(body[i:i + chunk]) / self.bandwidth)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def measure(server, transport, requests, concurrency):
+    api = clockodo.Clockodo("benchmark", "benchmark", transport=transport, base_url=server.url)
+    api._api_call("v2/entries")  # warm up the connection
+    server.bytes_sent = 0
+    latencies = []
+
+    def one(_):
+        start = time.perf_counter()
+        api._api_call("v2/entries")
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+    transport.close()
+
+    latencies.sort()
+    return {
+        "bytes/request": server.bytes_sent // requests,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p95 ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "requests/s": requests / wall,
+    }
+
+
+def identity_transport():
+    transport = RequestsTransport()
+    transport.accept_encoding = "identity"
+    return transport
+
+
+@click.command()
+@click.option("--entries", default=1000, help="Entries per page")
+@click.option("--requests", default=50)
+@click.option("--concurrency", default=4)
+@click.option("--latency", default=0.0, help="Server-side delay per request, in seconds")
+@click.option("--bandwidth", default=None, type=int, help="Bytes per second per response")
+def main(entries, requests, concurrency, latency, bandwidth):
+    transports = {
+        "requests, identity": identity_transport,
+        "requests, compressed": RequestsTransport,
+    }
+    try:
+        # The stub only speaks HTTP/1.1, so this shows httpx's own
+        # overhead; HTTP/2 is only negotiated with TLS servers.
+        HttpxTransport(http2=False).close()
+        transports["httpx, compressed"] = lambda: HttpxTransport(http2=False)
+    except ClockodoError:
+        pass
+
+    with StubServer(entries, latency, bandwidth) as server:
+        for name, make in transports.items():
+            result = measure(server, make(), requests, concurrency)
+            click.echo(f"{name:24} " + "  ".join(f"{k}: {v:.1f}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import datetime
+import concurrent.futures
+from clockodo.entry import ClockEntry
+from clockodo.watch import EntryAdded, EntryChanged, EntryRemoved
+
+
+def _usage(entry):
+    """Returns `(projects_id, seconds, revenue)` of an entry.
+
+    Only billable entries earn revenue. Where clocko:do calculated it
+    (`revenue`, also for hard budgets when asked to), that is used,
+    otherwise it's the hourly rate times the duration."""
+    seconds = 0
+    revenue = 0.0
+    if isinstance(entry, ClockEntry):
+        if entry.time_until is not None:
+            seconds = entry.duration if getattr(entry, "duration", None) is not None \
+                else int((entry.time_until - entry.time_since).total_seconds())
+    if getattr(entry, "billable", None):
+        if getattr(entry, "revenue", None) is not None:
+            revenue = entry.revenue
+        elif isinstance(entry, ClockEntry):
+            revenue = (getattr(entry, "hourly_rate", None) or 0.0) * seconds / 3600
+        else:
+            revenue = getattr(entry, "lumpsum", None) or 0.0
+    return getattr(entry, "projects_id", None), seconds, revenue
+
+
+class ProjectBudget:
+    def __init__(self, project):
+        self.project = project
+        self.seconds = 0
+        self.revenue = 0.0
+        self._alerted = set()
+
+    @property
+    def hours(self) -> float:
+        return self.seconds / 3600
+
+    @property
+    def used(self) -> float:
+        """Budget used, in hours or money depending on the project."""
+        return self.hours if self.project.budget_is_hours else self.revenue
+
+    @property
+    def remaining(self) -> float:
+        return self.project.budget_money - self.used
+
+    @property
+    def fraction(self) -> float:
+        if not self.project.budget_money:
+            return 0.0
+        return self.used / self.project.budget_money
+
+    def __str__(self):
+        unit = "h" if self.project.budget_is_hours else " EUR"
+        return f"{self.project.name}: {self.used:.02f}{unit} of {self.project.budget_money:.02f}{unit} used"
+
+
+class BudgetTracker:
+    """Keeps running totals of hours and revenue for projects with a
+    budget.
+
+    After `build()`, entries are applied incrementally: the tracker
+    remembers what every entry contributed, so a changed entry only
+    moves the difference. `remaining()` is a dict lookup.
+
+    Callbacks registered with `on_threshold()` are called as
+    `callback(budget, threshold)` whenever a project's used fraction
+    crosses one of `thresholds` upwards."""
+    def __init__(self, thresholds=(0.8, 1.0)):
+        self.thresholds = sorted(thresholds)
+        self.budgets = {}
+        self._entries = {}
+        self._callbacks = []
+
+    def on_threshold(self, callback):
+        self._callbacks.append(callback)
+
+    def build(self, api, time_since=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc),
+              time_until=None, max_workers=4):
+        """Load all active projects with a budget and their entries.
+
+        Only the entries of those projects are read, with one filtered
+        scan per project, `max_workers` of them at a time."""
+        if time_until is None:
+            time_until = datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(days=1)
+        for project in api.iter_projects(active=True):
+            if getattr(project, "budget_money", None):
+                self.budgets[project.id] = ProjectBudget(project)
+
+        def scan(project):
+            return list(api.iter_entries(time_since, time_until, {"project": project},
+                                         revenues_for_hard_budget=True))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for entries in executor.map(scan, [b.project for b in self.budgets.values()]):
+                for entry in entries:
+                    self.update(entry)
+
+    def _apply(self, usage, sign):
+        projects_id, seconds, revenue = usage
+        budget = self.budgets.get(projects_id)
+        if budget is None:
+            return None
+        budget.seconds += sign * seconds
+        budget.revenue += sign * revenue
+        return budget
+
+    def _check(self, budget):
+        fraction = budget.fraction
+        for threshold in self.thresholds:
+            if fraction >= threshold and threshold not in budget._alerted:
+                budget._alerted.add(threshold)
+                for callback in self._callbacks:
+                    callback(budget, threshold)
+            elif fraction < threshold:
+                budget._alerted.discard(threshold)
+
+    def update(self, entry):
+        """Add a new entry or apply the changes of an existing one."""
+        old = self._entries.pop(entry.id, None)
+        old_budget = self._apply(old, -1) if old is not None else None
+        usage = _usage(entry)
+        budget = self._apply(usage, 1)
+        if budget is not None:
+            self._entries[entry.id] = usage
+            self._check(budget)
+        if old_budget is not None and old_budget is not budget:
+            self._check(old_budget)
+
+    def remove(self, entry_id):
+        old = self._entries.pop(entry_id, None)
+        if old is not None:
+            self._check(self._apply(old, -1))
+
+    def remaining(self, projects_id) -> float:
+        return self.budgets[projects_id].remaining
+
+    def attach(self, watcher):
+        """Keep the totals up to date from a `clockodo.watch.Watcher`."""
+        def on_event(event):
+            if isinstance(event, (EntryAdded, EntryChanged)):
+                self.update(event.entry)
+            elif isinstance(event, EntryRemoved):
+                self.remove(event.entry.id)
+
+        return watcher.subscribe(on_event)
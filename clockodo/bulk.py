@@ -0,0 +1,74 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import math
+import datetime
+import itertools
+from clockodo.entry import ENTRY_TYPES, entries_query
+from clockodo.paging import Paginator
+from clockodo.api import parse_time
+
+# Integer columns are packed into `array("q")`, with `NONE` for null
+INT_COLUMNS = [
+    "id", "type", "users_id", "customers_id", "projects_id", "services_id",
+    "billable", "duration", "texts_id",
+]
+# Timestamps are packed as UNIX time
+TIME_COLUMNS = ["time_since", "time_until"]
+# Floats are packed into `array("d")`, with NaN for null
+FLOAT_COLUMNS = ["lumpsum", "hourly_rate"]
+NONE = -2 ** 63
+
+_TYPES = ENTRY_TYPES
+
+
+def _pack_int(value):
+    if value is None:
+        return NONE
+    return int(value)
+
+
+def _pack_time(value):
+    if value is None:
+        return NONE
+    return int(parse_time(value).timestamp())
+
+
+def _pack_float(value):
+    if value is None:
+        return math.nan
+    return float(value)
+
+
+def iter_raw_entry_pages(api, time_since: datetime.datetime,
+                         time_until: datetime.datetime,
+                         filters={},
+                         revenues_for_hard_budget=False,
+                         page_size=1000):
+    """Iterate over raw entry JSON in lists of up to `page_size` entries."""
+    raw = iter(Paginator(
+        api, "v2/entries", "entries", lambda e: e,
+        entries_query(time_since, time_until, filters, revenues_for_hard_budget),
+        anchor="time_since"
+    ))
+    while True:
+        page = list(itertools.islice(raw, page_size))
+        if not page:
+            break
+        yield page
+
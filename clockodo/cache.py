@@ -0,0 +1,502 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+
+"""Caches that several processes, possibly on several hosts, can share.
+
+A `SharedCache` works like `clockodo.api.EntityCache`, but keeps
+entities in a `CacheBackend` instead of a dict, so a fleet of workers
+using the same clocko:do account only fetches each customer, project
+or service once per TTL. It also caches what parameterless GETs like
+`v2/clock` return, per API user, for a few seconds.
+
+Backends store bytes under string keys with a TTL:
+ - `MemoryBackend`, for one process
+ - `FileBackend`, for the processes of one host
+ - `RedisBackend`, for anything that speaks the Redis protocol
+
+`backend_from_url()` creates one from `memory://`, `file:///path` or
+`redis://[:password@]host[:port][/db]`."""
+
+import os
+import json
+import time
+import contextlib
+import socket
+import hashlib
+import importlib
+import threading
+import urllib.parse
+import concurrent.futures
+from clockodo import trace
+from clockodo.api import ClockodoError
+
+# Part of every key. Bump it when the way entities are stored changes,
+# so old and new versions of this library can share a backend.
+FORMAT_VERSION = 1
+DEFAULT_TTLS = {"customer": 3600, "project": 3600, "service": 3600, "user": 3600}
+DEFAULT_RESPONSE_TTLS = {"v2/clock": 5}
+
+
+class CacheBackend:
+    """Stores bytes under string keys. Every value has a TTL in
+    seconds, or None to keep it until it's evicted."""
+    def get(self, key):
+        """The value of `key`, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None) -> bool:
+        """Set `key` only if it isn't set, and tell whether it was."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key) -> int:
+        """Atomically add one to an integer value (missing counts as 0)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            return item[0] if item is not None else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            item = self._live(key)
+            value = int(item[0]) + 1 if item is not None else 1
+            self._data[key] = (str(value).encode(), item[1] if item is not None else None)
+            return value
+
+
+class FileBackend(CacheBackend):
+    """One file per key in `directory`, holding the expiry time (UNIX
+    time, 0 for none) on the first line and the value after it.
+
+    Files are replaced atomically, so readers never see half a value.
+    Expired files are only removed when they're read."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    @staticmethod
+    def _encode(value, ttl):
+        expires = time.time() + ttl if ttl is not None else 0
+        return f"{expires}\n".encode() + value
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        expires, _, value = data.partition(b"\n")
+        try:
+            expires = float(expires)
+        except ValueError:
+            # Not ours, or written by something that crashed
+            return None
+        if expires and expires <= time.time():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return value
+
+    def get(self, key):
+        return self._read(self._path(key))
+
+    def set(self, key, value, ttl=None):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(self._encode(value, ttl))
+        os.replace(tmp, path)
+
+    def add(self, key, value, ttl=None):
+        path = self._path(key)
+        # Drops the file if it expired
+        self._read(path)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(self._encode(value, ttl))
+        return True
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def incr(self, key):
+        import fcntl
+        with open(self._path(key) + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            value = int(self.get(key) or 0) + 1
+            self.set(key, str(value).encode())
+            return value
+
+
+class RedisError(ClockodoError):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """A minimal client for the Redis protocol (RESP2), enough for
+    caching. Commands are sent over a single connection, one at a time,
+    and the connection is reopened after errors."""
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=1.0, prefix=""):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.prefix = prefix
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password is not None:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", str(self.db))
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = self._file = None
+
+    @staticmethod
+    def _encode(args):
+        out = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            out.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        return b"".join(out)
+
+    def _reply(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection to Redis closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        elif kind == b"-":
+            raise RedisError(rest.decode())
+        elif kind == b":":
+            return int(rest)
+        elif kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        elif kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._reply() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def _call(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._reply()
+
+    def call(self, *args):
+        """Send a command and return its reply."""
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._call(*args)
+            except (OSError, ConnectionError):
+                self._disconnect()
+                raise
+
+    def get(self, key):
+        return self.call("GET", self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            self.call("SET", self.prefix + key, value)
+        else:
+            self.call("SET", self.prefix + key, value, "PX", str(int(ttl * 1000)))
+
+    def add(self, key, value, ttl=None):
+        args = ["SET", self.prefix + key, value, "NX"]
+        if ttl is not None:
+            args += ["PX", str(int(ttl * 1000))]
+        return self.call(*args) is not None
+
+    def delete(self, key):
+        self.call("DEL", self.prefix + key)
+
+    def incr(self, key):
+        return self.call("INCR", self.prefix + key)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+def backend_from_url(url):
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    elif parsed.scheme == "file":
+        return FileBackend(parsed.path)
+    elif parsed.scheme == "redis":
+        db = parsed.path.strip("/")
+        return RedisBackend(
+            parsed.hostname or "localhost", parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=urllib.parse.unquote(parsed.password) if parsed.password else None
+        )
+    raise ClockodoError(f"unknown cache URL {url}")
+
+
+class _BackendDown(Exception):
+    pass
+
+
+def _dump(value):
+    cls = type(value)
+    if not cls.__module__.startswith("clockodo."):
+        raise ClockodoError(f"can't share a {cls.__name__} between processes")
+    fields = {k: v for k, v in value.__dict__.items() if k != "_api"}
+    return json.dumps({"class": f"{cls.__module__}:{cls.__qualname__}", "fields": fields}).encode()
+
+
+def _load(data, api):
+    blob = json.loads(data)
+    module, _, name = blob["class"].partition(":")
+    # Only ever rebuild our own entity classes from what's in the backend
+    if not module.startswith("clockodo."):
+        raise ClockodoError(f"refusing to load {blob['class']} from the cache")
+    cls = getattr(importlib.import_module(module), name)
+    value = cls.__new__(cls)
+    value.__dict__.update(blob["fields"])
+    value._api = api
+    return value
+
+
+def user_hash(user):
+    """A short, stable name for API user `user`. API users are email
+    addresses, which don't belong in key names."""
+    return hashlib.sha1(user.encode()).hexdigest()[:16]
+
+
+class SharedCache:
+    """An entity cache in a `CacheBackend`, for `Clockodo(cache=...)`.
+
+    Keys look like `clockodo:1:<namespace>:<generation>:customer:42`.
+    `namespace` has to be the same for all clients of one clocko:do
+    account and different for other accounts. `clear()` increments the
+    generation in the backend, which hides everything cached before
+    from all processes at once; the old keys expire on their own.
+
+    `ttls` maps entity kinds to TTLs in seconds, `response_ttls`
+    maps endpoints to how long their parameterless GET responses are
+    shared between the processes of the same API user. Those are
+    dropped whenever that user changes something.
+
+    When the backend fails, the cache gets out of the way: values are
+    fetched from clocko:do as if nothing was cached, and the backend
+    isn't tried again for `retry_after` seconds."""
+    def __init__(self, backend, namespace, ttls=None, response_ttls=None,
+                 default_ttl=600, lock_ttl=10.0, generation_ttl=1.0, retry_after=5.0):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.response_ttls = dict(DEFAULT_RESPONSE_TTLS, **(response_ttls or {}))
+        self.default_ttl = default_ttl
+        self.lock_ttl = lock_ttl
+        self.generation_ttl = generation_ttl
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._prefix = f"clockodo:{FORMAT_VERSION}:{namespace}:"
+        self._generation = None
+        self._generation_checked = 0.0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _backend(self):
+        """Guards calls to the backend. Raises `_BackendDown` if they
+        fail, or right away while the backend is considered down."""
+        if time.monotonic() < self._down_until:
+            raise _BackendDown()
+        try:
+            yield self.backend
+        except (OSError, ClockodoError):
+            self._down_until = time.monotonic() + self.retry_after
+            raise _BackendDown()
+
+    def _key(self, kind, *parts):
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_checked > self.generation_ttl:
+            self._generation = int(self.backend.get(self._prefix + "generation") or 0)
+            self._generation_checked = now
+        return self._prefix + ":".join(map(str, [self._generation, kind, *parts]))
+
+    def _single_flight(self, key, fetch):
+        """Run `fetch` for `key` once per process, and let concurrent
+        callers wait for its result."""
+        with self._lock:
+            pending = self._pending.get(key)
+            fetching = pending is None
+            if fetching:
+                pending = self._pending[key] = concurrent.futures.Future()
+        if not fetching:
+            return pending.result()
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            del self._pending[key]
+        pending.set_result(value)
+        return value
+
+    def _get_or_fetch(self, key, fetch, ttl, dump, load):
+        """Look `key` up in the backend, or fetch and store it. Only
+        one process fetches a missing key at a time, the others poll
+        the backend for up to `lock_ttl` seconds."""
+        locked_at = None
+        try:
+            with self._backend() as backend:
+                data = backend.get(key)
+                if data is None:
+                    if backend.add(key + ":lock", b"1", self.lock_ttl):
+                        locked_at = time.monotonic()
+                    else:
+                        give_up = time.monotonic() + self.lock_ttl
+                        while data is None and time.monotonic() < give_up:
+                            time.sleep(0.05)
+                            data = backend.get(key)
+        except _BackendDown:
+            return fetch()
+        if data is not None:
+            return load(data)
+
+        try:
+            value = fetch()
+            with contextlib.suppress(_BackendDown), self._backend() as backend:
+                backend.set(key, dump(value), ttl)
+            return value
+        finally:
+            # Only our own lock, and only if it can't have expired and
+            # been taken by someone else meanwhile
+            if locked_at is not None and time.monotonic() - locked_at < self.lock_ttl:
+                with contextlib.suppress(_BackendDown), self._backend() as backend:
+                    backend.delete(key + ":lock")
+
+    def get_or_fetch(self, key, fetch, api=None):
+        kind, id = key
+        try:
+            with self._backend():
+                backend_key = self._key(kind, id)
+        except _BackendDown:
+            return fetch()
+        with trace.span("shared cache", "cache", key=backend_key):
+            return self._single_flight(backend_key, lambda: self._get_or_fetch(
+                backend_key, fetch, self.ttls.get(kind, self.default_ttl),
+                _dump, lambda data: _load(data, api)
+            ))
+
+    def put(self, key, value):
+        kind, id = key
+        with contextlib.suppress(_BackendDown), self._backend() as backend:
+            backend.set(self._key(kind, id), _dump(value), self.ttls.get(kind, self.default_ttl))
+
+    def clear(self):
+        with contextlib.suppress(_BackendDown), self._backend() as backend:
+            self._generation = backend.incr(self._prefix + "generation")
+            self._generation_checked = time.monotonic()
+
+    def cached_response(self, user, endpoint, fetch):
+        """The parsed response of a parameterless GET of `endpoint` by
+        `user`, shared between processes for `response_ttls[endpoint]`
+        seconds."""
+        ttl = self.response_ttls.get(endpoint)
+        if ttl is None or user is None:
+            return fetch()
+        try:
+            with self._backend():
+                key = self._key("response", user_hash(user), endpoint)
+        except _BackendDown:
+            return fetch()
+        return self._single_flight(key, lambda: self._get_or_fetch(
+            key, fetch, ttl, lambda value: json.dumps(value).encode(), json.loads
+        ))
+
+    def forget_responses(self, user):
+        """Drop the shared responses of `user`, after they changed something."""
+        if user is None:
+            return
+        with contextlib.suppress(_BackendDown), self._backend() as backend:
+            for endpoint in self.response_ttls:
+                backend.delete(self._key("response", user_hash(user), endpoint))
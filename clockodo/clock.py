@@ -16,8 +16,22 @@
 # damage or existence of a defect, except proven that it results out
 # of said person's immediate fault when using the work as intended.
 
-from clockodo.api import FromJsonBlob, ClockodoApi
-from clockodo.entry import ClockEntry, iso8601
+import datetime
+from clockodo.api import FromJsonBlob, ClockodoApi, ClockodoError
+from clockodo.entry import BaseEntry, ClockEntry, iso8601
+
+
+def _clock_params(clock: ClockEntry, time_since=None) -> dict:
+    time_since = time_since if time_since is not None else clock.time_since
+    return {
+        "customers_id": clock.customers_id,
+        "projects_id": clock.projects_id,
+        "services_id": clock.services_id,
+        "time_since": iso8601(time_since) if time_since is not None else None,
+        "text": clock.text,
+        "texts_id": clock.texts_id,
+        "billable": str(int(clock.billable)) if clock.billable is not None else None
+    }
 
 
 class ClockApi(ClockodoApi):
@@ -36,13 +50,33 @@ class ClockApi(ClockodoApi):
     def start_clock(self, clock: ClockEntry):
         return ClockEntry.from_json_blob(
             self,
-            self._api_call(f"v2/clock", method="POST", params={
-                "customers_id": clock.customers_id,
-                "projects_id": clock.projects_id,
-                "services_id": clock.services_id,
-                "time_since": iso8601(clock.time_since) if clock.time_since is not None else None,
-                "text": clock.text,
-                "texts_id": clock.texts_id,
-                "billable": str(int(clock.billable)) if clock.billable is not None else None
-            })["running"]
+            self._api_call(f"v2/clock", method="POST", params=_clock_params(clock))["running"]
         )
+
+    def switch_clock(self, new_entry: ClockEntry, time: datetime.datetime = None, refetch=False):
+        """Stop the running clock, if any, and start `new_entry` in its
+        place, at the same instant.
+
+        clocko:do stops a running clock itself when a new one is
+        started, so without `time` this is a single request, and the
+        server picks the handoff time for both entries. With `time`,
+        the new clock starts then, and the stopped entry is moved to end
+        at the same time, which costs a second request.
+
+        Returns `(stopped, running)`, with `stopped` being None if no
+        clock was running. `stopped` is taken from the response unless
+        `refetch` is set."""
+        response = self._api_call("v2/clock", method="POST", params=_clock_params(new_entry, time))
+        running = ClockEntry.from_json_blob(self, response["running"])
+        stopped = response.get("stopped")
+        if stopped is None:
+            return None, running
+
+        stopped = BaseEntry.from_json_blob(self, stopped)
+        if stopped.time_until != running.time_since:
+            # Returns the entry as clocko:do has it now, so no need to
+            # refetch
+            stopped = self.edit_entry(stopped.id, {"time_until": running.time_since})
+        elif refetch:
+            stopped = self.get_entry(stopped.id)
+        return stopped, running
@@ -0,0 +1,180 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""Shell completion for customers, projects, services and entries.
+
+Completing must not wait for the network, so candidates come from an
+index in `$XDG_CACHE_HOME/clockodo`. When the index gets old, it is
+rebuilt by a detached `clockodo completion refresh`, and the next TAB
+press sees the result."""
+
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+import datetime
+import subprocess
+import click.shell_completion
+
+KINDS = ["customer", "project", "service"]
+# Rebuild the index in the background once it is older than this
+MAX_AGE = 3600
+# Entries of the last `HISTORY_DAYS` days count towards ranking and are
+# offered for entry IDs
+HISTORY_DAYS = 30
+# Usage from `HALF_LIFE` days ago counts half as much as usage today
+HALF_LIFE = 7
+
+
+def cache_dir():
+    """`$XDG_CACHE_HOME/clockodo`, created if missing."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    path = os.path.join(base, "clockodo")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _suffix(user):
+    if user is None:
+        return ""
+    return "-" + hashlib.sha256(user.encode()).hexdigest()[:16]
+
+
+def index_path(user=None):
+    """Where the index of `user` is kept. Users may see different
+    customers, projects and entries, so every one gets their own."""
+    return os.path.join(cache_dir(), f"completion{_suffix(user)}.json")
+
+
+def marker_path(user=None):
+    """Exists while the index of `user` is being rebuilt, or for a
+    while after rebuilding it failed."""
+    return os.path.join(cache_dir(), f"completion{_suffix(user)}.refreshing")
+
+
+def build_index(api, now=None):
+    """Fetch everything completion needs from clocko:do."""
+    now = now if now is not None else datetime.datetime.now(tz=datetime.timezone.utc)
+    index = {
+        "updated": now.timestamp(),
+        "customer": {c.id: {"name": c.name, "score": 0.0} for c in api.iter_customers(active=True)},
+        "project": {p.id: {"name": p.name, "score": 0.0} for p in api.iter_projects(active=True)},
+        "service": {s.id: {"name": s.name, "score": 0.0} for s in api.iter_services()},
+        "entry": {},
+    }
+    since = now - datetime.timedelta(days=HISTORY_DAYS)
+    for entry in api.iter_entries(since, now + datetime.timedelta(days=1)):
+        age = (now - entry.time_since).total_seconds() / 86400
+        weight = math.pow(0.5, age / HALF_LIFE)
+        for kind in KINDS:
+            item = index[kind].get(getattr(entry, kind + "s_id", None))
+            if item is not None:
+                item["score"] += weight
+        customer = index["customer"].get(entry.customers_id, {}).get("name", "")
+        index["entry"][entry.id] = {
+            "name": f"{entry.time_since.astimezone():%a %d %H:%M} {customer}: {entry.text or ''}",
+            "score": entry.time_since.timestamp(),
+        }
+    return index
+
+
+def save_index(index, path=None, user=None):
+    path = path if path is not None else index_path(user)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(index, fp)
+    os.replace(tmp, path)
+
+
+def load_index(path=None, user=None):
+    try:
+        with open(path if path is not None else index_path(user)) as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def refresh_in_background(user=None, token=None):
+    """Start rebuilding the index without waiting for it.
+
+    The credentials are passed in the environment, not on the command
+    line where other users could see them."""
+    env = dict(os.environ)
+    if user is not None:
+        env["CLOCKODO_API_USER"] = user
+    if token is not None:
+        env["CLOCKODO_API_TOKEN"] = token
+    subprocess.Popen(
+        [sys.executable, "-m", "clockodo", "completion", "refresh"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True, env=env
+    )
+
+
+def _index(ctx):
+    # --user and --token, from the command line being completed or
+    # their environment variables
+    params = ctx.find_root().params
+    user = params.get("user")
+    index = load_index(user=user)
+    if index is None or time.time() - index["updated"] > MAX_AGE:
+        # Only the first of several quick TAB presses starts a refresh,
+        # and after a failed one the next waits as long
+        marker = marker_path(user)
+        try:
+            if time.time() - os.path.getmtime(marker) < 60:
+                return index
+        except FileNotFoundError:
+            pass
+        with open(marker, "w"):
+            pass
+        refresh_in_background(user, params.get("token"))
+    return index
+
+
+def _ranked(ctx, kind):
+    index = _index(ctx)
+    if index is None:
+        return []
+    items = index[kind].items()
+    return sorted(items, key=lambda i: (-i[1]["score"], i[1]["name"].casefold()))
+
+
+def complete_names(kind):
+    """A `shell_complete` callback for options taking a name."""
+    def complete(ctx, param, incomplete):
+        incomplete = incomplete.casefold()
+        return [
+            click.shell_completion.CompletionItem(item["name"], help=f"ID {id}")
+            for id, item in _ranked(ctx, kind)
+            if incomplete in item["name"].casefold()
+        ]
+    return complete
+
+
+def complete_ids(kind):
+    """A `shell_complete` callback for options taking an ID."""
+    def complete(ctx, param, incomplete):
+        return [
+            click.shell_completion.CompletionItem(id, help=item["name"])
+            for id, item in _ranked(ctx, kind)
+            if id.startswith(incomplete)
+        ]
+    return complete
@@ -16,17 +16,15 @@
 # damage or existence of a defect, except proven that it results out
 # of said person's immediate fault when using the work as intended.
 
-import functools
-from clockodo.api import FromJsonBlob, ClockodoApi, ClockodoError
+from clockodo.api import FromJsonBlob, ClockodoApi, cached_entity, ClockodoError
+from clockodo.paging import Paginator
 
 class Customer(FromJsonBlob):
+    _schema = {
+        "id": None, "name": None, "number": None, "active": None,
+        "billable_default": bool, "note": None,
+    }
     _rename_fields = {"note": "_note"}
-    @classmethod
-    def from_json_blob(cls, api, blob: dict):
-        entry = super(Customer, cls).from_json_blob(api, blob)
-        entry.billable_default = bool(entry.billable_default)
-
-        return entry
 
     def __init__(self, api, name, number=None, active=True, billable_default=False, note=None):
         self._api = api
@@ -51,7 +49,7 @@ class Customer(FromJsonBlob):
 
 
 class CustomerApi(ClockodoApi):
-    @functools.lru_cache(maxsize=10)
+    @cached_entity("customer")
     def get_customer(self, id):
         entry = self._api_call(f"v2/customers/{id}")["customer"]
         return Customer.from_json_blob(self, entry)
@@ -67,19 +65,12 @@ class CustomerApi(ClockodoApi):
 
         return response
 
-    def iter_customers(self, active=None):
-        count_pages = None
-        params = {
-            "page": 1
-        }
+    def iter_customers(self, active=None, checkpoint=None):
+        params = {}
         if active is not None:
             params["filter[active]"] = str(int(active))
-        while count_pages is None or params["page"] <= count_pages:
-            response = self._api_call(f"v2/customers", params=params)
-            yield from map(lambda c: Customer.from_json_blob(self, c), response["customers"])
-
-            if "paging" not in response:
-                break
-            if count_pages is None:
-                count_pages = response["paging"]["count_pages"]
-            params["page"] = response["paging"]["current_page"] + 1
+        return Paginator(
+            self, "v2/customers", "customers",
+            lambda c: Customer.from_json_blob(self, c),
+            params, checkpoint=checkpoint
+        )
@@ -1,7 +1,8 @@
 import datetime
-import functools
+import itertools
 from abc import ABCMeta, abstractmethod
-from clockodo.api import FromJsonBlob, ClockodoApi
+from clockodo.api import FromJsonBlob, ClockodoApi, ClockodoError, parse_time
+from clockodo.paging import Paginator
 
 ISO8601_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 
@@ -28,46 +29,99 @@ def iso8601(dt: datetime.datetime) -> str:
     return dt
 
 
+# Filters that take an entity (or its ID) and are sent as `filter[<name>s_id]`.
+ENTITY_FILTERS = ["customer", "project", "service", "user", "lumpsum_service"]
+
+
+def entries_query(time_since: datetime.datetime,
+                  time_until: datetime.datetime,
+                  filters={},
+                  revenues_for_hard_budget=False,
+                  page=None) -> dict:
+    """Build query parameters for `v2/entries`.
+
+    Every filter is pushed down to clocko:do as `filter[...]`:
+     - `customer`, `project`, `service`, `user`, `lumpsum_service` take
+       an object with an `id` attribute or a plain ID
+     - `billable`, `text`, `texts_id`, `type`, `budget_type` are passed
+       through, with booleans converted to `0` or `1`"""
+    params = {
+        "time_since": iso8601(time_since),
+        "time_until": iso8601(time_until),
+        "page": page,
+        # it's not me who invented this kinda long field! ~Vika
+        "calc_also_revenues_for_projects_with_hard_budget": str(int(revenues_for_hard_budget))
+    }
+    for k, v in filters.items():
+        if k in ENTITY_FILTERS:
+            k = k + "s_id"
+            v = getattr(v, "id", v)
+        if isinstance(v, bool):
+            v = str(int(v))
+        params[f"filter[{k}]"] = v
+
+    return params
+
+
 class BaseEntry(metaclass=ABCMeta):
     @classmethod
-    def from_json_blob(cls, api, blob: dict):
-        entry = None
-        if blob["type"] == 1:
-            entry = ClockEntry.from_json_blob(api, blob)
-        elif blob["type"] == 2:
-            entry = LumpSumValue.from_json_blob(api, blob)
-        elif blob["type"] == 3:
-            entry = EntryWithLumpSumService.from_json_blob(api, blob)
-        else:
+    def from_json_blob(cls, api, blob: dict, fields=None):
+        """Decode an entry of any type.
+
+        If `fields` is given, only those fields (plus `id` and `type`)
+        are decoded, and the rest of the blob is thrown away."""
+        if fields is not None:
+            blob = {k: blob[k] for k in ["id", "type", *fields] if k in blob}
+        cls = ENTRY_TYPES.get(blob["type"])
+        if cls is None:
             raise ClockodoError("clocko:do returned entry with unknown type " + str(blob["type"]))
 
-        return entry
+        return cls.from_json_blob(api, blob)
 
     def edit(self, edit: dict):
         return self._api.edit_entry(self, edit)
 
-    @functools.cached_property
+    @property
     def customer(self):
         return self._api.get_customer(self.customers_id)
 
-    @functools.cached_property
+    @property
     def project(self):
         if self.projects_id is None:
             return None
         return self._api.get_project(self.projects_id)
 
+    @property
+    def user(self):
+        if getattr(self, "users_id", None) is None:
+            return None
+        return self._api.get_user(self.users_id)
 
-class ClockEntry(FromJsonBlob, BaseEntry):
-    _rename_fields = {}
 
-    @classmethod
-    def from_json_blob(cls, api, blob: dict):
-        entry = super(ClockEntry, cls).from_json_blob(api, blob)
-        entry.time_since = datetime.datetime.strptime(entry.time_since, ISO8601_TIME_FORMAT)
-        if entry.time_until is not None:
-            entry.time_until = datetime.datetime.strptime(entry.time_until, ISO8601_TIME_FORMAT)
+def _billable_str(billable):
+    if billable == 0:
+        return "not billable"
+    elif billable == 1:
+        return "billable, not yet billed"
+    elif billable == 2:
+        return "already billed"
+
+
+# Fields every type of entry has
+_ENTRY_SCHEMA = {
+    "id": None, "type": None, "users_id": None,
+    "customers_id": None, "projects_id": None,
+    "billable": None, "texts_id": None, "text": None,
+    "time_since": parse_time, "time_insert": None, "time_last_change": None,
+}
 
-        return entry
+
+class ClockEntry(FromJsonBlob, BaseEntry):
+    _schema = dict(_ENTRY_SCHEMA, **{
+        "services_id": None, "time_until": parse_time, "duration": None,
+        "clocked": None, "clocked_offline": None, "time_clocked_since": None,
+        "time_last_change_worktime": None, "hourly_rate": None,
+    })
 
     def __init__(self, api, customer, service,
                  time_since=None, time_until=None,
@@ -98,7 +152,7 @@ class ClockEntry(FromJsonBlob, BaseEntry):
         self.duration = None
         self.hourly_rate = hourly_rate
 
-    @functools.cached_property
+    @property
     def service(self):
         return self._api.get_service(self.services_id)
 
@@ -119,29 +173,24 @@ class ClockEntry(FromJsonBlob, BaseEntry):
             running = ", not started"
         duration = format_timedelta(self.clock_duration())
         id=f"(ID {self.id})" if self.id is not None else ""
-        if self.billable == 0:
-            billable = "not billable"
-        elif self.billable == 1:
-            billable = "billable, not yet billed"
-        elif self.billable == 2:
-            billable = "already billed"
 
-        return f"Clock entry{id} ({billable}) // {duration}{running}"
+        return f"Clock entry{id} ({_billable_str(self.billable)}) // {duration}{running}"
 
-    def stop(self):
-        self._api.stop_clock(self)
-        return self._api.get_entry(self.id)
+    def stop(self, refetch=False):
+        """Stop this clock and return the stopped entry.
+
+        clocko:do answers with the stopped entry, so it's only fetched
+        again with `refetch`."""
+        response = self._api.stop_clock(self)
+        if refetch or response.get("stopped") is None:
+            return self._api.get_entry(self.id)
+        return BaseEntry.from_json_blob(self._api, response["stopped"])
 
     def start(self):
         return self._api.start_clock(self)
 
 class LumpSumValue(FromJsonBlob, BaseEntry):
-    @classmethod
-    def from_json_blob(cls, api, blob: dict):
-        entry = super(LumpSumValue, cls).from_json_blob(api, blob)
-        entry.time_since = datetime.datetime.strptime(entry.time_since, ISO8601_TIME_FORMAT)
-
-        return entry
+    _schema = dict(_ENTRY_SCHEMA, services_id=None, lumpsum=None)
 
     def __init__(self, api, customer, service,
                  time_since, lumpsum,
@@ -161,23 +210,41 @@ class LumpSumValue(FromJsonBlob, BaseEntry):
 
     def __str__(self):
         id=f"(ID {self.id})" if self.id is not None else ""
-        if self.billable == 0:
-            billable = "not billable"
-        elif self.billable == 1:
-            billable = "billable, not yet billed"
-        elif self.billable == 2:
-            billable = "already billed"
 
-        return f"Lump sum entry{id} ({billable}) // {self.lumpsum:.02f} EUR"
+        return f"Lump sum entry{id} ({_billable_str(self.billable)}) // {self.lumpsum:.02f} EUR"
 
-    @functools.cached_property
+    @property
     def service(self):
         return self._api.get_service(self.services_id)
 
 
 class EntryWithLumpSumService(FromJsonBlob, BaseEntry):
-    def __init__(self, api, *args, **kwargs):
-        raise NotImplementedError
+    """An amount of a lump sum service, e.g. 3 site visits."""
+    _schema = dict(_ENTRY_SCHEMA, lumpsum_services_id=None, lumpsum_services_amount=None)
+
+    def __init__(self, api, customer, lumpsum_service, amount,
+                 time_since, text=None, user=None,
+                 project=None, billable=1):
+        self.id = None
+        self.type = 3
+        self.text = text
+        self._api = api
+        self.customers_id = customer.id
+        self.lumpsum_services_id = getattr(lumpsum_service, "id", lumpsum_service)
+        self.lumpsum_services_amount = amount
+        self.projects_id = project.id if project is not None else None
+        self.billable = billable
+        self.time_since = time_since
+        self.users_id = user.id if user is not None else None
+
+    def __str__(self):
+        id=f"(ID {self.id})" if self.id is not None else ""
+
+        return (f"Lump sum service entry{id} ({_billable_str(self.billable)}) // "
+                f"{self.lumpsum_services_amount} × lump sum service {self.lumpsum_services_id}")
+
+
+ENTRY_TYPES = {1: ClockEntry, 2: LumpSumValue, 3: EntryWithLumpSumService}
 
 
 class EntryApi(ClockodoApi):
@@ -188,9 +255,10 @@ class EntryApi(ClockodoApi):
     def add_entry(self, entry: BaseEntry):
         params = {}
         if isinstance(entry, ClockEntry):
-            for term in ["customer", "service", "project", "user"]:
+            # The IDs, not the relations, which would fetch every entity
+            for term in ["customers_id", "services_id", "projects_id", "users_id"]:
                 if getattr(entry, term, None) is not None:
-                    params[term + "s_id"] = getattr(entry, term).id
+                    params[term] = getattr(entry, term)
             for term in ["time_since", "time_until"]:
                 if getattr(entry, term, None) is not None:
                     params[term] = iso8601(getattr(entry, term))
@@ -200,9 +268,10 @@ class EntryApi(ClockodoApi):
             if getattr(entry, "billable", None) is not None:
                 params["billable"] = str(int(entry.billable))
         elif isinstance(entry, LumpSumValue):
-            for term in ["customer", "service", "project", "user"]:
+            # The IDs, not the relations, which would fetch every entity
+            for term in ["customers_id", "services_id", "projects_id", "users_id"]:
                 if getattr(entry, term, None) is not None:
-                    params[term + "s_id"] = getattr(entry, term).id
+                    params[term] = getattr(entry, term)
             for term in ["time_since"]:
                 if getattr(entry, term, None) is not None:
                     params[term] = iso8601(getattr(entry, term))
@@ -211,22 +280,53 @@ class EntryApi(ClockodoApi):
                     params[term] = getattr(entry, term)
             if getattr(entry, "billable", None) is not None:
                 params["billable"] = str(int(entry.billable))
+        elif isinstance(entry, EntryWithLumpSumService):
+            for term in ["customers_id", "projects_id", "users_id",
+                         "lumpsum_services_id", "lumpsum_services_amount", "text"]:
+                if getattr(entry, term, None) is not None:
+                    params[term] = getattr(entry, term)
+            params["time_since"] = iso8601(entry.time_since)
+            if getattr(entry, "billable", None) is not None:
+                params["billable"] = str(int(entry.billable))
         else:
             raise NotImplementedError
 
         response = self._api_call(f"v2/entries", method="POST", params=params)
         return BaseEntry.from_json_blob(self, response["entry"])
 
-    def edit_entry(self, entry: BaseEntry, edit: dict):
-        for term in ["customer", "service", "project", "user"]:
-            if term in edit:
-                edit[term + "s_id"] = edit[term].id if edit[term] is not None else None
-                del edit[term]
-        for term in ["time_since", "time_until"]:
-            if term in edit and isinstance(edit[term], datetime.datetime):
-                edit[term] = iso8601(edit[term])
+    def edit_entry(self, entry, edit: dict, check_unchanged=False):
+        """Edit an entry with a single PUT request.
 
-        response = self._api_call(f"v2/entries/{entry.id}", method="PUT", params=edit)
+        `entry` can be an entry object or just its ID. `edit` isn't
+        modified. Every field in `edit` is sent, even if `entry` already
+        has that value, since a local object may be out of date.
+
+        With `check_unchanged`, the entry is fetched first and the edit
+        is refused if its `time_last_change` differs from the one of
+        `entry`, i.e. if someone else changed it in the meantime."""
+        entry_id = entry.id if isinstance(entry, BaseEntry) else entry
+        params = {}
+        for term, value in edit.items():
+            if term in ["customer", "service", "project", "user"]:
+                term = term + "s_id"
+                value = getattr(value, "id", value)
+            if isinstance(value, datetime.datetime):
+                value = iso8601(value)
+            elif isinstance(value, bool):
+                value = str(int(value))
+            params[term] = value
+
+        if check_unchanged:
+            if not isinstance(entry, BaseEntry):
+                raise ClockodoError("check_unchanged requires an entry object, not an ID")
+            current = self.get_entry(entry_id)
+            if current.time_last_change != entry.time_last_change:
+                raise ClockodoError(f"entry {entry_id} was changed at {current.time_last_change}")
+
+        if not params and isinstance(entry, BaseEntry):
+            return entry
+
+        response = self._api_call(f"v2/entries/{entry_id}", method="PUT", params=params)
 
         return BaseEntry.from_json_blob(self, response["entry"])
 
@@ -234,59 +334,70 @@ class EntryApi(ClockodoApi):
                      time_until: datetime.datetime,
                      page=None,
                      filters={},
-                     revenues_for_hard_budget=False):
-        time_since = iso8601(time_since)
-        time_until = iso8601(time_until)
-
-        data = {
-            "time_since": time_since,
-            "time_until": time_until,
-            "page": page,
-            # it's not me who invented this kinda long field! ~Vika
-            "calc_also_revenues_for_projects_with_hard_budget": str(int(revenues_for_hard_budget))
-        }
-        for k, v in filters.items():
-            if k in ["customer", "project", "service"]:
-                data[f"filters[{k}s_id]"] = v.id
-            else:
-                if isinstance(v, bool):
-                    v = str(int(v))
-                data[f"filters[{k}]"] = v
+                     revenues_for_hard_budget=False,
+                     fields=None):
+        data = entries_query(time_since, time_until, filters, revenues_for_hard_budget, page=page)
 
         result = self._api_call("v2/entries", params=data)
-        result["entries"] = list(map(lambda e: BaseEntry.from_json_blob(self, e), result["entries"]))
+        result["entries"] = list(map(lambda e: BaseEntry.from_json_blob(self, e, fields), result["entries"]))
 
         return result
 
     def iter_entries(self, time_since: datetime.datetime,
                      time_until: datetime.datetime,
                      filters={},
-                     revenues_for_hard_budget=False):
-        time_since = iso8601(time_since)
-        time_until = iso8601(time_until)
-
-        params = {
-            "time_since": time_since,
-            "time_until": time_until,
-            "page": 1,
-            # it's not me who invented this kinda long field! ~Vika
-            "calc_also_revenues_for_projects_with_hard_budget": str(int(revenues_for_hard_budget))
-        }
-        for k, v in filters.items():
-            if k in ["customer", "project", "service"]:
-                params[f"filter[{k}s_id]"] = v.id
-            else:
-                if isinstance(v, bool):
-                    v = str(int(v))
-                params[f"filter[{k}]"] = v
-
-        count_pages = None
-        while count_pages is None or params["page"] <= count_pages:
+                     revenues_for_hard_budget=False,
+                     fields=None,
+                     checkpoint=None):
+        """Iterate over all entries in the range.
+
+        The returned `Paginator` can be asked for a `checkpoint()`
+        token, which resumes the scan when passed as `checkpoint` to
+        a call with the same arguments."""
+        return Paginator(
+            self, "v2/entries", "entries",
+            lambda e: BaseEntry.from_json_blob(self, e, fields),
+            entries_query(time_since, time_until, filters, revenues_for_hard_budget),
+            anchor="time_since",
+            checkpoint=checkpoint
+        )
+
+    def iter_entries_reverse(self, time_since: datetime.datetime,
+                             time_until: datetime.datetime,
+                             filters={},
+                             revenues_for_hard_budget=False,
+                             fields=None):
+        """Like `iter_entries()`, but from the newest entry to the oldest.
+
+        Only the first page is needed to learn the page count, after
+        that pages are fetched from the last one backwards. Stopping
+        early thus costs at most two requests, no matter how many
+        entries are in the range."""
+        params = entries_query(time_since, time_until, filters, revenues_for_hard_budget, page=1)
+
+        def decode_reversed(entries):
+            entries = [BaseEntry.from_json_blob(self, e, fields) for e in entries]
+            if fields is None or "time_since" in fields:
+                entries.sort(key=lambda e: e.time_since)
+            return reversed(entries)
+
+        first = self._api_call(f"v2/entries", params=params)
+        count_pages = first["paging"]["count_pages"] if "paging" in first else 1
+        for page in range(count_pages, 1, -1):
+            params["page"] = page
             response = self._api_call(f"v2/entries", params=params)
-            yield from map(lambda e: BaseEntry.from_json_blob(self, e), response["entries"])
+            yield from decode_reversed(response["entries"])
+        yield from decode_reversed(first["entries"])
 
-            if "paging" not in response:
-                break
-            if count_pages is None:
-                count_pages = response["paging"]["count_pages"]
-            params["page"] = response["paging"]["current_page"] + 1
+    def last_entries(self, n, time_since: datetime.datetime,
+                     time_until: datetime.datetime,
+                     filters={},
+                     revenues_for_hard_budget=False,
+                     fields=None) -> list:
+        """Get the last `n` entries in the range, oldest first."""
+        entries = list(itertools.islice(
+            self.iter_entries_reverse(time_since, time_until, filters, revenues_for_hard_budget, fields),
+            n
+        ))
+        entries.reverse()
+        return entries
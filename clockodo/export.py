@@ -0,0 +1,156 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import csv
+import json
+import datetime
+import itertools
+from clockodo.api import ClockodoError
+from clockodo.entry import iso8601
+
+EXPORT_FORMATS = ["jsonl", "csv", "parquet"]
+
+# Column order of the exported rows. Fields an entry doesn't have
+# (e.g. `lumpsum` on a clock entry) are exported as null.
+EXPORT_FIELDS = [
+    "id", "type", "users_id",
+    "customers_id", "customer",
+    "projects_id", "project",
+    "services_id", "service",
+    "billable", "time_since", "time_until", "duration",
+    "lumpsum", "hourly_rate", "texts_id", "text",
+    "time_insert", "time_last_change",
+]
+
+
+class NameResolver:
+    """Resolves customer, project and service IDs to names.
+
+    Instead of calling `get_customer()` and friends once per entry,
+    the whole list of each entity is fetched on first use with the
+    paged `iter_*` methods and kept in a dict."""
+    def __init__(self, api):
+        self._api = api
+        self._names = {}
+
+    def _table(self, kind):
+        if kind not in self._names:
+            it = getattr(self._api, f"iter_{kind}s")()
+            self._names[kind] = {i.id: i.name for i in it}
+        return self._names[kind]
+
+    def name(self, kind, id):
+        if id is None:
+            return None
+        return self._table(kind).get(id)
+
+
+def entry_row(entry, resolver=None) -> dict:
+    row = {}
+    for field in EXPORT_FIELDS:
+        if field in ["customer", "project", "service"]:
+            row[field] = resolver.name(field, getattr(entry, field + "s_id", None)) \
+                if resolver is not None else None
+            continue
+        value = getattr(entry, field, None)
+        if isinstance(value, datetime.datetime):
+            value = iso8601(value)
+        row[field] = value
+    return row
+
+
+def write_jsonl(rows, fp, append=False):
+    for row in rows:
+        fp.write(json.dumps(row, ensure_ascii=False))
+        fp.write("\n")
+
+
+def write_csv(rows, fp, append=False):
+    writer = csv.DictWriter(fp, fieldnames=EXPORT_FIELDS)
+    if not append:
+        writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+
+
+def _parquet_schema(pa):
+    timestamp = pa.timestamp("s", tz="UTC")
+    types = {
+        "id": pa.int64(), "type": pa.int8(), "users_id": pa.int64(),
+        "customers_id": pa.int64(), "customer": pa.string(),
+        "projects_id": pa.int64(), "project": pa.string(),
+        "services_id": pa.int64(), "service": pa.string(),
+        "billable": pa.int8(), "time_since": timestamp, "time_until": timestamp,
+        "duration": pa.int64(), "lumpsum": pa.float64(), "hourly_rate": pa.float64(),
+        "texts_id": pa.int64(), "text": pa.string(),
+        "time_insert": timestamp, "time_last_change": timestamp,
+    }
+    return pa.schema([(field, types[field]) for field in EXPORT_FIELDS])
+
+
+def _parse_timestamp(value):
+    if value is None:
+        return None
+    return datetime.datetime.strptime(value.replace("Z", "+0000"), "%Y-%m-%dT%H:%M:%S%z")
+
+
+def write_parquet(rows, fp, append=False, batch_size=10000):
+    if append:
+        raise ClockodoError("Parquet files can't be appended to")
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ClockodoError("Parquet export requires pyarrow to be installed")
+
+    schema = _parquet_schema(pa)
+    timestamps = [f.name for f in schema if pa.types.is_timestamp(f.type)]
+    with pq.ParquetWriter(fp, schema) as writer:
+        while True:
+            # Every batch is written as its own row group, so only
+            # `batch_size` rows are ever held in memory at once.
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            columns = {field: [row[field] for row in batch] for field in EXPORT_FIELDS}
+            for field in timestamps:
+                columns[field] = list(map(_parse_timestamp, columns[field]))
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+
+_WRITERS = {
+    "jsonl": write_jsonl,
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+
+def export_entries(api, entries, fp, format="jsonl", resolve_names=True, append=False):
+    """Stream `entries` into `fp` in the given format.
+
+    `fp` should be a text file for jsonl and csv, and a binary file
+    for parquet. Entries are consumed lazily, so passing the result
+    of `iter_entries()` keeps memory usage bounded.
+
+    With `append`, rows are added to an earlier, interrupted export
+    (e.g. without repeating the CSV header)."""
+    if format not in _WRITERS:
+        raise ClockodoError(f"unknown export format {format}")
+    resolver = NameResolver(api) if resolve_names else None
+    rows = (entry_row(e, resolver) for e in entries)
+    _WRITERS[format](rows, fp, append=append)
@@ -0,0 +1,560 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""An in-process fake of the parts of the clocko:do API this package uses.
+
+    with FakeClockodo(latency=0.02, error_rate=0.01) as fake:
+        fake.populate(customers=20, projects=100, services=5, entries=10000)
+        api = clockodo.Clockodo("someone", "anything", base_url=fake.url)
+
+Any user name and token are accepted; every user name gets its own
+`users_id` and running clock. Latency, random server errors and a
+per-user rate limit can be set up front or changed while it runs.
+
+It can also be run on its own, for tools in other processes:
+
+    $ python -m clockodo.fake --port 8080 --entries 10000
+
+`FakeRedis` does the same for the few Redis commands
+`clockodo.cache.RedisBackend` needs.
+"""
+
+import re
+import json
+import time
+import random
+import datetime
+import threading
+import http.server
+import socketserver
+import urllib.parse
+import click
+from clockodo.entry import ISO8601_TIME_FORMAT, iso8601
+
+PAGE_SIZE = 1000
+_ENTRY_FILTERS = ["customers_id", "projects_id", "services_id", "users_id", "billable", "type", "texts_id"]
+
+
+def _parse_time(value):
+    return datetime.datetime.strptime(value, ISO8601_TIME_FORMAT)
+
+
+def _now():
+    return datetime.datetime.now(tz=datetime.timezone.utc).replace(microsecond=0)
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+
+
+class FakeClockodo:
+    """A fake clocko:do server on a local port.
+
+    `latency` (plus up to `jitter`) seconds are waited before every
+    response, a fraction `error_rate` of requests fails with 503, and
+    with `rate_limit` each user may make that many requests per second
+    (with bursts of as many) before getting 429s."""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 page_size=PAGE_SIZE, seed=None, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.customers = {}
+        self.projects = {}
+        self.services = {}
+        self.entries = {}
+        self.users = {}
+        self.requests = 0
+        self._running = {}
+        self._buckets = {}
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode() if length else ""
+                status, data = fake.handle(
+                    self.command, self.path, body,
+                    self.headers.get("X-ClockodoApiUser") or "anonymous"
+                )
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/api/"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Test data
+
+    def _id(self):
+        with self._lock:
+            id = self._next_id
+            self._next_id += 1
+            return id
+
+    def add_customer(self, name, active=True, billable_default=False):
+        customer = {
+            "id": self._id(), "name": name, "number": None, "active": active,
+            "billable_default": billable_default, "note": None,
+        }
+        self.customers[customer["id"]] = customer
+        return customer
+
+    def add_project(self, customer, name, active=True, budget_money=None, budget_is_hours=False):
+        project = {
+            "id": self._id(), "customers_id": customer["id"], "name": name, "number": None,
+            "active": active, "billable_default": customer["billable_default"],
+            "budget_money": budget_money, "budget_is_hours": budget_is_hours,
+            "budget_is_not_strict": False, "note": None, "completed": False,
+        }
+        self.projects[project["id"]] = project
+        return project
+
+    def add_service(self, name, active=True):
+        service = {"id": self._id(), "name": name, "number": None, "active": active, "note": None}
+        self.services[service["id"]] = service
+        return service
+
+    def user_id(self, name):
+        """The `users_id` of the user with the API user name `name`."""
+        with self._lock:
+            user = self.users.get(name)
+            if user is None:
+                user = self.users[name] = {
+                    "id": 1000 + len(self.users), "name": name, "number": None, "active": True,
+                    "email": f"{name}@example.com", "role": "worker", "teams_id": None,
+                }
+            return user["id"]
+
+    def add_entry(self, users_id, customers_id, services_id, time_since, time_until=None,
+                  projects_id=None, text=None, billable=0, lumpsum=None,
+                  lumpsum_services_id=None, lumpsum_services_amount=None):
+        now = iso8601(_now())
+        entry = {
+            "id": self._id(), "type": 1, "users_id": users_id,
+            "customers_id": customers_id, "projects_id": projects_id, "services_id": services_id,
+            "billable": billable, "texts_id": None, "text": text,
+            "time_since": iso8601(time_since), "time_insert": now, "time_last_change": now,
+        }
+        if lumpsum_services_id is not None:
+            del entry["services_id"]
+            entry.update({
+                "type": 3, "lumpsum_services_id": lumpsum_services_id,
+                "lumpsum_services_amount": lumpsum_services_amount,
+            })
+        elif lumpsum is not None:
+            entry.update({"type": 2, "lumpsum": lumpsum})
+        else:
+            entry.update({
+                "time_until": iso8601(time_until) if time_until is not None else None,
+                "duration": int((time_until - time_since).total_seconds()) if time_until is not None else None,
+                "clocked": time_until is None, "clocked_offline": False,
+                "time_clocked_since": iso8601(time_since) if time_until is None else None,
+                "time_last_change_worktime": now, "hourly_rate": 90.0,
+            })
+        with self._lock:
+            self.entries[entry["id"]] = entry
+            if entry["type"] == 1 and time_until is None:
+                self._running[users_id] = entry["id"]
+        return entry
+
+    def populate(self, customers=10, projects=30, services=5, entries=1000, users=5,
+                 until=None, days=365):
+        """Fill the server with random but plausible data: working-hours
+        entries for `users` users over the `days` days before `until`."""
+        rng = self.random
+        cs = [self.add_customer(f"Customer {i}") for i in range(customers)]
+        ps = [self.add_project(rng.choice(cs), f"Project {i}", budget_money=rng.choice([None, 100.0, 5000.0]))
+              for i in range(projects)]
+        ss = [self.add_service(f"Service {i}") for i in range(services)]
+        us = [self.user_id(f"user{i}") for i in range(users)]
+        until = until if until is not None else _now()
+        start = until - datetime.timedelta(days=days)
+        times = sorted(
+            start + datetime.timedelta(seconds=rng.randrange(days * 86400))
+            for _ in range(entries)
+        )
+        for time_since in times:
+            project = rng.choice(ps) if ps and rng.random() < 0.8 else None
+            customer = self.customers[project["customers_id"]] if project else rng.choice(cs)
+            dice = rng.random()
+            if dice < 0.01:
+                self.add_entry(rng.choice(us), customer["id"], None, time_since,
+                               projects_id=project and project["id"], text="Site visit",
+                               lumpsum_services_id=1, lumpsum_services_amount=rng.randrange(1, 4))
+            elif dice < 0.05:
+                self.add_entry(rng.choice(us), customer["id"], rng.choice(ss)["id"], time_since,
+                               projects_id=project and project["id"], text="Lump sum",
+                               lumpsum=float(rng.randrange(10, 500)))
+            else:
+                self.add_entry(rng.choice(us), customer["id"], rng.choice(ss)["id"], time_since,
+                               time_since + datetime.timedelta(minutes=rng.randrange(5, 240)),
+                               projects_id=project and project["id"],
+                               text=f"Working on ticket #{rng.randrange(1000)}",
+                               billable=rng.choice([0, 1]))
+
+    # Request handling
+
+    def _check_limits(self, user):
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise _HttpError(503, "Service temporarily unavailable")
+        if self.rate_limit is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(user, (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+            if tokens < 1:
+                self._buckets[user] = (tokens, now)
+                raise _HttpError(429, "Too many requests")
+            self._buckets[user] = (tokens - 1, now)
+
+    def handle(self, method, path, body, user):
+        """Answer one request, returns `(status, body)`."""
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        url = urllib.parse.urlsplit(path)
+        endpoint = url.path.split("/api/", 1)[-1].strip("/")
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        params.update((k, v[-1]) for k, v in urllib.parse.parse_qs(body).items())
+        with self._lock:
+            self.requests += 1
+        try:
+            self._check_limits(user)
+            for pattern, methods in self._routes:
+                match = re.fullmatch(pattern, endpoint)
+                if match and method in methods:
+                    with self._lock:
+                        # Serialized under the lock, the dicts are shared
+                        response = methods[method](self, self.user_id(user), params, *match.groups())
+                        return 200, json.dumps(response).encode()
+            raise _HttpError(404, f"no such endpoint: {method} {endpoint}")
+        except _HttpError as e:
+            return e.status, json.dumps({"error": {"message": e.message}}).encode()
+
+    def _page(self, items, key, params):
+        page = int(params.get("page") or 1)
+        count_pages = max(1, -(-len(items) // self.page_size))
+        return {
+            key: items[(page - 1) * self.page_size:page * self.page_size],
+            "paging": {
+                "items_per_page": self.page_size, "current_page": page,
+                "count_pages": count_pages, "count_items": len(items),
+            },
+        }
+
+    def _get(self, table, id, what):
+        item = table.get(int(id))
+        if item is None:
+            raise _HttpError(404, f"{what} {id} not found")
+        return item
+
+    def _list_customers(self, users_id, params):
+        items = list(self.customers.values())
+        if "filter[active]" in params:
+            items = [c for c in items if c["active"] == bool(int(params["filter[active]"]))]
+        return self._page(items, "customers", params)
+
+    def _list_users(self, users_id, params):
+        items = list(self.users.values())
+        if "filter[active]" in params:
+            items = [u for u in items if u["active"] == bool(int(params["filter[active]"]))]
+        return self._page(items, "users", params)
+
+    def _get_user(self, users_id, params, id):
+        for user in self.users.values():
+            if user["id"] == int(id):
+                return {"user": user}
+        raise _HttpError(404, f"user {id} not found")
+
+    def _list_projects(self, users_id, params):
+        items = list(self.projects.values())
+        if "filter[active]" in params:
+            items = [p for p in items if p["active"] == bool(int(params["filter[active]"]))]
+        if "filter[customers_id]" in params:
+            items = [p for p in items if p["customers_id"] == int(params["filter[customers_id]"])]
+        return self._page(items, "projects", params)
+
+    def _list_entries(self, users_id, params):
+        try:
+            since = _parse_time(params["time_since"])
+            until = _parse_time(params["time_until"])
+        except (KeyError, ValueError):
+            raise _HttpError(400, "time_since and time_until are required")
+        now = iso8601(_now())
+        since, until = iso8601(since), iso8601(until)
+        items = [
+            e for e in self.entries.values()
+            if e["time_since"] < until and (e.get("time_until") or now) >= since
+        ]
+        for name in _ENTRY_FILTERS:
+            value = params.get(f"filter[{name}]")
+            if value is not None:
+                items = [e for e in items if str(e.get(name)) == value]
+        if "filter[text]" in params:
+            items = [e for e in items if params["filter[text]"] in (e["text"] or "")]
+        items.sort(key=lambda e: (e["time_since"], e["id"]))
+        return self._page(items, "entries", params)
+
+    def _add_entry(self, users_id, params):
+        entry = self.add_entry(
+            int(params.get("users_id", users_id)), int(params["customers_id"]),
+            int(params["services_id"]) if params.get("services_id") else None,
+            _parse_time(params["time_since"]),
+            _parse_time(params["time_until"]) if params.get("time_until") else None,
+            projects_id=int(params["projects_id"]) if params.get("projects_id") else None,
+            text=params.get("text"), billable=int(params.get("billable", 0)),
+            lumpsum=float(params["lumpsum"]) if params.get("lumpsum") else None,
+            lumpsum_services_id=int(params["lumpsum_services_id"]) if params.get("lumpsum_services_id") else None,
+            lumpsum_services_amount=float(params["lumpsum_services_amount"])
+            if params.get("lumpsum_services_amount") else None
+        )
+        return {"entry": entry}
+
+    def _edit_entry(self, users_id, params, id):
+        entry = self._get(self.entries, id, "entry")
+        for k, v in params.items():
+            if k in ["customers_id", "projects_id", "services_id", "users_id", "billable", "texts_id"]:
+                v = int(v) if v != "" else None
+            elif k == "lumpsum":
+                v = float(v)
+            elif k in ["time_since", "time_until"]:
+                v = iso8601(_parse_time(v))
+            elif k != "text":
+                continue
+            entry[k] = v
+        if entry["type"] == 1 and entry["time_until"] is not None:
+            entry["duration"] = int(
+                (_parse_time(entry["time_until"]) - _parse_time(entry["time_since"])).total_seconds()
+            )
+        entry["time_last_change"] = iso8601(_now())
+        return {"entry": entry}
+
+    def _delete_entry(self, users_id, params, id):
+        entry = self.entries.pop(int(id), None)
+        if entry is None:
+            raise _HttpError(404, f"entry {id} not found")
+        return {"success": True}
+
+    def _stop(self, users_id, now):
+        id = self._running.pop(users_id, None)
+        if id is None:
+            return None
+        entry = self.entries[id]
+        entry.update({
+            "time_until": iso8601(now), "clocked": False, "time_clocked_since": None,
+            "duration": int((now - _parse_time(entry["time_since"])).total_seconds()),
+            "time_last_change": iso8601(now),
+        })
+        return entry
+
+    def _current_clock(self, users_id, params):
+        id = self._running.get(users_id)
+        return {"running": self.entries[id] if id is not None else None}
+
+    def _start_clock(self, users_id, params):
+        now = _now()
+        time_since = _parse_time(params["time_since"]) if params.get("time_since") else now
+        stopped = self._stop(users_id, now)
+        running = self.add_entry(
+            users_id, int(params["customers_id"]), int(params["services_id"]), time_since,
+            projects_id=int(params["projects_id"]) if params.get("projects_id") else None,
+            text=params.get("text"), billable=int(params.get("billable") or 0)
+        )
+        return {"running": running, "stopped": stopped, "stopped_has_been_truncated": False}
+
+    def _stop_clock(self, users_id, params, id):
+        if self._running.get(users_id) != int(id):
+            raise _HttpError(400, f"entry {id} is not the running clock")
+        return {"stopped": self._stop(users_id, _now()), "running": None}
+
+    _routes = [
+        (r"v2/clock", {"GET": _current_clock, "POST": _start_clock}),
+        (r"v2/clock/(\d+)", {"DELETE": _stop_clock}),
+        (r"v2/entries", {"GET": _list_entries, "POST": _add_entry}),
+        (r"v2/entries/(\d+)", {
+            "GET": lambda self, u, p, id: {"entry": self._get(self.entries, id, "entry")},
+            "PUT": _edit_entry,
+            "DELETE": _delete_entry,
+        }),
+        (r"v2/customers", {"GET": _list_customers}),
+        (r"v2/customers/(\d+)", {
+            "GET": lambda self, u, p, id: {"customer": self._get(self.customers, id, "customer")},
+        }),
+        (r"v2/projects", {"GET": _list_projects}),
+        (r"v2/projects/(\d+)", {
+            "GET": lambda self, u, p, id: {"project": self._get(self.projects, id, "project")},
+        }),
+        (r"v2/users", {"GET": _list_users}),
+        (r"v2/users/(\d+)", {"GET": _get_user}),
+        (r"services", {"GET": lambda self, u, p: {"services": list(self.services.values())}}),
+        (r"services/(\d+)", {
+            "GET": lambda self, u, p, id: {"service": self._get(self.services, id, "service")},
+        }),
+    ]
+
+
+class FakeRedis:
+    """A fake Redis server on a local port, speaking just enough of the
+    protocol for `clockodo.cache.RedisBackend`: PING, AUTH, SELECT,
+    GET, SET (with EX, PX and NX), DEL and INCR.
+
+    `commands` counts the commands it answered."""
+    def __init__(self, password=None, port=0):
+        self.password = password
+        self.data = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                authenticated = fake.password is None
+                while True:
+                    args = self._read()
+                    if args is None:
+                        return
+                    command = args[0].upper()
+                    if command == b"AUTH":
+                        authenticated = args[-1].decode() == fake.password
+                        reply = b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n"
+                    elif not authenticated:
+                        reply = b"-NOAUTH Authentication required.\r\n"
+                    else:
+                        reply = fake.execute(command, args[1:])
+                    self.wfile.write(reply)
+
+            def _read(self):
+                line = self.rfile.readline()
+                if not line.startswith(b"*"):
+                    return None
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self._server = Server(("127.0.0.1", port), Handler)
+        self.port = self._server.server_address[1]
+        self.url = f"redis://127.0.0.1:{self.port}/0"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _live(self, key):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return item
+
+    def execute(self, command, args):
+        with self._lock:
+            self.commands += 1
+            if command == b"PING":
+                return b"+PONG\r\n"
+            elif command == b"SELECT":
+                return b"+OK\r\n"
+            elif command == b"GET":
+                item = self._live(args[0])
+                if item is None:
+                    return b"$-1\r\n"
+                return b"$%d\r\n%s\r\n" % (len(item[0]), item[0])
+            elif command == b"SET":
+                key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+                expires = None
+                if b"EX" in options:
+                    expires = time.monotonic() + int(options[options.index(b"EX") + 1])
+                elif b"PX" in options:
+                    expires = time.monotonic() + int(options[options.index(b"PX") + 1]) / 1000
+                if b"NX" in options and self._live(key) is not None:
+                    return b"$-1\r\n"
+                self.data[key] = (value, expires)
+                return b"+OK\r\n"
+            elif command == b"DEL":
+                return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+            elif command == b"INCR":
+                item = self._live(args[0])
+                value = int(item[0]) + 1 if item is not None else 1
+                self.data[args[0]] = (str(value).encode(), item[1] if item is not None else None)
+                return b":%d\r\n" % value
+            return b"-ERR unknown command '%s'\r\n" % command
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@click.command()
+@click.option("--port", default=8080)
+@click.option("--customers", default=10)
+@click.option("--projects", default=30)
+@click.option("--services", default=5)
+@click.option("--entries", default=1000)
+@click.option("--latency", default=0.0, help="Seconds to wait before every response")
+@click.option("--error-rate", default=0.0, help="Fraction of requests failing with 503")
+@click.option("--rate-limit", default=None, type=float, help="Requests per second per user")
+def main(port, customers, projects, services, entries, latency, error_rate, rate_limit):
+    fake = FakeClockodo(latency=latency, error_rate=error_rate, rate_limit=rate_limit, port=port)
+    fake.populate(customers=customers, projects=projects, services=services, entries=entries)
+    click.echo(f"Serving a fake clocko:do at {fake.url}")
+    with fake:
+        try:
+            fake._thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
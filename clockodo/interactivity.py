@@ -1,7 +1,8 @@
 import datetime
 import functools
+import threading
+import concurrent.futures
 import clockodo
-import inquirer
 
 def our_tz():
     return datetime.datetime.now(tz=datetime.timezone.utc).astimezone().tzinfo
@@ -15,19 +16,56 @@ def inject_api(fun, api):
     return _inner
 
 
-def memoize_once(fun):
-    _cached = None
+_memo_lock = threading.Lock()
+
+
+def _memoize(fun, key):
+    # Results live on the client itself, so they go away with it and a
+    # new client can never see another one's. The lock only guards the
+    # dict; the first caller for a key fetches, the others wait for it.
     @functools.wraps(fun)
     def _inner(*args, **kwargs):
-        nonlocal _cached
-        if _cached is None:
-            _cached = fun(*args, **kwargs)
-        return _cached
+        api = kwargs["api"]
+        k = (_inner, key(*args))
+        with _memo_lock:
+            cached = api.__dict__.setdefault("_memoized", {})
+            pending = cached.get(k)
+            fetching = pending is None
+            if fetching:
+                pending = cached[k] = concurrent.futures.Future()
+        if not fetching:
+            return pending.result()
+        try:
+            value = fun(*args, **kwargs)
+        except BaseException as e:
+            with _memo_lock:
+                del cached[k]
+            pending.set_exception(e)
+            raise
+        pending.set_result(value)
+        return value
 
     return _inner
 
 
-@memoize_once
+def memoize_once(fun):
+    """Cache the result of `fun` per API client.
+
+    Safe to use from several threads, `fun` is only ever called once
+    per client."""
+    return _memoize(fun, lambda *args: None)
+
+
+def memoize_by_customer(fun):
+    """Like `memoize_once`, but per client and `answers["customer"]`."""
+    def key(answers, *args):
+        customer = answers["customer"]
+        return customer.id if customer is not None else None
+
+    return _memoize(fun, key)
+
+
+@memoize_by_customer
 def project_entries(answers, api=None):
     return [("(none)", None)] \
         + [(p.name, p) for p in api.iter_projects(
@@ -47,6 +85,7 @@ def service_entries(answers, api=None):
 
 
 def validate_timestamp(answers, current):
+    import inquirer.errors
     try:
         current = datetime.datetime.strptime(current, "%H:%M:%S").time()
     except ValueError:
@@ -71,12 +110,57 @@ def get_last_clock_out_time(api=None):
         datetime.time(0, tzinfo=our_tz())
     )
 
-    try:
-        # Get the last clock entry for this period
-        *_, last = api.iter_entries(time_since, time_until)
-    except ValueError:
-        # Fallback in case the iterator is empty
-        last = None
+    # Get the last clock entry for this period
+    last = next(api.iter_entries_reverse(time_since, time_until), None)
 
     if isinstance(last, clockodo.entry.ClockEntry) and last.time_until is not None:
         return last.time_until.astimezone(our_tz()).strftime("%H:%M:%S")
+
+
+class Prefetcher:
+    """Fetches everything the interactive prompts need in the background.
+
+    All downloads start as soon as the object is created, while the user
+    is still reading the first question. The methods below can be used
+    as `choices` and `default` callables for inquirer questions and only
+    block if their data hasn't arrived yet."""
+    def __init__(self, api, last_clock_out=True, max_workers=4):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._customers = self._executor.submit(
+            lambda: [(c.name, c) for c in api.iter_customers(active=True)]
+        )
+        self._services = self._executor.submit(
+            lambda: [(s.name, s) for s in filter(lambda s: s.active, api.iter_services())]
+        )
+        # One scan over all active projects is cheaper than a scan per
+        # customer, and makes switching customers free.
+        self._projects = self._executor.submit(self._fetch_projects, api)
+        self._last_clock_out = None
+        if last_clock_out:
+            self._last_clock_out = self._executor.submit(get_last_clock_out_time, api=api)
+
+    @staticmethod
+    def _fetch_projects(api):
+        projects = {}
+        for p in api.iter_projects(active=True):
+            projects.setdefault(p.customers_id, []).append((p.name, p))
+        return projects
+
+    def customer_entries(self, answers):
+        return self._customers.result()
+
+    def project_entries(self, answers):
+        customer = answers["customer"]
+        return [("(none)", None)] \
+            + self._projects.result().get(customer.id if customer is not None else None, [])
+
+    def service_entries(self, answers):
+        return self._services.result()
+
+    def last_clock_out_time(self, answers):
+        if self._last_clock_out is None:
+            return None
+        return self._last_clock_out.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
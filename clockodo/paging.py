@@ -0,0 +1,159 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import json
+import base64
+import hashlib
+from clockodo import resilience, trace
+from clockodo.api import ClockodoError
+
+
+class Paginator:
+    """Iterates over all items of a paged clocko:do list endpoint.
+
+    The position after the last item handed out can be saved with
+    `checkpoint()` at any time, and passed back as `checkpoint` later
+    to continue from there instead of starting over.
+
+    Without an `anchor`, pages are walked by number, and items that
+    shift onto the next page because of concurrent inserts are
+    skipped by their `id`.
+
+    With an `anchor` (for entries, `"time_since"`), every page is
+    requested with the anchor parameter moved up to the last item
+    seen, which requires the endpoint to return items sorted by that
+    field. Inserts or deletions in the part that was already read
+    can't make the scan skip or repeat anything then, and the
+    checkpoint stays valid however long the scan was interrupted.
+
+    An item only counts as done once the next one is requested (or
+    `commit()` is called), so a checkpoint taken while the caller is
+    still working on an item, e.g. after it failed, includes it again."""
+    def __init__(self, api, endpoint, key, decode, params, anchor=None, checkpoint=None):
+        self._api = api
+        self.endpoint = endpoint
+        self.key = key
+        self.decode = decode
+        self.params = {k: v for k, v in params.items() if k != "page" and v is not None}
+        self.anchor_field = anchor
+        self._page = 1
+        self._anchor = None
+        self._seen = set()
+        self._done = False
+        # `(page, anchor, seen, id)` from before the item handed out
+        # last, until the caller comes back for the next one
+        self._pending = None
+        self._items = None
+        # Pages are fetched lazily, maybe after the block that set a
+        # deadline was left, so remember it now
+        self._deadline = resilience.current_deadline()
+        if checkpoint is not None:
+            self._restore(checkpoint)
+
+    def _fingerprint(self):
+        blob = json.dumps([self.endpoint, self.params], sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+    def checkpoint(self) -> str:
+        """A token for the position after the last item the caller is
+        done with."""
+        page, anchor, seen = self._page, self._anchor, self._seen
+        if self._pending is not None:
+            page, anchor, seen, item_id = self._pending
+            seen = seen - {item_id}
+        state = {
+            "query": self._fingerprint(),
+            "page": page,
+            "anchor": anchor,
+            "seen": sorted(seen),
+            "done": self._done,
+        }
+        return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+    def _restore(self, token):
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except ValueError:
+            raise ClockodoError("malformed checkpoint token")
+        if state["query"] != self._fingerprint():
+            raise ClockodoError("this checkpoint token belongs to a different query")
+        self._page = state["page"]
+        self._anchor = state["anchor"]
+        self._seen = set(state["seen"])
+        self._done = state["done"]
+
+    def commit(self):
+        """Mark the item handed out last as done right away."""
+        self._pending = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._items is None:
+            self._items = self._iterate()
+        return next(self._items)
+
+    def _iterate(self):
+        while not self._done:
+            params = dict(self.params, page=self._page)
+            if self._anchor is not None:
+                params[self.anchor_field] = self._anchor
+            with resilience.deadline_at(self._deadline), \
+                    trace.span("page", "paging", endpoint=self.endpoint, page=self._page):
+                response = self._api._api_call(self.endpoint, params=params)
+
+            page_anchor = self._anchor
+            page_ids = set()
+            for blob in response[self.key]:
+                if blob["id"] in self._seen:
+                    continue
+                # When the anchor moves, `_seen` is replaced rather than
+                # cleared, so this keeps the state before the item intact
+                before = (self._page, self._anchor, self._seen, blob["id"])
+                if self.anchor_field is not None:
+                    value = blob[self.anchor_field]
+                    if self._anchor is not None and value < self._anchor:
+                        # Returned because it overlaps the new window,
+                        # but it started (and was yielded) before
+                        continue
+                    if value != self._anchor:
+                        self._anchor = value
+                        self._seen = set()
+                        self._page = 1
+                with trace.span("decode", "decode"):
+                    item = self.decode(blob)
+                self._seen.add(blob["id"])
+                page_ids.add(blob["id"])
+                self._pending = before
+                yield item
+                self._pending = None
+
+            paging = response.get("paging")
+            if paging is None or not response[self.key] \
+                    or paging["current_page"] >= paging["count_pages"]:
+                self._done = True
+            elif self.anchor_field is None:
+                # Keep the ids of this page around to drop items that
+                # shift onto the next one.
+                self._page = paging["current_page"] + 1
+                self._seen = page_ids
+            elif self._anchor == page_anchor:
+                # The whole page had the same anchor value, so moving
+                # the window doesn't help. Fall back to the next page.
+                self._page = paging["current_page"] + 1
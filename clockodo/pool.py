@@ -0,0 +1,169 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import threading
+import collections
+import concurrent.futures
+import requests.adapters
+import clockodo
+from clockodo.api import EntityCache, RequestsTransport, ClockodoError
+from clockodo.cache import SharedCache
+
+
+class ClockodoPool:
+    """Manages clients for many users and clocko:do accounts.
+
+    All clients share one transport, and thus one HTTP connection pool
+    (pass an `HttpxTransport` to multiplex over HTTP/2 instead). Clients that belong to
+    the same account (company) share an entity cache, so customers,
+    projects and services are only fetched once per account.
+
+    Work submitted through `submit()` runs on at most `max_concurrency`
+    threads. Accounts are served round-robin, so one account with a
+    long queue can't starve the others. No account runs more than
+    `per_account_concurrency` tasks at once, nor has more HTTP requests
+    in flight, counting every page and every hedged duplicate.
+
+    With a `clockodo.cache.CacheBackend` as `cache_backend`, accounts
+    use a `SharedCache` in it instead, shared with other processes."""
+    def __init__(self, max_concurrency=8, per_account_concurrency=4, cache_size=1000, transport=None,
+                 cache_backend=None):
+        self.max_concurrency = max_concurrency
+        self.per_account_concurrency = per_account_concurrency
+        self.cache_size = cache_size
+        self.cache_backend = cache_backend
+
+        if transport is None:
+            transport = RequestsTransport(requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency))
+        self._transport = transport
+
+        self._caches = {}
+        self._limits = {}
+        self._clients = {}
+        self._accounts = {}
+
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._ready = collections.deque()
+        self._running = collections.Counter()
+        self._shutdown = False
+        self._workers = []
+
+    def client(self, api_user, api_token, account=None, language="en"):
+        """Get the client for `api_user`, creating it if necessary.
+
+        `account` names the clocko:do account the user belongs to and
+        decides which entity cache the client uses. It defaults to
+        the user itself."""
+        if account is None:
+            account = api_user
+        with self._cond:
+            if api_user not in self._clients:
+                if account not in self._caches:
+                    if self.cache_backend is not None:
+                        self._caches[account] = SharedCache(self.cache_backend, namespace=account)
+                    else:
+                        self._caches[account] = EntityCache(maxsize=self.cache_size)
+                    self._limits[account] = threading.BoundedSemaphore(self.per_account_concurrency)
+                self._clients[api_user] = clockodo.Clockodo(
+                    api_user, api_token, language=language,
+                    transport=self._transport,
+                    cache=self._caches[account],
+                    limiter=self._limits[account]
+                )
+                self._accounts[api_user] = account
+            return self._clients[api_user]
+
+    def account_of(self, client):
+        return self._accounts[client.user]
+
+    def submit(self, client, fun, *args, **kwargs) -> concurrent.futures.Future:
+        """Schedule `fun(client, *args, **kwargs)` and return a future."""
+        future = concurrent.futures.Future()
+        account = self.account_of(client)
+        with self._cond:
+            if self._shutdown:
+                raise ClockodoError("this pool was shut down")
+            queue = self._queues.setdefault(account, collections.deque())
+            if not queue:
+                self._ready.append(account)
+            queue.append((future, client, fun, args, kwargs))
+            if len(self._workers) < self.max_concurrency:
+                worker = threading.Thread(target=self._worker, daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify()
+        return future
+
+    def map(self, fun, clients, *args, **kwargs):
+        """Run `fun` for every client and yield results in order."""
+        futures = [self.submit(c, fun, *args, **kwargs) for c in clients]
+        for future in futures:
+            yield future.result()
+
+    def _next_task(self):
+        # Called with self._cond held. Picks the first account in
+        # round-robin order that is below its concurrency limit.
+        for _ in range(len(self._ready)):
+            account = self._ready.popleft()
+            if self._running[account] >= self.per_account_concurrency:
+                self._ready.append(account)
+                continue
+            queue = self._queues[account]
+            task = queue.popleft()
+            if queue:
+                self._ready.append(account)
+            self._running[account] += 1
+            return account, task
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                picked = self._next_task()
+                while picked is None:
+                    if self._shutdown and not self._ready:
+                        return
+                    self._cond.wait()
+                    picked = self._next_task()
+            account, (future, client, fun, args, kwargs) = picked
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fun(client, *args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            with self._cond:
+                self._running[account] -= 1
+                self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        for client in self._clients.values():
+            client.close()
+        self._transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -16,10 +16,17 @@
 # damage or existence of a defect, except proven that it results out
 # of said person's immediate fault when using the work as intended.
 
-import functools
-from clockodo.api import FromJsonBlob, ClockodoApi
+from clockodo.api import FromJsonBlob, ClockodoApi, cached_entity
+from clockodo.paging import Paginator
 
 class Project(FromJsonBlob):
+    _schema = {
+        "id": None, "customers_id": None, "name": None, "number": None,
+        "active": None, "billable_default": None, "note": None,
+        "budget_money": None, "budget_is_hours": None, "budget_is_not_strict": None,
+        "completed": None, "billed_money": None, "billed_completely": None,
+        "revenue_factor": None,
+    }
     def __init__(self, api, name, customer,
                  number=None,
                  active=True,
@@ -54,9 +61,10 @@ class Project(FromJsonBlob):
 
 
 class ProjectApi(ClockodoApi):
-    @functools.lru_cache(maxsize=100)
+    @cached_entity("project")
     def get_project(self, id):
         entry = self._api_call(f"v2/projects/{id}")["project"]
+        return Project.from_json_blob(self, entry)
 
     def list_projects(self, customer=None, active=None, page=None):
         params = {
@@ -72,22 +80,15 @@ class ProjectApi(ClockodoApi):
 
         return response
 
-    def iter_projects(self, active=None, customer=None):
-        count_pages = None
-        params = {
-            "page": 1
-        }
+    def iter_projects(self, active=None, customer=None, checkpoint=None):
+        params = {}
         if active is not None:
             params["filter[active]"] = str(int(active))
         if customer is not None:
             params["filter[customers_id]"] = customer.id
 
-        while count_pages is None or params["page"] <= count_pages:
-            response = self._api_call(f"v2/projects", params=params)
-            yield from map(lambda c: Project.from_json_blob(self, c), response["projects"])
-
-            if "paging" not in response:
-                break
-            if count_pages is None:
-                count_pages = response["paging"]["count_pages"]
-            params["page"] = response["paging"]["current_page"] + 1
+        return Paginator(
+            self, "v2/projects", "projects",
+            lambda p: Project.from_json_blob(self, p),
+            params, checkpoint=checkpoint
+        )
@@ -0,0 +1,151 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import time
+import threading
+import contextlib
+import contextvars
+import collections
+
+_deadline = contextvars.ContextVar("clockodo_deadline", default=None)
+
+
+def current_deadline():
+    """The active deadline as a `time.monotonic()` value, or None."""
+    return _deadline.get()
+
+
+def remaining():
+    """Seconds left until the active deadline, or None."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+@contextlib.contextmanager
+def deadline_at(deadline):
+    """Make `deadline` (a `time.monotonic()` value or None) the active one."""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Every API call made inside this block, including pages fetched
+    by iterators created inside it, has to finish within `seconds`.
+
+    Nested deadlines can only make the active one shorter."""
+    new = time.monotonic() + seconds
+    outer = _deadline.get()
+    with deadline_at(new if outer is None else min(new, outer)):
+        yield
+
+
+class LatencyTracker:
+    """Keeps the last `size` latencies to estimate a percentile."""
+    MIN_SAMPLES = 10
+
+    def __init__(self, size=100, default=1.0):
+        self.default = default
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    @property
+    def ready(self):
+        """Whether there are enough samples for a real estimate."""
+        with self._lock:
+            return len(self._samples) >= self.MIN_SAMPLES
+
+    def percentile(self, p=0.95):
+        with self._lock:
+            samples = sorted(self._samples)
+        # Too few samples to say anything, fall back to a guess
+        if len(samples) < self.MIN_SAMPLES:
+            return self.default
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class CircuitBreaker:
+    """Stops calling an API that keeps failing.
+
+    After `threshold` failures in a row the breaker opens, and calls
+    fail right away for `cooldown` seconds. GET requests are answered
+    from the last good response to the same request meanwhile, if there
+    is one. After the cooldown one request is let through, and its
+    outcome decides whether the breaker closes or stays open."""
+    def __init__(self, threshold=5, cooldown=30.0, fallback_size=256):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.fallback_size = fallback_size
+        self._failures = 0
+        self._opened_at = None
+        # The thread making the trial request, if there is one
+        self._trial = None
+        self._fallback = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial is None and time.monotonic() - self._opened_at >= self.cooldown:
+                self._trial = threading.get_ident()
+                return True
+            return False
+
+    def success(self, key=None, content=None):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = None
+            if key is not None:
+                self._fallback[key] = content
+                self._fallback.move_to_end(key)
+                if len(self._fallback) > self.fallback_size:
+                    self._fallback.popitem(last=False)
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                self._trial = None
+
+    def release(self):
+        """End this thread's trial request without an outcome, e.g.
+        because it failed for reasons of its own."""
+        with self._lock:
+            if self._trial == threading.get_ident():
+                self._trial = None
+
+    def fallback(self, key):
+        """The body of the last good response for `key`, or None."""
+        with self._lock:
+            return self._fallback.get(key)
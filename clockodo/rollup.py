@@ -0,0 +1,207 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import json
+import datetime
+from clockodo.entry import ClockEntry
+from clockodo.api import ClockodoError
+
+# Dimensions every daily rollup is broken down by
+ROLLUP_KEY = ["users_id", "customers_id", "projects_id", "services_id", "billable"]
+
+
+class Totals:
+    def __init__(self, seconds=0, lumpsum=0.0, entries=0):
+        self.seconds = seconds
+        self.lumpsum = lumpsum
+        self.entries = entries
+
+    def add(self, seconds, lumpsum, entries=1):
+        self.seconds += seconds
+        self.lumpsum += lumpsum
+        self.entries += entries
+
+    @property
+    def duration(self) -> datetime.timedelta:
+        return datetime.timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return f"Totals(seconds={self.seconds}, lumpsum={self.lumpsum}, entries={self.entries})"
+
+
+def _local_day(dt: datetime.datetime) -> datetime.date:
+    return dt.astimezone().date()
+
+
+def _day_bounds(day: datetime.date):
+    since = datetime.datetime.combine(day, datetime.time(0)).astimezone()
+    until = datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time(0)).astimezone()
+    return since, until
+
+
+def _contribution(entry):
+    """Returns `(day, key, seconds, lumpsum)` for an entry.
+
+    Entries are attributed to the local day they start on."""
+    key = tuple(getattr(entry, k, None) for k in ROLLUP_KEY)
+    seconds = 0
+    if isinstance(entry, ClockEntry):
+        if entry.time_until is None:
+            # Running clocks change every second, they're only counted
+            # when querying today's live data
+            return None
+        if getattr(entry, "duration", None) is not None:
+            seconds = entry.duration
+        else:
+            seconds = int((entry.time_until - entry.time_since).total_seconds())
+    lumpsum = getattr(entry, "lumpsum", None) or 0.0
+    return _local_day(entry.time_since), key, seconds, lumpsum
+
+
+class RollupStore:
+    """Per-day totals of entries by user, customer, project, service and
+    billability.
+
+    The store remembers which day and key every entry contributed to,
+    so changed entries are applied as a delta on the days they touch
+    without re-summing anything else. Range queries only look at one
+    bucket per day and key.
+
+    A store only holds entries matching `filters` (see
+    `clockodo.entry.entries_query()`). Rebuilding days clears them
+    completely, so building with other filters is refused; use one
+    store per set of filters instead."""
+    def __init__(self, filters={}):
+        self.filters = dict(filters)
+        self.days = {}
+        self._entries = {}
+        self._day_entries = {}
+
+    def _apply(self, contribution, sign):
+        day, key, seconds, lumpsum = contribution
+        bucket = self.days.setdefault(day, {})
+        totals = bucket.setdefault(key, Totals())
+        totals.add(sign * seconds, sign * lumpsum, sign)
+        if totals.entries == 0:
+            del bucket[key]
+
+    def update(self, entry):
+        """Add a new entry or apply the changes of an existing one."""
+        self.remove(entry.id)
+        contribution = _contribution(entry)
+        if contribution is None:
+            return
+        self._entries[entry.id] = contribution
+        self._day_entries.setdefault(contribution[0], set()).add(entry.id)
+        self._apply(contribution, 1)
+
+    def remove(self, entry_id):
+        contribution = self._entries.pop(entry_id, None)
+        if contribution is not None:
+            self._day_entries[contribution[0]].discard(entry_id)
+            self._apply(contribution, -1)
+
+    def _check_filters(self, filters):
+        if filters is None:
+            return self.filters
+        if dict(filters) != self.filters:
+            raise ClockodoError(
+                f"this store rolls up entries matching {self.filters!r}, not {dict(filters)!r}"
+            )
+        return self.filters
+
+    def build(self, api, since: datetime.date, until: datetime.date, filters=None):
+        """Fetch and roll up all entries of days `since` up to (excluding) `until`."""
+        filters = self._check_filters(filters)
+        for day in [d for d in self._day_entries if since <= d < until]:
+            self._clear_day(day)
+        time_since, _ = _day_bounds(since)
+        time_until, _ = _day_bounds(until)
+        for entry in api.iter_entries(time_since, time_until, filters=filters):
+            self.update(entry)
+
+    def _clear_day(self, day):
+        for entry_id in self._day_entries.pop(day, set()):
+            del self._entries[entry_id]
+        self.days.pop(day, None)
+
+    def refresh_days(self, api, days, filters=None):
+        """Recompute only the given days, e.g. after entries were deleted."""
+        for day in days:
+            self.build(api, day, day + datetime.timedelta(days=1), filters=filters)
+
+    def query(self, since: datetime.date, until: datetime.date,
+              by=("projects_id",), api=None, filters=None) -> dict:
+        """Sum up totals for days `since` up to (excluding) `until`,
+        grouped by the `ROLLUP_KEY` fields named in `by`.
+
+        If `api` is given and today is in range, today's totals are
+        computed from live data instead, including clocks running since
+        today. Like everywhere else, entries count on the day they start."""
+        filters = self._check_filters(filters)
+        indices = [ROLLUP_KEY.index(k) for k in by]
+        result = {}
+        today = datetime.date.today()
+        day = since
+        while day < until:
+            if api is not None and day == today:
+                buckets = self._live_day(api, day, filters)
+            else:
+                buckets = self.days.get(day, {})
+            for key, totals in buckets.items():
+                group = tuple(key[i] for i in indices)
+                result.setdefault(group, Totals()).add(totals.seconds, totals.lumpsum, totals.entries)
+            day += datetime.timedelta(days=1)
+
+        return result
+
+    def _live_day(self, api, day, filters):
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        buckets = {}
+        time_since, time_until = _day_bounds(day)
+        for entry in api.iter_entries(time_since, time_until, filters=filters):
+            # clocko:do also returns entries from earlier days that
+            # reach into this one, those belong to the day they started
+            if _local_day(entry.time_since) != day:
+                continue
+            key = tuple(getattr(entry, k, None) for k in ROLLUP_KEY)
+            if isinstance(entry, ClockEntry) and entry.time_until is None:
+                seconds = int((now - entry.time_since).total_seconds())
+                buckets.setdefault(key, Totals()).add(seconds, 0.0)
+                continue
+            contribution = _contribution(entry)
+            if contribution is not None:
+                buckets.setdefault(key, Totals()).add(*contribution[2:])
+        return buckets
+
+    def save(self, fp):
+        for entry_id, (day, key, seconds, lumpsum) in self._entries.items():
+            fp.write(json.dumps([entry_id, day.isoformat(), key, seconds, lumpsum]))
+            fp.write("\n")
+
+    @classmethod
+    def load(cls, fp, filters={}):
+        """Read a store written by `save()`, which had `filters`."""
+        store = cls(filters)
+        for line in fp:
+            entry_id, day, key, seconds, lumpsum = json.loads(line)
+            contribution = (datetime.date.fromisoformat(day), tuple(key), seconds, lumpsum)
+            store._entries[entry_id] = contribution
+            store._day_entries.setdefault(contribution[0], set()).add(entry_id)
+            store._apply(contribution, 1)
+        return store
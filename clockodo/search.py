@@ -0,0 +1,400 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+
+"""Full-text search over entry descriptions.
+
+Entries are kept in a local inverted index in `$XDG_CACHE_HOME/clockodo`,
+one per API user, so searching years of history doesn't touch the
+network. `sync()` only rescans the last few weeks,
+where entries are still likely to change, and a `Watcher` can keep the
+index current in between.
+
+A query is a list of words, all of which have to appear in the text.
+The last word also matches as a prefix. `customer:`, `project:` and
+`service:` terms keep hits whose customer, project or service name
+contains the given text."""
+
+import os
+import re
+import math
+import bisect
+import hashlib
+import datetime
+import functools
+import collections
+from clockodo.api import json_loader
+from clockodo.completion import cache_dir
+
+# `clockodo entries search` syncs first if the index is older than this
+MAX_AGE = 600
+# Entries starting after this are rescanned by every `sync()`
+RESCAN_DAYS = 31
+# Where the first `sync()` starts
+HISTORY_START = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+FACETS = ["customer", "project", "service"]
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"\w+")
+_FACET_TERM = re.compile(r"^(customer|project|service):(.+)$")
+# Positions in a document record
+TIME, USER, CUSTOMER, PROJECT, SERVICE, LENGTH, TEXT = range(7)
+
+
+def tokenize(text):
+    return _WORD.findall(text.casefold()) if text else []
+
+
+def index_path(user=None):
+    """Where the index of `user`'s entries is kept. Users see different
+    entries, so every one gets their own file."""
+    if user is None:
+        return os.path.join(cache_dir(), "search.json")
+    digest = hashlib.sha256(user.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir(), f"search-{digest}.json")
+
+
+class Hit(collections.namedtuple("Hit", [
+    "id", "score", "time_since", "text", "customer", "project", "service"
+])):
+    def __str__(self):
+        where = " / ".join(name for name in (self.customer, self.project, self.service) if name)
+        return f"#{self.id} {self.time_since.astimezone():%Y-%m-%d %H:%M} {where}: {self.text or ''}"
+
+
+class Results(list):
+    """The hits of a search, best first.
+
+    `total` is the number of matching entries, of which the hits are
+    the best `limit`, and `facets` counts the customers, projects and
+    services of all of them."""
+    def __init__(self, hits, index, matches):
+        super().__init__(hits)
+        self.total = len(matches)
+        self._index = index
+        self._matches = matches
+
+    @functools.cached_property
+    def facets(self) -> dict:
+        return self._index._facet_counts(self._matches)
+
+
+class SearchIndex:
+    """An inverted index over the `text` of entries.
+
+    Every document is a list of start time (UNIX time), user,
+    customer, project and service IDs, token count and text. Postings
+    map a token to the IDs of the entries containing it, once per
+    occurrence. Without a `path`, the index of API user `user` is
+    used."""
+    def __init__(self, path=None, user=None):
+        self.path = path if path is not None else index_path(user)
+        self.docs = {}
+        self.postings = {}
+        self.names = {facet: {} for facet in FACETS}
+        self.synced = None
+        self._tokens = None
+        self._counts = {}
+        self._norms = None
+        self._total_length = 0
+
+    @classmethod
+    def load(cls, path=None, user=None):
+        """The index stored at `path` (or `user`'s), or an empty one."""
+        index = cls(path, user)
+        try:
+            with open(index.path, "rb") as fp:
+                data = json_loader()(fp.read())
+        except (FileNotFoundError, ValueError):
+            return index
+        index.docs = {int(k): v for k, v in data["docs"].items()}
+        index.postings = data["postings"]
+        index.names = {facet: {int(k): v for k, v in names.items()} for facet, names in data["names"].items()}
+        index.synced = data["synced"]
+        index._total_length = sum(doc[LENGTH] for doc in index.docs.values())
+        return index
+
+    def save(self):
+        import json
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump({
+                "synced": self.synced,
+                "names": self.names,
+                "docs": self.docs,
+                "postings": self.postings,
+            }, fp, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def add(self, entry):
+        """Add an entry, or replace the indexed version of it."""
+        tokens = tokenize(entry.text)
+        doc = [
+            entry.time_since.timestamp(),
+            getattr(entry, "users_id", None),
+            getattr(entry, "customers_id", None),
+            getattr(entry, "projects_id", None),
+            getattr(entry, "services_id", None),
+            len(tokens),
+            entry.text,
+        ]
+        # Most entries a sync sees again haven't changed, and removing
+        # one has to go through the postings of all its tokens
+        if self.docs.get(entry.id) == doc:
+            return
+        self.remove(entry.id)
+        self.docs[entry.id] = doc
+        self._total_length += len(tokens)
+        self._norms = None
+        for token in tokens:
+            postings = self.postings.get(token)
+            if postings is None:
+                self.postings[token] = postings = []
+                self._tokens = None
+            postings.append(entry.id)
+            self._counts.pop(token, None)
+
+    def remove(self, entry_id):
+        doc = self.docs.pop(entry_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc[LENGTH]
+        self._norms = None
+        for token in set(tokenize(doc[TEXT])):
+            self._counts.pop(token, None)
+            postings = [i for i in self.postings[token] if i != entry_id]
+            if postings:
+                self.postings[token] = postings
+            else:
+                del self.postings[token]
+                self._tokens = None
+
+    def sync(self, api, since=None, now=None):
+        """Fetch new and changed entries from clocko:do.
+
+        Everything from `since` on is fetched again, by default the
+        last `RESCAN_DAYS` days before the previous sync, or all of
+        history the first time. Entries that are gone from that range
+        are dropped from the index."""
+        now = now if now is not None else datetime.datetime.now(tz=datetime.timezone.utc)
+        if since is None:
+            if self.synced is None:
+                since = HISTORY_START
+            else:
+                since = datetime.datetime.fromtimestamp(self.synced, tz=datetime.timezone.utc) \
+                    - datetime.timedelta(days=RESCAN_DAYS)
+        self.names = {
+            "customer": {c.id: c.name for c in api.iter_customers()},
+            "project": {p.id: p.name for p in api.iter_projects()},
+            "service": {s.id: s.name for s in api.iter_services()},
+        }
+        seen = set()
+        for entry in api.iter_entries(since, now + datetime.timedelta(days=1)):
+            self.add(entry)
+            seen.add(entry.id)
+        start = since.timestamp()
+        for entry_id in [i for i, doc in self.docs.items() if doc[TIME] >= start and i not in seen]:
+            self.remove(entry_id)
+        self.synced = now.timestamp()
+
+    def attach(self, watcher):
+        """Keep the index up to date from a `clockodo.watch.Watcher`."""
+        from clockodo.watch import EntryAdded, EntryChanged, EntryRemoved
+
+        def on_event(event):
+            if isinstance(event, (EntryAdded, EntryChanged)):
+                self.add(event.entry)
+            elif isinstance(event, EntryRemoved):
+                self.remove(event.entry.id)
+
+        return watcher.subscribe(on_event)
+
+    def _matching_tokens(self, prefix):
+        if self._tokens is None:
+            self._tokens = sorted(self.postings)
+        i = bisect.bisect_left(self._tokens, prefix)
+        while i < len(self._tokens) and self._tokens[i].startswith(prefix):
+            yield self._tokens[i]
+            i += 1
+
+    def _term_counts(self, token):
+        """Occurrences of `token` per entry."""
+        counts = self._counts.get(token)
+        if counts is None:
+            counts = self._counts[token] = collections.Counter(self.postings[token])
+        return counts
+
+    def _length_norms(self):
+        """The BM25 length normalization of every document."""
+        if self._norms is None:
+            average = self._total_length / len(self.docs) if self.docs else 1
+            self._norms = {
+                i: K1 * (1 - B + B * doc[LENGTH] / (average or 1)) for i, doc in self.docs.items()
+            }
+        return self._norms
+
+    def _scores(self, words, prefix):
+        """BM25 scores of the documents containing all of `words`."""
+        n = len(self.docs)
+        terms = []
+        for k, word in enumerate(words):
+            if prefix and k == len(words) - 1:
+                tokens = list(self._matching_tokens(word))
+            else:
+                tokens = [word] if word in self.postings else []
+            if not tokens:
+                return {}
+            terms.append([self._term_counts(token) for token in tokens])
+        # Starting with the rarest term keeps the candidates few
+        terms.sort(key=lambda counts: sum(map(len, counts)))
+
+        norms = self._length_norms()
+        scores = None
+        for counts in terms:
+            term = {}
+            for token_counts in counts:
+                df = len(token_counts)
+                weight = math.log((n - df + 0.5) / (df + 0.5) + 1) * (K1 + 1)
+                if scores is not None:
+                    token_counts = {i: token_counts[i] for i in scores if i in token_counts}
+                token_scores = {i: weight * tf / (tf + norms[i]) for i, tf in token_counts.items()}
+                if not term:
+                    term = token_scores
+                    continue
+                for entry_id, score in token_scores.items():
+                    term[entry_id] = term.get(entry_id, 0.0) + score
+            if scores is None:
+                scores = term
+            else:
+                scores = {i: s + term[i] for i, s in scores.items() if i in term}
+            if not scores:
+                break
+        return scores
+
+    def _name(self, facet, doc):
+        entity_id = doc[(CUSTOMER, PROJECT, SERVICE)[FACETS.index(facet)]]
+        return self.names[facet].get(entity_id, str(entity_id) if entity_id is not None else None)
+
+    def search(self, query, since=None, until=None, limit=20, prefix=True, **facets) -> Results:
+        """`Results` for the entries matching `query`.
+
+        `since` and `until` limit the start time of hits. Keyword
+        arguments `customer`, `project` and `service` work like the
+        facet terms in a query. Without any words, the newest matching
+        entries are returned."""
+        words = []
+        facets = {k: v.casefold() for k, v in facets.items() if v is not None}
+        for term in query.split():
+            match = _FACET_TERM.match(term)
+            if match is not None:
+                facets[match.group(1)] = match.group(2).casefold()
+            else:
+                words += tokenize(term)
+        docs = self.docs
+        scores = self._scores(words, prefix) if words else None
+        candidates = scores if scores is not None else docs
+
+        since = since.timestamp() if since is not None else None
+        until = until.timestamp() if until is not None else None
+        # Entity IDs whose names match, per document position
+        allowed = [
+            ((CUSTOMER, PROJECT, SERVICE)[FACETS.index(facet)],
+             {i for i, name in self.names[facet].items() if value in name.casefold()})
+            for facet, value in facets.items()
+        ]
+        if since is not None or until is not None or allowed:
+            candidates = [
+                i for i in candidates
+                if (since is None or docs[i][TIME] >= since)
+                and (until is None or docs[i][TIME] < until)
+                and all(docs[i][position] in ids for position, ids in allowed)
+            ]
+
+        # Two stable sorts by plain keys (best score, then newest) don't
+        # allocate a tuple per candidate, which matters with large indexes
+        ranked = sorted(candidates, key=lambda i: docs[i][TIME], reverse=True)
+        if scores is not None:
+            ranked.sort(key=scores.__getitem__, reverse=True)
+        return Results(
+            [self._hit(i, scores[i] if scores is not None else 0.0) for i in ranked[:limit]],
+            self, ranked
+        )
+
+    def _hit(self, entry_id, score):
+        doc = self.docs[entry_id]
+        return Hit(
+            entry_id, score,
+            datetime.datetime.fromtimestamp(doc[TIME], tz=datetime.timezone.utc),
+            doc[TEXT], *(self._name(facet, doc) for facet in FACETS)
+        )
+
+    def _facet_counts(self, entry_ids):
+        """How many of the entries belong to each customer, project and
+        service, by name."""
+        docs = self.docs
+        counts = {}
+        for facet, position in zip(FACETS, (CUSTOMER, PROJECT, SERVICE)):
+            names = self.names[facet]
+            counts[facet] = collections.Counter()
+            for entity_id, n in collections.Counter(docs[i][position] for i in entry_ids).items():
+                if entity_id is not None:
+                    counts[facet][names.get(entity_id, str(entity_id))] += n
+        return counts
+
+    def suggest(self, text="", limit=10, customers_id=None, projects_id=None, services_id=None):
+        """Descriptions used before that contain the words in `text`.
+
+        Each distinct description is scored by how often and how
+        recently it was used. It counts double for each of customer,
+        project and service it shares with the new entry, and four
+        times if it starts with `text`."""
+        words = tokenize(text)
+        if words:
+            candidates = self._scores(words, True)
+        else:
+            candidates = self.docs
+        wanted = text.casefold().strip()
+        now = max((doc[TIME] for doc in self.docs.values()), default=0)
+        scores = collections.defaultdict(float)
+        for entry_id in candidates:
+            doc = self.docs[entry_id]
+            if not doc[TEXT]:
+                continue
+            weight = 0.5 ** ((now - doc[TIME]) / (86400 * 30))
+            if doc[TEXT].casefold().startswith(wanted):
+                weight *= 4
+            for position, wanted_id in ((CUSTOMER, customers_id), (PROJECT, projects_id), (SERVICE, services_id)):
+                if wanted_id is not None and doc[position] == wanted_id:
+                    weight *= 2
+            scores[doc[TEXT]] += weight
+        return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+    def autocomplete(self, **context):
+        """A readline-style `complete(text, state)` function for prompts,
+        offering `suggest()` results in order."""
+        cache = {}
+
+        def complete(text, state):
+            if text not in cache:
+                cache[text] = self.suggest(text, **context)
+            suggestions = cache[text]
+            return suggestions[state] if state < len(suggestions) else None
+
+        return complete
@@ -16,10 +16,10 @@
 # damage or existence of a defect, except proven that it results out
 # of said person's immediate fault when using the work as intended.
 
-import functools
-from clockodo.api import FromJsonBlob, ClockodoApi
+from clockodo.api import FromJsonBlob, ClockodoApi, cached_entity
 
 class Service(FromJsonBlob):
+    _schema = {"id": None, "name": None, "number": None, "active": None, "note": None}
     def __init__(self, api, name, number=None, active=True, note=None):
         self._api = None
         self.name = name
@@ -35,7 +35,7 @@ class Service(FromJsonBlob):
 
 
 class ServiceApi(ClockodoApi):
-    @functools.lru_cache(maxsize=50)
+    @cached_entity("service")
     def get_service(self, id):
         entry = self._api_call(f"services/{id}")["service"]
         return Service.from_json_blob(self, entry)
@@ -0,0 +1,440 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""Drives many simulated clients against a (fake) clocko:do at once.
+
+    $ python -m clockodo.stress --clients 50 --duration 600 --latency 0.02 --error-rate 0.01
+
+prints throughput, latency percentiles, errors and the process' memory
+every few seconds and per operation at the end. `run()` takes custom
+workloads, to put an integration built on `Clockodo` under load."""
+
+import gc
+import os
+import time
+import random
+import datetime
+import weakref
+import threading
+import collections
+import click
+import clockodo
+from clockodo.api import ClockodoApiError
+from clockodo.entry import ClockEntry
+from clockodo.fake import FakeClockodo
+from clockodo import interactivity
+
+Report = collections.namedtuple("Report", [
+    "elapsed", "ops", "throughput", "p50", "p95", "p99", "error_rate", "rss"
+])
+
+
+def rss() -> int:
+    """Resident memory of this process, in bytes."""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        # Only the peak is available here, in KiB on Linux but bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentile(samples, p):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class _Client:
+    """State a simulated user keeps between operations."""
+    def __init__(self, api, rng):
+        self.api = api
+        self.rng = rng
+        self._customers = None
+        self._services = None
+
+    def task(self):
+        if self._customers is None:
+            # Both or neither, either call may fail
+            services = list(self.api.iter_services())
+            self._customers = list(self.api.iter_customers(active=True))
+            self._services = services
+        return ClockEntry(
+            self.api, self.rng.choice(self._customers), self.rng.choice(self._services),
+            text=f"Stress test task #{self.rng.randrange(1000)}"
+        )
+
+
+def _recent_entries(client, days):
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    return sum(1 for _ in client.api.iter_entries(now - datetime.timedelta(days=days), now))
+
+
+def _entry_details(client):
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    entries = client.api.last_entries(5, now - datetime.timedelta(days=30), now)
+    return [str(e.customer) for e in entries]
+
+
+def _stop(client):
+    clock = client.api.current_clock()
+    if clock is not None:
+        clock.stop()
+
+
+def _edit(client):
+    clock = client.api.current_clock()
+    if clock is not None:
+        client.api.edit_entry(clock, {"text": f"Edited #{client.rng.randrange(1000)}"})
+
+
+# name: (weight, function taking a client); roughly what people using
+# the CLI and an overview dashboard do
+DEFAULT_WORKLOAD = {
+    "current clock": (30, lambda c: c.api.current_clock()),
+    "switch task": (15, lambda c: c.api.switch_clock(c.task())),
+    "stop clock": (5, _stop),
+    "edit clock": (5, _edit),
+    "today's entries": (25, lambda c: _recent_entries(c, 1)),
+    "month of entries": (2, lambda c: _recent_entries(c, 30)),
+    "list projects": (10, lambda c: sum(1 for _ in c.api.iter_projects(active=True))),
+    "entry details": (8, _entry_details),
+}
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        self.total = collections.defaultdict(list)
+        self.errors = collections.defaultdict(collections.Counter)
+
+    def reset(self):
+        self.interval = []
+        self.interval_errors = 0
+
+    def record(self, name, seconds, error=None):
+        with self._lock:
+            self.interval.append(seconds)
+            self.total[name].append(seconds)
+            if error is not None:
+                self.interval_errors += 1
+                self.errors[name][error] += 1
+
+    def take_interval(self):
+        with self._lock:
+            samples, errors = self.interval, self.interval_errors
+            self.reset()
+        return sorted(samples), errors
+
+
+def _error_name(e):
+    if isinstance(e, ClockodoApiError):
+        return f"HTTP {e.status}"
+    return type(e).__name__
+
+
+def run(url, clients=10, duration=30.0, workload=None, think_time=0.0, report_every=10.0,
+        seed=None, on_report=None, **client_kwargs):
+    """Run `clients` simulated users against `url` for `duration` seconds.
+
+    Every client picks operations from `workload` by weight, with an
+    exponentially distributed pause averaging `think_time` seconds in
+    between. `on_report(report)` is called with a `Report` for every
+    `report_every` seconds. Returns `(report, per_operation)`, where
+    `per_operation` maps operation names to `(count, p50, p95, p99,
+    errors)`; the report's `rss` is the growth over the run."""
+    workload = workload if workload is not None else DEFAULT_WORKLOAD
+    names = list(workload)
+    weights = [workload[n][0] for n in names]
+    stats = _Stats()
+    stop = threading.Event()
+    rng = random.Random(seed)
+
+    def simulate(i, client_rng):
+        client = _Client(clockodo.Clockodo(f"user{i}", "stress", base_url=url, **client_kwargs), client_rng)
+        while not stop.is_set():
+            name = client_rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            error = None
+            try:
+                workload[name][1](client)
+            except Exception as e:
+                error = _error_name(e)
+            stats.record(name, time.perf_counter() - start, error)
+            if think_time:
+                stop.wait(client_rng.expovariate(1 / think_time))
+
+    rss_start = rss()
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=simulate, args=(i, random.Random(rng.random())), daemon=True)
+        for i in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    last = started
+    while not stop.is_set():
+        now = time.monotonic()
+        stop.wait(min(report_every, started + duration - now))
+        if time.monotonic() - started >= duration:
+            stop.set()
+        now = time.monotonic()
+        samples, errors = stats.take_interval()
+        if on_report is not None:
+            on_report(Report(
+                now - started, len(samples), len(samples) / (now - last),
+                _percentile(samples, 0.5), _percentile(samples, 0.95), _percentile(samples, 0.99),
+                errors / len(samples) if samples else 0.0, rss()
+            ))
+        last = now
+    for t in threads:
+        t.join()
+
+    elapsed = time.monotonic() - started
+    everything = sorted(s for samples in stats.total.values() for s in samples)
+    errors = sum(sum(c.values()) for c in stats.errors.values())
+    per_operation = {}
+    for name, samples in sorted(stats.total.items()):
+        samples.sort()
+        per_operation[name] = (
+            len(samples), _percentile(samples, 0.5), _percentile(samples, 0.95),
+            _percentile(samples, 0.99), dict(stats.errors[name])
+        )
+    report = Report(
+        elapsed, len(everything), len(everything) / elapsed,
+        _percentile(everything, 0.5), _percentile(everything, 0.95), _percentile(everything, 0.99),
+        errors / len(everything) if everything else 0.0, rss() - rss_start
+    )
+    return report, per_operation
+
+
+def _ids(choices):
+    return [(name, value.id if value is not None else None) for name, value in choices]
+
+
+def _prompt_data(api, customer, entries):
+    # What the interactive prompts and an entry listing fetch, reduced
+    # to plain values that can be compared between clients
+    return (
+        _ids(interactivity.customer_entries({}, api=api)),
+        _ids(interactivity.service_entries({}, api=api)),
+        _ids(interactivity.project_entries({"customer": customer}, api=api)),
+        interactivity.get_last_clock_out_time(api=api),
+        [e.customer.id for e in entries],
+    )
+
+
+def check_shared_client(fake, threads=16, rounds=50, seed=None):
+    """Use one client from `threads` threads at once and compare it with
+    one used from a single thread.
+
+    `fake` is a running `FakeClockodo` with some customers and services
+    that nothing else is using. Every round picks one of five new users
+    and checks that all threads get what the single-threaded client got,
+    with as many requests. Clients are thrown away after every round, so
+    a new client for another user sometimes gets an old one's address,
+    and all of them must have been freed at the end. Returns a list of problems, empty if there were none."""
+    rng = random.Random(seed)
+    since = datetime.datetime.now().astimezone().replace(hour=0, minute=0, second=0, microsecond=0)
+    until = since + datetime.timedelta(days=1)
+    customers, services = list(fake.customers), list(fake.services)
+    # Users of their own, with entries today that end at different times,
+    # so that handing one user's data to another shows
+    users = [f"check{i}" for i in range(5)]
+    for i, user in enumerate(users):
+        for j in range(10):
+            start = since + datetime.timedelta(minutes=i * 10 + j)
+            fake.add_entry(fake.user_id(user), rng.choice(customers), rng.choice(services),
+                           start, start + datetime.timedelta(minutes=1))
+    problems = []
+    clients = []
+    for round in range(rounds):
+        user = rng.choice(users)
+        reference = clockodo.Clockodo(user, "stress", base_url=fake.url)
+        entries = list(reference.last_entries(20, since, until))
+        customer = rng.choice(list(reference.iter_customers(active=True)))
+        before = fake.requests
+        expected = _prompt_data(reference, customer, entries)
+        expected_requests = fake.requests - before
+
+        api = clockodo.Clockodo(user, "stress", base_url=fake.url)
+        clients += [weakref.ref(reference), weakref.ref(api)]
+        entries = list(api.last_entries(20, since, until))
+        barrier = threading.Barrier(threads)
+        results = [None] * threads
+
+        def use(i):
+            barrier.wait()
+            try:
+                results[i] = _prompt_data(api, customer, entries)
+            except Exception as e:
+                results[i] = e
+
+        before = fake.requests
+        workers = [threading.Thread(target=use, args=(i,)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        requests = fake.requests - before
+        wrong = sum(1 for r in results if r != expected)
+        if wrong:
+            problems.append(f"round {round} ({user}): {wrong} of {threads} threads got different data")
+        if requests != expected_requests:
+            problems.append(
+                f"round {round} ({user}): {requests} requests from {threads} threads, "
+                f"{expected_requests} from one"
+            )
+        # Entities and clients reference each other, collect them now
+        # so that the next clients get their addresses. `use` holds on
+        # to them as well, and is replaced in the next round.
+        del reference, use
+        api = entries = customer = None
+        gc.collect()
+    leaked = sum(1 for client in clients if client() is not None)
+    if leaked:
+        problems.append(f"{leaked} of {len(clients)} clients were never freed")
+    return problems
+
+
+def check_scaling(fake, threads=16, duration=1.0, latency=0.05, efficiency=0.7):
+    """Measure how the throughput of one shared client grows with the
+    number of threads using it.
+
+    While a request waits `latency` seconds for the server, other
+    threads should be able to make theirs, so with 1, 2, 4, ... up to
+    `threads` threads every thread should get about as many requests
+    done as a single one. Each count runs for `duration` seconds against
+    `fake`, whose latency is changed for the time being. Returns
+    `(throughput, problems)`, with `throughput` mapping thread counts to
+    requests per second and a problem for each count that got less than
+    `efficiency` of linear scaling."""
+    counts = []
+    n = 1
+    while n < threads:
+        counts.append(n)
+        n *= 2
+    counts.append(threads)
+    throughput = {}
+    problems = []
+    saved = fake.latency
+    fake.latency = latency
+    try:
+        api = clockodo.Clockodo("scaling", "stress", base_url=fake.url)
+        api.current_clock()
+        for n in counts:
+            barrier = threading.Barrier(n + 1)
+            done = [0] * n
+
+            def use(i):
+                barrier.wait()
+                while time.monotonic() < deadline:
+                    api.current_clock()
+                    done[i] += 1
+
+            workers = [threading.Thread(target=use, args=(i,)) for i in range(n)]
+            deadline = float("inf")
+            for t in workers:
+                t.start()
+            started = time.monotonic()
+            deadline = started + duration
+            barrier.wait()
+            for t in workers:
+                t.join()
+            throughput[n] = sum(done) / (time.monotonic() - started)
+        single = throughput[1]
+        for n in counts[1:]:
+            if throughput[n] < efficiency * n * single:
+                problems.append(
+                    f"{n} threads: {throughput[n]:.1f} requests/s, "
+                    f"{throughput[n] / single:.1f} times as many as one thread"
+                )
+        api.close()
+    finally:
+        fake.latency = saved
+    return throughput, problems
+
+
+def format_report(report):
+    return (
+        f"{report.elapsed:7.1f}s {report.ops:7d} ops {report.throughput:8.1f}/s  "
+        f"p50 {report.p50 * 1000:7.1f}ms  p95 {report.p95 * 1000:7.1f}ms  p99 {report.p99 * 1000:7.1f}ms  "
+        f"errors {report.error_rate:6.2%}  rss {report.rss / 2 ** 20:7.1f}MiB"
+    )
+
+
+@click.command()
+@click.option("--clients", default=10)
+@click.option("--duration", default=30.0, help="Seconds to run for")
+@click.option("--think-time", default=0.0, help="Average pause between a client's operations")
+@click.option("--report-every", default=5.0)
+@click.option("--url", default=None, help="Use this server (e.g. `python -m clockodo.fake`) instead of an in-process one")
+@click.option("--entries", default=5000, help="Entries in the in-process fake")
+@click.option("--latency", default=0.0, help="Fake server delay per request")
+@click.option("--jitter", default=0.0, help="Random extra fake server delay, up to this much")
+@click.option("--error-rate", default=0.0, help="Fraction of fake server requests failing with 503")
+@click.option("--rate-limit", default=None, type=float, help="Fake server requests per second per user")
+@click.option("--seed", default=None, type=int)
+@click.option("--check", is_flag=True,
+              help="Instead of measuring, check that one client shared by --clients threads behaves and scales")
+def main(clients, duration, think_time, report_every, url, entries, latency, jitter, error_rate,
+         rate_limit, seed, check):
+    def report(r):
+        click.echo(format_report(r))
+
+    def go(url):
+        total, per_operation = run(
+            url, clients=clients, duration=duration, think_time=think_time,
+            report_every=report_every, seed=seed, on_report=report
+        )
+        click.echo("total   " + format_report(total).replace("rss", "rss growth"))
+        for name, (count, p50, p95, p99, errors) in per_operation.items():
+            errors = ", ".join(f"{k}: {v}" for k, v in errors.items())
+            click.echo(
+                f"  {name:18} {count:7d}  p50 {p50 * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  "
+                f"p99 {p99 * 1000:7.1f}ms  {errors}"
+            )
+
+    if check:
+        # Needs the request count, so always in-process and without errors
+        fake = FakeClockodo(latency=latency, jitter=jitter, seed=seed)
+        fake.populate(entries=entries, users=5)
+        with fake:
+            problems = check_shared_client(fake, threads=clients, seed=seed)
+            throughput, slow = check_scaling(fake, threads=clients, latency=max(latency, 0.05))
+        for n, rate in throughput.items():
+            click.echo(f"{n:3d} threads {rate:8.1f} requests/s")
+        problems += slow
+        for problem in problems:
+            click.echo(problem)
+        click.echo(f"{len(problems)} problems")
+        raise SystemExit(1 if problems else 0)
+    if url is not None:
+        go(url)
+        return
+    fake = FakeClockodo(latency=latency, jitter=jitter, error_rate=error_rate,
+                        rate_limit=rate_limit, seed=seed)
+    fake.populate(entries=entries, users=clients)
+    with fake:
+        go(fake.url)
+
+
+if __name__ == "__main__":
+    main()
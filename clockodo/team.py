@@ -0,0 +1,138 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import datetime
+import threading
+import concurrent.futures
+from collections import namedtuple
+from clockodo.entry import ClockEntry
+from clockodo.timeline import Timeline, UserTotals, merge_sorted
+
+Presence = namedtuple("Presence", ["user", "clock"])
+
+
+class Team:
+    """Queries over all users of an account.
+
+    Per-user queries run concurrently, but all queries of one `Team`
+    share `max_concurrency` worker threads, so no more requests than
+    that are in flight however many people there are. The users
+    directory is fetched once and kept until `refresh()`; by default
+    it only has `active` users, except for summaries."""
+    def __init__(self, api, max_concurrency=16, active=True):
+        self.api = api
+        self.active = active
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_concurrency, thread_name_prefix="clockodo-team"
+        )
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def users(self, include_inactive=False) -> list:
+        active = None if include_inactive else self.active
+        with self._lock:
+            if active not in self._users:
+                self._users[active] = list(self.api.iter_users(active=active))
+            return self._users[active]
+
+    def refresh(self):
+        with self._lock:
+            self._users = {}
+
+    def fan_out(self, fun, users=None):
+        """Call `fun(user)` for every user concurrently, yielding
+        `(user, result)` as they finish. If a call fails, the ones that
+        haven't started yet are cancelled and the error is raised."""
+        users = users if users is not None else self.users()
+        futures = {self._executor.submit(fun, user): user for user in users}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def iter_entries(self, time_since: datetime.datetime,
+                     time_until: datetime.datetime,
+                     users=None,
+                     filters={}):
+        """All entries of `users` (by default, everyone) in the range,
+        fetched per user concurrently and merged by `time_since`."""
+        def fetch(user):
+            return sorted(
+                self.api.iter_entries(time_since, time_until, filters=dict(filters, user=user)),
+                key=lambda e: e.time_since
+            )
+
+        return merge_sorted(*(entries for _, entries in self.fan_out(fetch, users)))
+
+    def presence(self) -> list:
+        """A `Presence` for every user, with the clock they're running
+        (or None), sorted by name.
+
+        clocko:do only tells the API user their own running clock, so
+        this asks for everyone's entries at this moment instead: one
+        request, not one per user."""
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        running = {}
+        for entry in self.api.iter_entries(now - datetime.timedelta(seconds=1), now):
+            if isinstance(entry, ClockEntry) and entry.time_until is None:
+                running[entry.users_id] = entry
+        return sorted(
+            (Presence(user, running.get(user.id)) for user in self.users()),
+            key=lambda p: p.user.name.casefold()
+        )
+
+    def summary(self, time_since: datetime.datetime, time_until: datetime.datetime, users=None) -> dict:
+        """`timeline.UserTotals` (work, breaks, overlaps) for every user
+        in the range, computed per user concurrently.
+
+        By default that is everyone who is active, plus inactive users
+        with entries in the range, e.g. someone deactivated mid-week."""
+        def totals(user):
+            timeline = Timeline()
+            for _ in timeline.sweep(self.api.iter_entries(time_since, time_until, filters={"user": user})):
+                pass
+            return timeline.totals.get(user.id, UserTotals())
+
+        if users is not None:
+            return dict(self.fan_out(totals, users))
+        active = {user.id for user in self.users()}
+        return {
+            user: result for user, result in self.fan_out(totals, self.users(include_inactive=True))
+            if user.id in active or result.entries
+        }
+
+    def weekly_summary(self, week_start: datetime.date = None, users=None) -> dict:
+        """`summary()` for the week (Monday to Monday, local time)
+        starting at `week_start`, by default the current one."""
+        if week_start is None:
+            today = datetime.date.today()
+            week_start = today - datetime.timedelta(days=today.weekday())
+        since = datetime.datetime.combine(week_start, datetime.time(0)).astimezone()
+        until = datetime.datetime.combine(week_start + datetime.timedelta(days=7), datetime.time(0)).astimezone()
+        return self.summary(since, until, users)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,151 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import heapq
+import datetime
+import itertools
+from collections import namedtuple
+from clockodo.entry import ClockEntry
+
+Gap = namedtuple("Gap", ["users_id", "before", "after", "duration"])
+Overlap = namedtuple("Overlap", ["users_id", "first", "second", "duration"])
+
+
+class UserTotals:
+    def __init__(self):
+        self.work = datetime.timedelta(0)
+        self.entries = 0
+        self.break_count = 0
+        self.breaks = datetime.timedelta(0)
+        self.overlap_count = 0
+        self.overlaps = datetime.timedelta(0)
+
+
+class _UserState:
+    def __init__(self):
+        # Min-heap of (end, seq, entry) for entries that are still
+        # "open" at the current sweep position
+        self.active = []
+        self.last_end = None
+        self.last_entry = None
+
+
+class Timeline:
+    """Sweep-line over a stream of entries.
+
+    Entries are processed in order of `time_since`, keeping a heap of
+    the entries that are still running at the sweep position for every
+    user. That makes finding every gap and every pair of overlapping
+    entries O(n log n + k) for n entries and k overlaps.
+
+    Running clocks are treated as ending at `now`. Entries without a
+    time span (lump sums) are passed through without affecting gaps
+    and overlaps."""
+    def __init__(self, now=None):
+        if now is None:
+            now = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.now = now
+        self.totals = {}
+        self._users = {}
+        self._seq = itertools.count()
+
+    def _end(self, entry):
+        return entry.time_until if entry.time_until is not None else self.now
+
+    def feed(self, entry) -> list:
+        """Add one entry. Entries must be fed sorted by `time_since`.
+
+        Returns the gaps and overlaps found between this entry and the
+        entries fed before it."""
+        users_id = getattr(entry, "users_id", None)
+        totals = self.totals.setdefault(users_id, UserTotals())
+        if not isinstance(entry, ClockEntry) or entry.time_since is None:
+            return []
+        state = self._users.setdefault(users_id, _UserState())
+        start, end = entry.time_since, self._end(entry)
+
+        totals.entries += 1
+        if getattr(entry, "duration", None) is not None:
+            totals.work += datetime.timedelta(seconds=entry.duration)
+        else:
+            totals.work += end - start
+
+        events = []
+        while state.active and state.active[0][0] <= start:
+            heapq.heappop(state.active)
+        if state.active:
+            for other_end, _, other in sorted(state.active, key=lambda a: a[2].time_since):
+                duration = min(end, other_end) - start
+                events.append(Overlap(users_id, other, entry, duration))
+                totals.overlap_count += 1
+                totals.overlaps += duration
+        elif state.last_end is not None and start > state.last_end:
+            duration = start - state.last_end
+            events.append(Gap(users_id, state.last_entry, entry, duration))
+            totals.break_count += 1
+            totals.breaks += duration
+
+        heapq.heappush(state.active, (end, next(self._seq), entry))
+        if state.last_end is None or end >= state.last_end:
+            state.last_end = end
+            state.last_entry = entry
+
+        return events
+
+    def sweep(self, entries, assume_sorted=False):
+        """Feed all `entries`, yielding every entry preceded by the gaps
+        and overlaps it introduces.
+
+        Unless `assume_sorted` is set, the entries are sorted first,
+        which requires holding all of them in memory."""
+        if not assume_sorted:
+            entries = sorted(entries, key=lambda e: e.time_since)
+        for entry in entries:
+            yield from self.feed(entry)
+            yield entry
+
+
+def merge_sorted(*streams):
+    """Merge several streams that are each sorted by `time_since`."""
+    return heapq.merge(*streams, key=lambda e: e.time_since)
+
+
+def iter_sorted_shards(api, time_since: datetime.datetime,
+                       time_until: datetime.datetime,
+                       shard=datetime.timedelta(days=7),
+                       filters={}):
+    """Iterate entries sorted by `time_since` in bounded memory.
+
+    The range is fetched in windows of `shard` length. Each window is
+    sorted on its own. clocko:do also returns entries that merely
+    overlap a window, so after the first window, entries that started
+    before it are skipped: they were yielded by the window they started
+    in, however many windows they span."""
+    seen = set()
+    window_since = time_since
+    while window_since < time_until:
+        window_until = min(window_since + shard, time_until)
+        window = sorted(
+            (e for e in api.iter_entries(window_since, window_until, filters=filters)
+             if e.id not in seen and (window_since == time_since or e.time_since >= window_since)),
+            key=lambda e: e.time_since
+        )
+        # An entry starting right at the boundary may come with both windows
+        seen = {e.id for e in window}
+        yield from window
+        window_since = window_until
@@ -0,0 +1,130 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""Records where time goes, as a timeline for chrome://tracing or
+https://ui.perfetto.dev.
+
+    with clockodo.trace.tracing("trace.json"):
+        for entry in api.iter_entries(since, until):
+            ...
+
+Spans are recorded from all threads while tracing is on. When it is
+off, `span()` costs a function call and a global lookup."""
+
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+
+# Everything imported before this is not seen by `--trace`
+IMPORTED_AT = time.perf_counter()
+
+_active = None
+_null = contextlib.nullcontext()
+
+
+class Tracer:
+    """Collects spans as Chrome trace events."""
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def add(self, name, cat, start, end, args=None):
+        event = {
+            "name": name, "cat": cat, "ph": "X",
+            "ts": start * 1e6, "dur": (end - start) * 1e6,
+            "pid": self._pid, "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, cat, args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, cat, start, time.perf_counter(), args)
+
+    def write(self, fp):
+        with self._lock:
+            events = list(self.events)
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid in {e["tid"] for e in events}:
+            if tid in names:
+                events.append({
+                    "name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid,
+                    "args": {"name": names[tid]},
+                })
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+
+def span(name, cat="clockodo", **args):
+    """A context manager timing the code inside it.
+
+    It yields the `args` dict (or None if tracing is off), which can
+    be filled with more details, like a status code, before the span
+    ends."""
+    tracer = _active
+    if tracer is None:
+        return _null
+    return tracer.span(name, cat, args)
+
+
+def traced(name=None, cat="clockodo"):
+    """Decorator putting every call of a function in a span."""
+    def decorator(fun):
+        span_name = name if name is not None else fun.__qualname__
+
+        @functools.wraps(fun)
+        def _inner(*args, **kwargs):
+            with span(span_name, cat):
+                return fun(*args, **kwargs)
+
+        return _inner
+
+    return decorator
+
+
+def enabled():
+    return _active is not None
+
+
+@contextlib.contextmanager
+def tracing(path=None):
+    """Trace everything inside the block and write the timeline to
+    `path` (a file name or file object) afterwards. Yields the
+    `Tracer`."""
+    global _active
+    tracer = Tracer()
+    outer, _active = _active, tracer
+    try:
+        yield tracer
+    finally:
+        _active = outer
+        if path is not None:
+            if hasattr(path, "write"):
+                tracer.write(path)
+            else:
+                with open(path, "w") as fp:
+                    tracer.write(fp)
@@ -0,0 +1,64 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+from clockodo.api import FromJsonBlob, ClockodoApi, cached_entity
+from clockodo.paging import Paginator
+
+class User(FromJsonBlob):
+    _schema = {
+        "id": None, "name": None, "number": None, "email": None,
+        "role": None, "active": None, "teams_id": None,
+    }
+    _optional_fields = ["number", "email", "role", "teams_id"]
+
+    def __str__(self):
+        active = ""
+        if not self.active:
+            active = ", inactive"
+        return f"{self.name} (user ID {self.id}{active})"
+
+
+class UserApi(ClockodoApi):
+    @cached_entity("user")
+    def get_user(self, id):
+        entry = self._api_call(f"v2/users/{id}")["user"]
+        return User.from_json_blob(self, entry)
+
+    def _decode_user(self, blob):
+        user = User.from_json_blob(self, blob)
+        # Listing all users is how a team directory is built, so make
+        # later `get_user()` calls free
+        self._cache.put(("user", user.id), user)
+        return user
+
+    def list_users(self, active=None, page=None):
+        params = {
+            "page": page
+        }
+        if active is not None:
+            params["filter[active]"] = str(int(active))
+        response = self._api_call("v2/users", params=params)
+        response["users"] = list(map(self._decode_user, response["users"]))
+
+        return response
+
+    def iter_users(self, active=None, checkpoint=None):
+        params = {}
+        if active is not None:
+            params["filter[active]"] = str(int(active))
+        return Paginator(self, "v2/users", "users", self._decode_user, params, checkpoint=checkpoint)
@@ -0,0 +1,338 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+"""A local write-ahead queue for clock operations.
+
+Starting, stopping and editing the clock is recorded on disk with the
+time it happened and can be confirmed right away; `flush()` sends the
+operations to clocko:do later, in order. An operation is refused as a
+conflict if the clock was changed elsewhere in the meantime, which is
+noticed through `time_last_change`."""
+
+import os
+import json
+import fcntl
+import datetime
+import contextlib
+from clockodo import resilience
+from clockodo.api import ClockodoError, ClockodoApiError, ClockodoTimeout, ClockodoUnavailable
+from clockodo.entry import BaseEntry, ClockEntry, iso8601, ISO8601_TIME_FORMAT
+
+
+def state_dir():
+    """`$XDG_STATE_HOME/clockodo`, created if missing."""
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    path = os.path.join(base, "clockodo")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _now():
+    return datetime.datetime.now(tz=datetime.timezone.utc)
+
+
+def _jsonable(value):
+    if isinstance(value, datetime.datetime):
+        return iso8601(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class Conflict(ClockodoError):
+    pass
+
+
+class WriteAheadLog:
+    """Operations waiting to be sent, kept as JSON lines in `directory`.
+
+    Every operation is a dict with a `seq` number, the `op` (`start`,
+    `stop` or `edit`), the time `at` which it happened and its `target`:
+    an entry ID, `"seq:<n>"` for a clock started by an earlier queued
+    operation, or None for whichever clock is running. `expect` holds
+    the `id` and `time_last_change` the clock was last seen with.
+
+    Appending only takes a short lock on the log, so it never waits for
+    a flush that is talking to the network. When nothing is queued,
+    operations on the running clock look it up first if they are given
+    an API client, giving up after `refresh_timeout` seconds."""
+    def __init__(self, directory=None, refresh_timeout=2.0):
+        self.directory = directory if directory is not None else state_dir()
+        self.refresh_timeout = refresh_timeout
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, "queue.jsonl")
+        self.conflicts_path = os.path.join(self.directory, "conflicts.jsonl")
+        self.clock_path = os.path.join(self.directory, "clock.json")
+
+    @contextlib.contextmanager
+    def _lock(self, name):
+        with open(os.path.join(self.directory, name), "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                return [json.loads(line) for line in fp if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _write(self, ops):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fp:
+            for op in ops:
+                fp.write(json.dumps(op) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self.path)
+
+    def pending(self) -> list:
+        with self._lock("queue.lock"):
+            return self._read()
+
+    def conflicts(self) -> list:
+        try:
+            with open(self.conflicts_path) as fp:
+                return [json.loads(line) for line in fp if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def known_clock(self):
+        """`{"id": ..., "time_last_change": ...}` of the running clock as
+        last seen, or None if none was running."""
+        try:
+            with open(self.clock_path) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return None
+
+    def remember(self, clock):
+        """Note which clock is running (None for none), to detect
+        changes made elsewhere before queued operations are sent."""
+        known = None
+        if clock is not None:
+            known = {"id": clock.id, "time_last_change": clock.time_last_change}
+        tmp = self.clock_path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(known, fp)
+        os.replace(tmp, self.clock_path)
+
+    def _refresh(self, api):
+        """Remember the clock that is running now. Returns False if
+        clocko:do couldn't tell, then the last known clock stays."""
+        try:
+            with resilience.deadline(self.refresh_timeout):
+                self.remember(api.current_clock())
+        except ClockodoError:
+            return False
+        return True
+
+    def _append(self, op, target=None, params=None, at=None, expect=None, api=None):
+        refreshed = False
+        if api is not None and target is None and op != "start" and not self.pending():
+            # The last seen clock is stale if it was changed without the
+            # queue, e.g. in the web interface. Not under the lock, this
+            # may take a while.
+            refreshed = self._refresh(api)
+        with self._lock("queue.lock"):
+            ops = self._read()
+            record = {
+                "seq": max((o["seq"] for o in ops), default=0) + 1,
+                "op": op,
+                "at": iso8601(at if at is not None else _now()),
+                "target": target,
+                "expect": expect,
+                "params": params or {},
+            }
+            if record["target"] is None and op != "start":
+                # Refer to a clock started in the queue rather than to
+                # whatever will be running when this is sent
+                for o in reversed(ops):
+                    if o["op"] == "start":
+                        record["target"] = f"seq:{o['seq']}"
+                        break
+                    if o["op"] == "stop" and (o["target"] is None or str(o["target"]).startswith("seq:")):
+                        raise ClockodoError("no clock is running after the queued operations")
+                else:
+                    record["expect"] = self.known_clock()
+                    if refreshed and record["expect"] is None:
+                        raise ClockodoError("no clock is running")
+            with open(self.path, "a") as fp:
+                fp.write(json.dumps(record) + "\n")
+                fp.flush()
+                os.fsync(fp.fileno())
+            return record
+
+    def start(self, customers_id, services_id, text=None, projects_id=None,
+              billable=None, texts_id=None, time_since=None):
+        """Queue starting a clock, at `time_since` or now."""
+        params = {
+            "customers_id": customers_id,
+            "projects_id": projects_id,
+            "services_id": services_id,
+            "text": text,
+            "texts_id": texts_id,
+            "billable": _jsonable(billable),
+        }
+        return self._append("start", params=params, at=time_since)
+
+    def stop(self, clock=None, at=None, api=None):
+        """Queue stopping `clock` (an entry or ID), or the running one."""
+        target = getattr(clock, "id", clock)
+        expect = None
+        if isinstance(clock, ClockEntry):
+            expect = {"id": clock.id, "time_last_change": clock.time_last_change}
+        return self._append("stop", target=target, at=at, expect=expect, api=api)
+
+    def edit(self, clock, edit: dict, api=None):
+        """Queue an edit of `clock` (an entry or ID), or the running one."""
+        target = getattr(clock, "id", clock)
+        expect = None
+        if isinstance(clock, ClockEntry):
+            expect = {"id": clock.id, "time_last_change": clock.time_last_change}
+        params = {k: _jsonable(getattr(v, "id", v)) for k, v in edit.items()}
+        return self._append("edit", target=target, params=params, expect=expect, api=api)
+
+    def _resolve(self, api, op):
+        """Returns the entry `op` applies to, or raises `Conflict`."""
+        if str(op["target"]).startswith("seq:"):
+            raise Conflict("the clock this refers to couldn't be started")
+        if op["target"] is None:
+            entry = api.current_clock()
+            if entry is None:
+                raise Conflict("no clock is running")
+        else:
+            entry = api.get_entry(op["target"])
+        expect = op["expect"]
+        if expect is not None and (entry.id != expect["id"]
+                                   or entry.time_last_change != expect["time_last_change"]):
+            raise Conflict(f"entry {entry.id} was changed at {entry.time_last_change}")
+        return entry
+
+    def _apply(self, api, op):
+        """Send one operation. Returns the entry it produced, if any."""
+        at = datetime.datetime.strptime(op["at"], ISO8601_TIME_FORMAT)
+        if op["op"] == "start":
+            params = dict(op["params"], time_since=op["at"])
+            if params["billable"] is not None:
+                params["billable"] = str(params["billable"])
+            if op.get("attempted"):
+                # We may have crashed right after starting it last time
+                current = api.current_clock()
+                if current is not None and current.time_since == at:
+                    return current
+            response = api._api_call("v2/clock", method="POST", params=params)
+            if response.get("stopped") is not None:
+                # clocko:do stopped whatever clock was running when this
+                # was sent, make it end when the new one started
+                stopped = BaseEntry.from_json_blob(api, response["stopped"])
+                if stopped.time_until != at:
+                    stopped = api.edit_entry(stopped.id, {"time_until": at})
+                self._changed(stopped)
+            return ClockEntry.from_json_blob(api, response["running"])
+        entry = self._resolve(api, op)
+        if op["op"] == "stop":
+            if entry.time_until is None:
+                api.stop_clock(entry)
+            elif not op.get("attempted"):
+                raise Conflict(f"entry {entry.id} was already stopped at {entry.time_until}")
+            # clocko:do stops the clock when it gets the request, move
+            # the end back to when it was actually stopped
+            return api.edit_entry(entry.id, {"time_until": at})
+        elif op["op"] == "edit":
+            return api.edit_entry(entry.id, op["params"])
+        raise ClockodoError(f"unknown queued operation {op['op']}")
+
+    @staticmethod
+    def _expect_change(ops, entry):
+        # Our own changes shouldn't look like conflicts
+        for o in ops:
+            if o["expect"] is not None and o["expect"]["id"] == entry.id:
+                o["expect"]["time_last_change"] = entry.time_last_change
+
+    def _changed(self, entry):
+        """Let later operations expect `entry` as it is now."""
+        with self._lock("queue.lock"):
+            ops = self._read()
+            self._expect_change(ops, entry)
+            self._write(ops)
+
+    def _finish(self, op, entry):
+        """Drop `op` from the log and point later operations on the
+        clock it started to the real entry."""
+        with self._lock("queue.lock"):
+            ops = [o for o in self._read() if o["seq"] != op["seq"]]
+            if entry is not None:
+                for o in ops:
+                    if o["target"] == f"seq:{op['seq']}":
+                        o["target"] = entry.id
+                self._expect_change(ops, entry)
+            self._write(ops)
+
+    def _mark_attempted(self, op):
+        with self._lock("queue.lock"):
+            ops = self._read()
+            for o in ops:
+                if o["seq"] == op["seq"]:
+                    o["attempted"] = True
+            self._write(ops)
+
+    def flush(self, api):
+        """Send queued operations in order until the log is empty or
+        clocko:do can't be reached.
+
+        Operations that conflict are moved to `conflicts()` and the
+        rest continues. Returns `(sent, conflicts)` counts."""
+        sent = conflicts = 0
+        with self._lock("flush.lock"):
+            while True:
+                ops = self.pending()
+                if not ops:
+                    break
+                op = ops[0]
+                self._mark_attempted(op)
+                try:
+                    entry = self._apply(api, op)
+                except (ClockodoTimeout, ClockodoUnavailable):
+                    break
+                except ClockodoApiError as e:
+                    # Worth retrying later, not a problem with the operation
+                    if e.status >= 500 or e.status in (401, 403, 429):
+                        break
+                    entry, error = None, str(e)
+                except ClockodoError as e:
+                    # A Conflict, or refused before asking clocko:do
+                    # (e.g. stopping a stopped clock), retrying won't help
+                    entry, error = None, e.msg
+                else:
+                    error = None
+                if error is not None:
+                    with open(self.conflicts_path, "a") as fp:
+                        fp.write(json.dumps(dict(op, error=error)) + "\n")
+                    conflicts += 1
+                else:
+                    sent += 1
+                    if op["op"] == "start" or (entry is not None and entry.time_until is None):
+                        self.remember(entry)
+                    elif op["op"] == "stop":
+                        self.remember(None)
+                self._finish(op, entry)
+        return sent, conflicts
@@ -0,0 +1,189 @@
+# Copyright © 2022 nyantec GmbH <oss@nyantec.com>
+# Written by Vika Shleina <vsh@nyantec.com>
+#
+# Provided that these terms and disclaimer and all copyright notices
+# are retained or reproduced in an accompanying document, permission
+# is granted to deal in this work without restriction, including un‐
+# limited rights to use, publicly perform, distribute, sell, modify,
+# merge, give away, or sublicence.
+#
+# This work is provided "AS IS" and WITHOUT WARRANTY of any kind, to
+# the utmost extent permitted by applicable law, neither express nor
+# implied; without malicious intent or gross negligence. In no event
+# may a licensor, author or contributor be held liable for indirect,
+# direct, other damage, loss, or other issues arising in any way out
+# of dealing in the work, even if advised of the possibility of such
+# damage or existence of a defect, except proven that it results out
+# of said person's immediate fault when using the work as intended.
+
+import logging
+import datetime
+import threading
+from collections import namedtuple
+from clockodo.api import ClockodoApi
+
+ClockStarted = namedtuple("ClockStarted", ["clock"])
+ClockStopped = namedtuple("ClockStopped", ["clock"])
+ClockEdited = namedtuple("ClockEdited", ["clock", "previous"])
+EntryAdded = namedtuple("EntryAdded", ["entry"])
+EntryChanged = namedtuple("EntryChanged", ["entry", "previous"])
+EntryRemoved = namedtuple("EntryRemoved", ["entry"])
+
+log = logging.getLogger(__name__)
+
+
+def _changed(old, new):
+    return old.time_last_change != new.time_last_change
+
+
+class Watcher:
+    """Polls the running clock and recent entries and reports changes.
+
+    Every poll costs two requests: the running clock, and the entries
+    of the last `window`. Both are compared with the previous poll by
+    `id` and `time_last_change`, and the differences are sent to every
+    subscriber as `ClockStarted`, `EntryChanged` etc. events.
+
+    The interval drops to `min_interval` whenever something changed
+    and grows towards `max_interval` while nothing does. A single
+    watcher can serve any number of subscribers, so API load doesn't
+    grow with them."""
+    def __init__(self, api, window=datetime.timedelta(days=1),
+                 min_interval=5.0, max_interval=120.0, backoff=1.5, filters={}):
+        self._api = api
+        self.window = window
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.filters = filters
+        self.interval = min_interval
+        self.last_error = None
+
+        self._clock = None
+        self._entries = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def subscribe(self, callback):
+        """Call `callback(event)` for every event. Returns a function
+        that removes the subscription again."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def _diff_clock(self, old, new):
+        if old is None and new is not None:
+            return [ClockStarted(new)]
+        if old is not None and new is None:
+            return [ClockStopped(old)]
+        if old is not None and new is not None:
+            if old.id != new.id:
+                return [ClockStopped(old), ClockStarted(new)]
+            if _changed(old, new):
+                return [ClockEdited(new, old)]
+        return []
+
+    def _diff_entries(self, old, new, window_start):
+        events = []
+        for id, entry in new.items():
+            if id not in old:
+                events.append(EntryAdded(entry))
+            elif _changed(old[id], entry):
+                events.append(EntryChanged(entry, old[id]))
+        for id, entry in old.items():
+            # Entries that merely slid out of the window weren't removed
+            if id not in new and entry.time_since >= window_start:
+                events.append(EntryRemoved(entry))
+        return events
+
+    def poll(self) -> list:
+        """Poll once, notify subscribers and return the events.
+
+        The first poll only records the current state."""
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        window_start = now - self.window
+        clock = self._api.current_clock()
+        entries = {
+            e.id: e for e in self._api.iter_entries(
+                window_start, now + datetime.timedelta(minutes=1), filters=self.filters
+            )
+        }
+
+        events = []
+        if self._entries is not None:
+            events = self._diff_clock(self._clock, clock) \
+                + self._diff_entries(self._entries, entries, window_start)
+        self._clock = clock
+        self._entries = entries
+
+        if events:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for event in events:
+            for callback in subscribers:
+                # A failing subscriber is its own problem: the others
+                # still get the event, and polling goes on as usual
+                try:
+                    callback(event)
+                except Exception:
+                    log.exception("watch subscriber %r failed on %r", callback, event)
+
+        return events
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                self.interval = self.max_interval
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start polling on a background thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def events(self):
+        """Async iterator over events. Starts polling if necessary."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        unsubscribe = self.subscribe(lambda e: loop.call_soon_threadsafe(queue.put_nowait, e))
+        self.start()
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            unsubscribe()
+
+
+class WatchApi(ClockodoApi):
+    def watch(self, **kwargs) -> Watcher:
+        """Get the watcher of this client, creating it on first use.
+
+        Arguments are only used when the watcher is created."""
+        if getattr(self, "_watcher", None) is None:
+            self._watcher = Watcher(self, **kwargs)
+        return self._watcher